@@ -0,0 +1,152 @@
+# app/assign.py
+"""Workload-balanced auto-assignment of unassigned NEW tasks."""
+from __future__ import annotations
+
+import heapq
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from sqlalchemy import func, insert, select, update
+from sqlalchemy.orm import Session
+
+from .cache import invalidate_task
+from .ingest import CHUNK, _chunks
+from .models import Role, Task, TaskEvent, TaskEventType, TaskStatus, User
+
+# Statuses that count as a teacher's open workload
+OPEN_STATUSES = (TaskStatus.ASSIGNED, TaskStatus.ACCEPTED)
+
+# A teacher who already visited the student is preferred while their load is
+# at most this many tasks above the current minimum
+PREFER_SLACK = 2
+
+
+def auto_assign(
+    db: Session,
+    actor: User,
+    user_ids: Optional[List[int]] = None,
+    prefer_previous: bool = True,
+    max_per_user: Optional[int] = None,
+) -> Dict[str, object]:
+    """Spread all unassigned NEW tasks over eligible teachers, least loaded first.
+
+    Reads are three queries (unassigned tasks, teachers, grouped open load)
+    plus one grouped history query when prefer_previous is set. Writes are
+    one UPDATE ... RETURNING per teacher chunk and one bulk event insert, all
+    in one transaction. The UPDATE re-checks "still NEW and unassigned", so
+    tasks grabbed by someone else in the meantime are skipped, not overwritten.
+    """
+    tasks = db.execute(
+        select(Task.id, Task.student_id)
+        .where(
+            Task.status == TaskStatus.NEW,
+            Task.assignee_user_id.is_(None),
+            Task.deleted_at.is_(None),
+        )
+        .order_by(Task.due_at.is_(None), Task.due_at, Task.id)
+    ).all()
+
+    q = select(User.id).where(User.role == Role.USER)
+    if user_ids:
+        q = q.where(User.id.in_(user_ids))
+    teachers = list(db.scalars(q.order_by(User.id)))
+    if not teachers:
+        return {"assigned": 0, "skipped": len(tasks), "per_user": {}}
+
+    load: Dict[int, int] = {uid: 0 for uid in teachers}
+    for uid, n in db.execute(
+        select(Task.assignee_user_id, func.count())
+        .where(
+            Task.assignee_user_id.in_(teachers),
+            Task.status.in_(OPEN_STATUSES),
+            Task.deleted_at.is_(None),
+        )
+        .group_by(Task.assignee_user_id)
+    ):
+        load[uid] = n
+
+    # student -> teacher with most completed visits
+    previous: Dict[int, int] = {}
+    if prefer_previous and tasks:
+        best: Dict[int, int] = {}
+        for sid, uid, n in db.execute(
+            select(Task.student_id, Task.assignee_user_id, func.count())
+            .where(Task.status == TaskStatus.DONE, Task.assignee_user_id.in_(teachers))
+            .group_by(Task.student_id, Task.assignee_user_id)
+        ):
+            if n > best.get(sid, 0):
+                best[sid], previous[sid] = n, uid
+
+    # Min-heap of (load, teacher); stale entries are skipped on pop
+    heap = [(n, uid) for uid, n in load.items()]
+    heapq.heapify(heap)
+    given: Dict[int, int] = defaultdict(int)
+    plan: Dict[int, List[int]] = defaultdict(list)
+
+    def full(uid: int) -> bool:
+        return max_per_user is not None and given[uid] >= max_per_user
+
+    for task_id, student_id in tasks:
+        # Every load change pushes a fresh entry, so stale or full ones can be dropped
+        while heap and (heap[0][0] != load[heap[0][1]] or full(heap[0][1])):
+            heapq.heappop(heap)
+        if not heap:
+            break  # everyone hit max_per_user
+        uid = heap[0][1]
+        prev = previous.get(student_id)
+        if prev is not None and prev != uid and not full(prev) and load[prev] <= heap[0][0] + PREFER_SLACK:
+            uid = prev
+        plan[uid].append(task_id)
+        load[uid] += 1
+        given[uid] += 1
+        heapq.heappush(heap, (load[uid], uid))
+
+    now = datetime.utcnow()
+    assigned: Dict[int, List[int]] = {}
+    for uid, ids in plan.items():
+        done: List[int] = []
+        for chunk in _chunks(ids, CHUNK):
+            done += db.scalars(
+                update(Task)
+                .where(
+                    Task.id.in_(chunk),
+                    Task.status == TaskStatus.NEW,
+                    Task.assignee_user_id.is_(None),
+                    Task.deleted_at.is_(None),
+                )
+                .values(
+                    assignee_user_id=uid,
+                    status=TaskStatus.ASSIGNED,
+                    version=Task.version + 1,
+                    updated_at=now,
+                )
+                .returning(Task.id)
+                .execution_options(synchronize_session=False)
+            ).all()
+        assigned[uid] = done
+
+    events = [
+        {
+            "task_id": tid,
+            "type": TaskEventType.ASSIGN,
+            "meta": {"from": None, "to": uid, "auto": True},
+            "actor_user_id": actor.id,
+            "created_at": now,
+        }
+        for uid, ids in assigned.items()
+        for tid in ids
+    ]
+    if events:
+        db.execute(insert(TaskEvent), events)
+    db.commit()
+
+    all_ids = [tid for ids in assigned.values() for tid in ids]
+    invalidate_task(*all_ids, with_comments=True)
+    planned = sum(len(ids) for ids in plan.values())
+    return {
+        "assigned": len(all_ids),
+        "skipped": len(tasks) - len(all_ids),
+        "lost_races": planned - len(all_ids),
+        "per_user": {uid: len(ids) for uid, ids in assigned.items()},
+    }
@@ -0,0 +1,243 @@
+# app/audit.py
+"""Compact task audit events: field-level diffs and retention rollups.
+
+Edit events keep only the fields whose value actually changed:
+
+    {"changed": {field: new}, "old": {field: old}, "undo": {field: [p, s, mid]}}
+
+``changed`` has the shape webhook receivers already know. For long text
+and checklists, the old value goes into ``undo`` as a reverse patch
+against the new value: common prefix length, common suffix length and the
+old middle (``old == new[:p] + mid + new[len(new) - s:]``). Ticking one
+checklist item therefore stores one item, not the whole list twice. Each
+event decodes on its own, so rollups can delete older rows.
+
+``rollup_events`` (nightly) folds events older than EVENT_ROLLUP_AFTER_DAYS
+into one task_event_rollups row per task. It always keeps the newest
+EVENT_KEEP_RECENT events of each task. ``event_view`` returns what the
+events endpoint shows: the decoded events, then the summary.
+"""
+from __future__ import annotations
+
+import json
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.orm import Session
+
+from .cache import invalidate_task
+from .config import settings
+from .db import SessionLocal
+from .models import Task, TaskEvent, TaskEventRollup, TaskEventType
+from .schemas import TaskEventOut
+from .utils import _jsonify, naive_utc
+
+
+# --- Field diffs -------------------------------------------------------------
+def _comparable(value: Any) -> Any:
+    # Stored datetimes are naive UTC; "Z" and "+00:00" spell the same instant
+    return naive_utc(value) if isinstance(value, datetime) else value
+
+
+def edit_diff(task: Task, payload: Dict[str, Any]) -> Dict[str, Tuple[Any, Any]]:
+    """{field: (old, new)} as JSON for the payload fields whose value differs from the task's."""
+    diff = {}
+    for field, value in payload.items():
+        old, new = _comparable(getattr(task, field)), _comparable(value)
+        if old != new:
+            diff[field] = (_jsonify(old), _jsonify(new))
+    return diff
+
+
+def _size(value: Any) -> int:
+    return len(json.dumps(value, separators=(",", ":"), ensure_ascii=False))
+
+
+def _prefix(a, b) -> int:
+    if isinstance(a, str):
+        return len(os.path.commonprefix([a, b]))
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
+
+
+def _undo(old: Any, new: Any) -> Optional[list]:
+    """Reverse patch [prefix, suffix, old middle] for two strings or two lists."""
+    if not (isinstance(old, str) and isinstance(new, str) or isinstance(old, list) and isinstance(new, list)):
+        return None
+    p = _prefix(old, new)
+    n = min(len(old), len(new)) - p
+    s = _prefix(old[::-1][:n], new[::-1][:n])
+    return [p, s, old[p:len(old) - s]]
+
+
+def _apply_undo(new: Any, patch: list) -> Any:
+    p, s, mid = patch
+    return new[:p] + mid + new[len(new) - s:]
+
+
+def encode_edit(diff: Dict[str, Tuple[Any, Any]]) -> Dict[str, Any]:
+    """Event metadata for an edit; old values go in ``undo`` when the patch is smaller."""
+    meta: Dict[str, Any] = {"changed": {f: new for f, (_, new) in diff.items()}}
+    for field, (old, new) in diff.items():
+        patch = _undo(old, new)
+        if patch is not None and _size(patch) < _size(old):
+            meta.setdefault("undo", {})[field] = patch
+        else:
+            meta.setdefault("old", {})[field] = old
+    return meta
+
+
+def decode(meta: Any) -> Any:
+    """Metadata as the API shows it: ``undo`` patches expanded into ``old``."""
+    if not isinstance(meta, dict) or "undo" not in meta:
+        return meta
+    out = {k: v for k, v in meta.items() if k != "undo"}
+    old = dict(meta.get("old") or {})
+    for field, patch in meta["undo"].items():
+        old[field] = _apply_undo(meta["changed"][field], patch)
+    out["old"] = old
+    return out
+
+
+# --- Rollups -----------------------------------------------------------------
+def _fold(summary: Dict[str, Any], e: TaskEvent) -> None:
+    """Add one event to a decoded summary (oldest event first)."""
+    kind = e.type.value
+    counts = summary.setdefault("counts", {})
+    counts[kind] = counts.get(kind, 0) + 1
+    if e.actor_user_id not in summary.setdefault("actors", []):
+        summary["actors"] = sorted(summary["actors"] + [e.actor_user_id])
+    meta = decode(e.meta) or {}
+    if e.type == TaskEventType.EDIT:
+        if meta.get("create"):
+            summary["created"] = True
+        changed, old = summary.setdefault("changed", {}), summary.setdefault("old", {})
+        for field, value in (meta.get("changed") or {}).items():
+            # Net change: old value from the first edit of the field, new value from the last
+            if field not in changed and field in (meta.get("old") or {}):
+                old[field] = meta["old"][field]
+            changed[field] = value
+    elif e.type in (TaskEventType.ASSIGN, TaskEventType.REASSIGN):
+        assignee = summary.setdefault("assignee", {"from": meta.get("from")})
+        assignee["to"] = meta.get("to")
+    elif e.type in (TaskEventType.ACCEPT, TaskEventType.REJECT, TaskEventType.COMPLETE):
+        summary["last_status"] = kind
+        if meta.get("reason"):
+            summary["last_reason"] = meta["reason"]
+
+
+def _compact(summary: Dict[str, Any]) -> Dict[str, Any]:
+    """Re-encode the net field changes like an edit event; drop fields changed back."""
+    changed, old = summary.pop("changed", {}), summary.pop("old", {})
+    known = {f: (old[f], v) for f, v in changed.items() if f in old and old[f] != v}
+    unknown = {f: v for f, v in changed.items() if f not in old}  # pre-diff events had no old values
+    if known or unknown:
+        meta = encode_edit(known)
+        meta["changed"].update(unknown)
+        summary.update(meta)
+    return summary
+
+
+def rollup_events(now: Optional[datetime] = None) -> int:
+    """Fold old events into task_event_rollups; returns the number of events folded."""
+    from .jobs import BATCH_PAUSE_SECONDS  # app.jobs imports this module at load time
+
+    cutoff = (now or datetime.utcnow()) - timedelta(days=settings.EVENT_ROLLUP_AFTER_DAYS)
+    keep = max(settings.EVENT_KEEP_RECENT, 1)  # the board shows each task's latest event
+    batch = settings.SCHEDULER_BATCH_SIZE
+    total, after = 0, 0
+    with SessionLocal() as db:
+        while True:
+            task_ids = db.scalars(
+                select(Task.id).where(Task.id > after).order_by(Task.id).limit(batch)
+            ).all()
+            if not task_ids:
+                return total
+            after = task_ids[-1]
+            ranked = (
+                select(
+                    TaskEvent.id,
+                    func.row_number().over(partition_by=TaskEvent.task_id, order_by=TaskEvent.id.desc()).label("rn"),
+                )
+                .where(TaskEvent.task_id.in_(task_ids))
+                .subquery()
+            )
+            candidates = db.scalars(
+                select(TaskEvent).join(ranked, ranked.c.id == TaskEvent.id)
+                .where(ranked.c.rn > keep).order_by(TaskEvent.id)
+            ).all()
+            # Fold a prefix per task: stop at the first event still inside the window,
+            # so every remaining event is newer than the rollup
+            per_task: Dict[int, List[TaskEvent]] = {}
+            stopped = set()
+            for e in candidates:
+                if e.task_id in stopped:
+                    continue
+                if e.created_at >= cutoff:
+                    stopped.add(e.task_id)
+                    continue
+                per_task.setdefault(e.task_id, []).append(e)
+            if per_task:
+                for task_id, events in per_task.items():
+                    _merge(db, task_id, events)
+                folded = [e.id for events in per_task.values() for e in events]
+                db.execute(delete(TaskEvent).where(TaskEvent.id.in_(folded)))
+                db.commit()
+                invalidate_task(*per_task)
+                total += len(folded)
+                time.sleep(BATCH_PAUSE_SECONDS)
+            db.expunge_all()
+
+
+def _merge(db: Session, task_id: int, events: List[TaskEvent]) -> None:
+    r = db.get(TaskEventRollup, task_id)
+    if r is None:
+        r = TaskEventRollup(task_id=task_id, first_event_id=events[0].id, first_at=events[0].created_at,
+                            events=0, summary={})
+        db.add(r)
+    summary = decode(dict(r.summary))
+    for e in events:
+        _fold(summary, e)
+    r.summary = _compact(summary)
+    r.events += len(events)
+    r.last_event_id = events[-1].id
+    r.last_at = events[-1].created_at
+    r.last_actor_user_id = events[-1].actor_user_id
+
+
+# --- Read view ---------------------------------------------------------------
+def event_view(db: Session, task_id: int) -> List[TaskEventOut]:
+    """Events newest first with diffs decoded, then the rollup of older ones (if any)."""
+    rows = (
+        db.query(TaskEvent)
+        .filter(TaskEvent.task_id == task_id)
+        .order_by(TaskEvent.created_at.desc(), TaskEvent.id.desc())
+        .all()
+    )
+    items = [
+        TaskEventOut(
+            id=e.id, task_id=e.task_id, type=e.type, metadata=decode(e.meta),
+            actor_user_id=e.actor_user_id, created_at=e.created_at,
+        )
+        for e in rows
+    ]
+    r = db.get(TaskEventRollup, task_id)
+    if r is not None:
+        items.append(TaskEventOut(
+            id=r.last_event_id, task_id=task_id, type=TaskEventType.ROLLUP,
+            metadata={
+                "events": r.events,
+                "first_event_id": r.first_event_id,
+                "last_event_id": r.last_event_id,
+                "first_at": r.first_at.isoformat(),
+                **decode(r.summary),
+            },
+            actor_user_id=r.last_actor_user_id, created_at=r.last_at,
+        ))
+    return items
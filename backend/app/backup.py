@@ -0,0 +1,424 @@
+# app/backup.py
+"""Online SQLite snapshots: create, list, rotate, restore.
+
+Snapshots go through SQLite's backup API, ``BACKUP_PAGES_PER_STEP`` pages
+at a time with a ``BACKUP_STEP_SLEEP_SECONDS`` pause between steps, so the
+copy never hogs the disk. In WAL mode the copy reads from one pinned read
+snapshot. WAL readers never block writers, and commits made during the copy
+don't restart it. Without the pin, every commit on another connection sends
+the backup API back to page 1, and a busy database never finishes. Each
+snapshot is checked (``PRAGMA quick_check``), gzipped and renamed into
+place, then older ones are pruned (``BACKUP_KEEP_LAST`` plus one per day
+for ``BACKUP_KEEP_DAILY`` days).
+
+    python -m app.backup create [--tenant oslo | --all-tenants]
+    python -m app.backup list
+    python -m app.backup restore app-20261019T023000Z.db.gz [--to copy.db]
+
+Restore copies the snapshot into the live file in one backup-API
+transaction, so running workers see it like any other commit.
+"""
+from __future__ import annotations
+
+import argparse
+import gzip
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from .config import settings
+from .db import current_tenant, get_engine, init_schema, list_tenants, sqlite_file, tenancy_enabled, use_tenant, valid_tenant
+
+_SNAPSHOT = re.compile(r"^(?P<label>[a-z0-9][a-z0-9_-]*)-(?P<stamp>\d{8}T\d{6}Z)\.db\.gz$")
+_STAMP = "%Y%m%dT%H%M%SZ"
+
+# Last report per database, this process only (GET /api/admin/backups)
+_last: Dict[str, dict] = {}
+_running: set = set()
+_running_lock = threading.Lock()
+
+
+class BackupError(RuntimeError):
+    pass
+
+
+class BackupBusy(BackupError):
+    """A backup of the same database is already running."""
+
+
+def backup_dir() -> str:
+    """BACKUP_DIR, else backups/ next to the database (shared by all schools)."""
+    if settings.BACKUP_DIR:
+        return os.path.abspath(settings.BACKUP_DIR)
+    base = settings.TENANT_DB_DIR if tenancy_enabled() else os.path.dirname(_db_path())
+    return os.path.join(os.path.abspath(base), "backups")
+
+
+def _db_path() -> str:
+    path = sqlite_file()
+    if path is None:
+        raise BackupError("online backups need a file-backed SQLite database")
+    return path
+
+
+def db_label() -> str:
+    """Snapshot name prefix: the tenant key, else the database file name."""
+    tenant = current_tenant.get()
+    if tenant:
+        return tenant
+    stem = os.path.splitext(os.path.basename(_db_path()))[0].lower()
+    return re.sub(r"[^a-z0-9_-]", "-", stem).lstrip("-_") or "db"
+
+
+@contextmanager
+def _exclusive(out_dir: str, label: str):
+    """One backup per database at a time, across threads and worker processes."""
+    with _running_lock:
+        if label in _running:
+            raise BackupBusy(f"backup of {label!r} already running")
+        _running.add(label)
+    try:
+        try:
+            import fcntl
+        except ImportError:  # Windows dev: single process
+            yield
+            return
+        with open(os.path.join(out_dir, f".{label}.lock"), "a") as fh:
+            try:
+                fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                raise BackupBusy(f"backup of {label!r} already running in another process")
+            try:
+                yield
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+    finally:
+        with _running_lock:
+            _running.discard(label)
+
+
+# --- Create ------------------------------------------------------------------
+# Pause between write-lock probes while a copy runs (create(probe_writers=True))
+PROBE_INTERVAL_SECONDS = 0.005
+
+
+class _WriteProbe:
+    """Measures how long a writer waits for the lock while a copy runs.
+
+    A side thread keeps taking and releasing the write lock (``BEGIN
+    EXCLUSIVE`` + ``ROLLBACK``, nothing written). In rollback-journal mode
+    that waits for the backup step's SHARED lock, just like a commit does.
+    Probes run one after another, so their summed waits are the time a
+    writer would have been stuck. Waits on other app writers count as well.
+    The probes themselves contend with real writers, so this is for
+    benchmarks (bench/backup.py), not scheduled backups.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.waits: List[float] = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="backup-write-probe", daemon=True)
+
+    def _run(self) -> None:
+        conn = sqlite3.connect(self.path, isolation_level=None, timeout=5)
+        try:
+            while not self._stop.wait(PROBE_INTERVAL_SECONDS):
+                t0 = time.perf_counter()
+                try:
+                    conn.execute("BEGIN EXCLUSIVE")
+                    conn.execute("ROLLBACK")
+                except sqlite3.OperationalError:  # busy past the timeout: count the full wait
+                    pass
+                self.waits.append(time.perf_counter() - t0)
+        finally:
+            conn.close()
+
+    def __enter__(self) -> "_WriteProbe":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        self._thread.join()
+
+
+def _copy(src_path: str, dest_path: str, probe_writers: bool = False) -> dict:
+    """Stepped backup of src into a new file; returns page/step timings."""
+    src = sqlite3.connect(src_path, isolation_level=None)
+    dst = sqlite3.connect(dest_path, isolation_level=None)
+    try:
+        src.execute("PRAGMA busy_timeout=5000")
+        wal = src.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        if wal:
+            # Pin one read snapshot for the whole copy (see module docstring)
+            src.execute("BEGIN")
+            src.execute("SELECT 1 FROM sqlite_master LIMIT 1")
+        steps: List[float] = []
+        state = {"mark": time.perf_counter(), "remaining": None, "restarts": 0}
+
+        def progress(status, remaining, total):
+            steps.append(time.perf_counter() - state["mark"])
+            if state["remaining"] is not None and remaining > state["remaining"]:
+                state["restarts"] += 1
+            state["remaining"] = remaining
+            if remaining:
+                time.sleep(settings.BACKUP_STEP_SLEEP_SECONDS)
+            state["mark"] = time.perf_counter()
+
+        # Size of the pinned snapshot; the file alone misses pages still in the -wal
+        db_bytes = (src.execute("PRAGMA page_count").fetchone()[0]
+                    * src.execute("PRAGMA page_size").fetchone()[0])
+        t0 = time.perf_counter()
+        probe = _WriteProbe(src_path) if probe_writers else None
+        with probe or nullcontext():
+            src.backup(dst, pages=max(settings.BACKUP_PAGES_PER_STEP, 1), progress=progress)
+            copy_s = time.perf_counter() - t0
+            if wal:
+                src.execute("COMMIT")
+        # Self-contained file: no -wal/-shm next to the snapshot
+        dst.execute("PRAGMA journal_mode=DELETE")
+        if dst.execute("PRAGMA quick_check").fetchone()[0] != "ok":
+            raise BackupError("snapshot failed quick_check")
+        pages = dst.execute("PRAGMA page_count").fetchone()[0]
+    finally:
+        src.close()
+        dst.close()
+    report = {
+        "journal_mode": "wal" if wal else "rollback",
+        "pages": pages,
+        "steps": len(steps),
+        "restarts": state["restarts"],
+        "copy_ms": round(copy_s * 1000, 1),
+        "max_step_ms": round(max(steps, default=0) * 1000, 2),
+        "db_bytes": db_bytes,
+    }
+    if probe:
+        report.update({
+            "write_probes": len(probe.waits),
+            "writers_blocked_ms": round(sum(probe.waits) * 1000, 2),
+            "max_writer_wait_ms": round(max(probe.waits, default=0) * 1000, 2),
+        })
+    return report
+
+
+def _compress(raw: str, dest: str) -> int:
+    tmp = dest + ".tmp"
+    with open(raw, "rb") as fin, open(tmp, "wb") as fout:
+        with gzip.GzipFile(fileobj=fout, mode="wb", compresslevel=settings.BACKUP_COMPRESS_LEVEL) as gz:
+            shutil.copyfileobj(fin, gz, 1 << 20)
+        fout.flush()
+        os.fsync(fout.fileno())
+    os.replace(tmp, dest)
+    return os.path.getsize(dest)
+
+
+def create(probe_writers: bool = False) -> dict:
+    """Snapshot the current database (tenant-aware), then apply retention.
+
+    probe_writers measures writer lock waits during the copy (see _WriteProbe).
+    """
+    src_path = _db_path()
+    label = db_label()
+    out_dir = backup_dir()
+    os.makedirs(out_dir, exist_ok=True)
+    with _exclusive(out_dir, label):
+        started = datetime.utcnow()
+        name = f"{label}-{started.strftime(_STAMP)}.db.gz"
+        raw = os.path.join(out_dir, f".{label}.db.tmp")
+        t0 = time.perf_counter()
+        try:
+            report = _copy(src_path, raw, probe_writers)
+            t1 = time.perf_counter()
+            size = _compress(raw, os.path.join(out_dir, name))
+            compress_s = time.perf_counter() - t1
+        finally:
+            for leftover in (raw, os.path.join(out_dir, name + ".tmp")):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+        report.update({
+            "snapshot": name,
+            "started_at": started.isoformat() + "Z",
+            "snapshot_bytes": size,
+            "compress_ms": round(compress_s * 1000, 1),
+            "total_ms": round((time.perf_counter() - t0) * 1000, 1),
+            "pruned": prune(label),
+        })
+    _last[label] = report
+    return report
+
+
+# --- List / rotate -------------------------------------------------------------
+def list_snapshots(label: Optional[str] = None) -> List[dict]:
+    """Snapshots on disk, newest first; all databases unless label is given."""
+    out_dir = backup_dir()
+    if not os.path.isdir(out_dir):
+        return []
+    rows = []
+    for f in os.listdir(out_dir):
+        m = _SNAPSHOT.match(f)
+        if not m or (label and m["label"] != label):
+            continue
+        rows.append({
+            "name": f,
+            "label": m["label"],
+            "taken_at": datetime.strptime(m["stamp"], _STAMP),
+            "bytes": os.path.getsize(os.path.join(out_dir, f)),
+        })
+    rows.sort(key=lambda r: r["taken_at"], reverse=True)
+    return rows
+
+
+def prune(label: str, now: Optional[datetime] = None) -> List[str]:
+    """Keep the newest BACKUP_KEEP_LAST, plus the newest per day for BACKUP_KEEP_DAILY days."""
+    snaps = list_snapshots(label)
+    keep = {s["name"] for s in snaps[:max(settings.BACKUP_KEEP_LAST, 1)]}
+    oldest_day = (now or datetime.utcnow()).date() - timedelta(days=settings.BACKUP_KEEP_DAILY)
+    days = set()
+    for s in snaps:  # newest first, so the first seen per day is kept
+        day = s["taken_at"].date()
+        if day > oldest_day and day not in days:
+            days.add(day)
+            keep.add(s["name"])
+    removed = [s["name"] for s in snaps if s["name"] not in keep]
+    for name in removed:
+        os.remove(os.path.join(backup_dir(), name))
+    return removed
+
+
+def last_report() -> Optional[dict]:
+    try:
+        return _last.get(db_label())
+    except BackupError:
+        return None
+
+
+def backup_job() -> int:
+    """Scheduler entry point; returns pages copied."""
+    return create()["pages"]
+
+
+# --- Restore -------------------------------------------------------------------
+def _snapshot_path(snapshot: str) -> str:
+    path = snapshot if os.path.sep in snapshot else os.path.join(backup_dir(), snapshot)
+    if not os.path.isfile(path):
+        raise BackupError(f"no such snapshot: {snapshot}")
+    return path
+
+
+def restore(snapshot: str, to: Optional[str] = None) -> dict:
+    """Replace the current database with a snapshot (or write it to ``to``).
+
+    The swap is one backup-API write transaction on the live file, so open
+    connections in running workers stay valid. Afterwards change_log jumps
+    past every seq a worker may have read: app.coherence sees the gap and
+    drops its caches.
+    """
+    src = _snapshot_path(snapshot)
+    dest = os.path.abspath(to) if to else _db_path()
+    tmp = dest + ".restore.tmp"
+    t0 = time.perf_counter()
+    try:
+        with gzip.open(src, "rb") as fin, open(tmp, "wb") as fout:
+            shutil.copyfileobj(fin, fout, 1 << 20)
+        snap = sqlite3.connect(tmp, isolation_level=None)
+        try:
+            if snap.execute("PRAGMA quick_check").fetchone()[0] != "ok":
+                raise BackupError(f"{snapshot} failed quick_check")
+            pages = snap.execute("PRAGMA page_count").fetchone()[0]
+            unpack_s = time.perf_counter() - t0
+            if to:
+                snap.close()
+                os.replace(tmp, dest)
+                return {"restored": snapshot, "to": dest, "pages": pages, "total_ms": round(unpack_s * 1000, 1)}
+            live = sqlite3.connect(dest, isolation_level=None)
+            try:
+                live.execute("PRAGMA busy_timeout=5000")
+                seq = "SELECT COALESCE(MAX(seq), 0) FROM sqlite_sequence WHERE name = 'change_log'"
+                before = live.execute(seq).fetchone()[0]
+                t1 = time.perf_counter()
+                snap.backup(live)  # one step: a single write transaction
+                swap_s = time.perf_counter() - t1
+                live.execute("BEGIN IMMEDIATE")
+                floor = max(before, live.execute(seq).fetchone()[0]) + 1
+                live.execute("DELETE FROM sqlite_sequence WHERE name = 'change_log'")
+                live.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('change_log', ?)", (floor,))
+                live.execute("INSERT INTO change_log (scope, key) VALUES ('restore', NULL)")
+                live.execute("COMMIT")
+            finally:
+                live.close()
+        finally:
+            snap.close()
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    init_schema(get_engine())  # an older snapshot may predate migrations
+    return {
+        "restored": snapshot,
+        "to": dest,
+        "pages": pages,
+        "unpack_ms": round(unpack_s * 1000, 1),
+        "writers_blocked_ms": round(swap_s * 1000, 1),
+        "total_ms": round((time.perf_counter() - t0) * 1000, 1),
+    }
+
+
+# --- CLI -----------------------------------------------------------------------
+def _fmt_bytes(n: int) -> str:
+    return f"{n / 1048576:.1f} MB" if n >= 1048576 else f"{n / 1024:.0f} kB"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Online SQLite backups for Simple Task Pro.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_create = sub.add_parser("create", help="Take a snapshot now and apply retention.")
+    sub.add_parser("list", help="List snapshots, newest first.")
+    p_restore = sub.add_parser("restore", help="Restore a snapshot into the live database.")
+    p_restore.add_argument("snapshot", help="File name in the backup dir, or a path.")
+    p_restore.add_argument("--to", help="Write the restored database to this path instead.")
+    for p in (p_create, p_restore):
+        p.add_argument("--tenant", action="append", default=[],
+                       help="School database (needs TENANT_DB_DIR); repeatable for create.")
+    p_create.add_argument("--all-tenants", action="store_true",
+                          help="Snapshot every school database in TENANT_DB_DIR.")
+    args = parser.parse_args()
+
+    tenants: List[Optional[str]] = [None]
+    if args.cmd != "list" and (args.tenant or getattr(args, "all_tenants", False)):
+        if not tenancy_enabled():
+            parser.error("--tenant/--all-tenants need TENANT_DB_DIR")
+        bad = [t for t in args.tenant if not valid_tenant(t)]
+        if bad:
+            parser.error(f"invalid tenant key(s): {', '.join(bad)}")
+        tenants = sorted(set(args.tenant) | set(list_tenants() if getattr(args, "all_tenants", False) else []))
+    if args.cmd == "restore" and len(tenants) > 1:
+        parser.error("restore takes one --tenant")
+
+    if args.cmd == "list":
+        print(f"{backup_dir()}:")
+        for s in list_snapshots():
+            print(f"  {s['name']:<48} {_fmt_bytes(s['bytes']):>10}")
+        return
+
+    for tenant in tenants:
+        with use_tenant(tenant):
+            if args.cmd == "create":
+                r = create()
+                print(f"[BACKUP] {r['snapshot']}: {r['pages']} pages in {r['steps']} steps, "
+                      f"{_fmt_bytes(r['db_bytes'])} -> {_fmt_bytes(r['snapshot_bytes'])}, "
+                      f"copy {r['copy_ms']:.0f} ms + gzip {r['compress_ms']:.0f} ms"
+                      + (f", pruned {len(r['pruned'])}" if r["pruned"] else ""))
+            else:
+                r = restore(args.snapshot, args.to)
+                print(f"[RESTORE] {r['restored']} -> {r['to']}: {r['pages']} pages in {r['total_ms']:.0f} ms"
+                      + (f" (writers blocked {r['writers_blocked_ms']:.0f} ms)" if "writers_blocked_ms" in r else ""))
+
+
+if __name__ == "__main__":
+    main()
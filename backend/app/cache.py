@@ -0,0 +1,129 @@
+# app/cache.py
+"""Bounded LRU/TTL cache for serialized read payloads.
+
+Values are stored already serialized (JSON bytes) together with the access
+data needed to re-check permissions on a hit. Writers call ``invalidate_task``
+after commit. A load that started before an invalidation is not stored, so a
+slow reader can't put stale data back into the cache.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+from .config import settings
+from .db import current_tenant
+
+
+class TTLCache:
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._epoch = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            expires, value = item
+            if expires < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def epoch(self) -> int:
+        return self._epoch
+
+    def set(self, key: Hashable, value: Any, epoch: Optional[int] = None) -> None:
+        with self._lock:
+            if epoch is not None and epoch != self._epoch:
+                return  # invalidated while loading
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        value = self.get(key)
+        if value is not None:
+            return value
+        epoch = self._epoch
+        value = loader()
+        self.set(key, value, epoch)
+        return value
+
+    def delete(self, *keys: Hashable) -> None:
+        with self._lock:
+            self._epoch += 1
+            self.invalidations += 1
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._epoch += 1
+            self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else None,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+task_cache = TTLCache(settings.CACHE_MAXSIZE, settings.CACHE_TTL_SECONDS)
+
+
+# Keys per task: detail payload, event list, comment list. Keys start with
+# the current tenant, so schools sharing a process never see each other's rows.
+def task_key(task_id: int) -> Tuple[Optional[str], str, int]:
+    return (current_tenant.get(), "task", task_id)
+
+def events_key(task_id: int) -> Tuple[Optional[str], str, int]:
+    return (current_tenant.get(), "events", task_id)
+
+def comments_key(task_id: int) -> Tuple[Optional[str], str, int]:
+    return (current_tenant.get(), "comments", task_id)
+
+def students_key() -> Tuple[Optional[str], str, int]:
+    return (current_tenant.get(), "students", 0)
+
+
+def invalidate_task(*task_ids: int, with_comments: bool = False) -> None:
+    """Drop the detail and event payloads (call after commit)."""
+    keys = []
+    for tid in set(task_ids):
+        keys += [task_key(tid), events_key(tid)]
+        if with_comments:
+            keys.append(comments_key(tid))
+    if keys:
+        task_cache.delete(*keys)
+
+
+def invalidate_comments(*task_ids: int) -> None:
+    task_cache.delete(*[comments_key(tid) for tid in task_ids])
+
+
+def invalidate_students() -> None:
+    task_cache.delete(students_key())
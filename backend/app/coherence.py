@@ -0,0 +1,154 @@
+# app/coherence.py
+"""Cross-process cache coherence for multi-worker deployments.
+
+Each process keeps its own caches (task payloads, users, students,
+gazetteer). SQLite triggers append every change to ``change_log``. Before
+serving a request a process checks ``PRAGMA data_version`` on a private
+read-only connection. That is an in-memory counter and costs no I/O. It
+only changes after a commit on another connection, and only then does
+the process read the new change_log rows and invalidate the matching keys.
+With tenancy on, each school database has its own read position, and
+listeners run inside that tenant's context.
+"""
+from __future__ import annotations
+
+import logging
+import sqlite3
+import threading
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from .db import current_tenant, sqlite_file
+
+log = logging.getLogger("app.coherence")
+
+# Rows pulled per sync; a process further behind than this just clears everything
+MAX_BATCH = 20000
+
+Listener = Callable[[List[Optional[int]]], None]
+
+
+class _Tail:
+    """Read position in one database's change_log."""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+        self.last_seq = conn.execute(
+            "SELECT COALESCE(MAX(seq), 0) FROM change_log"
+        ).fetchone()[0]
+        self.data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+
+
+class ChangeFeed:
+    def __init__(self):
+        # Re-entrant: opening a tenant engine in sync() may evict another and call drop()
+        self._lock = threading.RLock()
+        # One tail per database: None without tenancy, else the tenant key
+        self._tails: Dict[Optional[str], _Tail] = {}
+        self._listeners: Dict[str, List[Listener]] = defaultdict(list)
+        self._reset_listeners: List[Callable[[], None]] = []
+        self.syncs = 0
+        self.changes_applied = 0
+        self.resets = 0
+
+    # -- wiring -------------------------------------------------------------
+    def subscribe(self, scope: str, fn: Listener) -> None:
+        """fn(keys) is called with the changed keys of ``scope``."""
+        self._listeners[scope].append(fn)
+
+    def on_reset(self, fn: Callable[[], None]) -> None:
+        """fn() drops a whole cache; used when the feed can't be followed precisely."""
+        self._reset_listeners.append(fn)
+
+    @property
+    def active(self) -> bool:
+        return current_tenant.get() in self._tails
+
+    def drop(self, tenant: Optional[str]) -> None:
+        """Close the tail of a database whose engine was evicted."""
+        with self._lock:
+            tail = self._tails.pop(tenant, None)
+        if tail is not None:
+            tail.conn.close()
+
+    # -- polling ------------------------------------------------------------
+    def _connect(self) -> Optional[_Tail]:
+        tenant = current_tenant.get()
+        tail = self._tails.get(tenant)
+        if tail is None:
+            path = sqlite_file()
+            if path is None:
+                return None
+            conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA query_only=1")
+            tail = self._tails[tenant] = _Tail(conn)
+        return tail
+
+    def sync(self) -> None:
+        """Apply changes committed by other connections since the last call."""
+        with self._lock:
+            try:
+                tail = self._connect()
+            except sqlite3.Error:
+                log.exception("change feed unavailable")
+                return
+            if tail is None:
+                return
+            conn = tail.conn
+            dv = conn.execute("PRAGMA data_version").fetchone()[0]
+            if dv == tail.data_version:
+                return
+            tail.data_version = dv
+            self.syncs += 1
+            rows = conn.execute(
+                "SELECT seq, scope, key FROM change_log WHERE seq > ? ORDER BY seq LIMIT ?",
+                (tail.last_seq, MAX_BATCH + 1),
+            ).fetchall()
+            if not rows:
+                return
+            # seq is AUTOINCREMENT and written by one writer at a time, so a
+            # gap means rows we never saw were pruned
+            if len(rows) > MAX_BATCH or rows[0][0] > tail.last_seq + 1:
+                # Too far behind, or rows we never saw were pruned
+                tail.last_seq = conn.execute(
+                    "SELECT MAX(seq) FROM change_log"
+                ).fetchone()[0]
+                self.resets += 1
+                for fn in self._reset_listeners:
+                    fn()
+                return
+            by_scope: Dict[str, List[Optional[int]]] = defaultdict(list)
+            for _seq, scope, key in rows:
+                by_scope[scope].append(key)
+            tail.last_seq = rows[-1][0]
+            self.changes_applied += len(rows)
+        for scope, keys in by_scope.items():
+            for fn in self._listeners.get(scope, ()):
+                fn(keys)
+
+    def stats(self) -> Dict[str, int]:
+        tail = self._tails.get(current_tenant.get())
+        return {
+            "last_seq": tail.last_seq if tail else 0,
+            "databases": len(self._tails),
+            "syncs": self.syncs,
+            "changes_applied": self.changes_applied,
+            "resets": self.resets,
+        }
+
+
+def scope_version(db: Session, scope: str) -> int:
+    """Last change seq of a scope in db._VERSIONED_SCOPES; 0 if it never changed.
+
+    Read from scope_versions, which triggers keep and pruning never touches,
+    so every worker gets the same value for the same data (used for ETags).
+    """
+    return db.execute(
+        text("SELECT seq FROM scope_versions WHERE scope = :scope"), {"scope": scope}
+    ).scalar() or 0
+
+
+feed = ChangeFeed()
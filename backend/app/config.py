@@ -1,12 +1,94 @@
+from pydantic import BaseModel
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
+
+class VisitRule(BaseModel):
+    """Create a home-visit task when a student has min_count absences
+    with one of reason_codes within window_days."""
+    name: str
+    reason_codes: list[str] = ["Syk"]
+    min_count: int = 3
+    window_days: int = 14
+    due_in_days: int = 1
+    title: str = "Home visit: {student}"
+
+class WebhookEndpoint(BaseModel):
+    """Receiver of task events, signed with HMAC-SHA256 using secret."""
+    name: str
+    url: str
+    secret: str
+    enabled: bool = True
+
 class Settings(BaseSettings):
     # peker på backend/.env
     model_config = SettingsConfigDict(env_file='backend/.env', env_file_encoding='utf-8')
 
     DATABASE_URL: str = "sqlite:///./app.db"
+
+    # Multi-school: set TENANT_DB_DIR to give every school (tenant) its own
+    # SQLite file <dir>/<tenant>.db, picked per request from TENANT_HEADER or
+    # the subdomain of TENANT_BASE_DOMAIN (oslo.tasks.example.org -> oslo)
+    TENANT_DB_DIR: str | None = None
+    TENANT_HEADER: str = "X-Tenant"
+    TENANT_BASE_DOMAIN: str | None = None
+    TENANT_POOL_SIZE: int = 32          # open tenant engines kept per process
     CORS_ORIGINS: str | list[str] = ["http://localhost:5173", "http://127.0.0.1:5173"]
     API_TOKENS: list[str] = ["DEV_TOKEN_123"]
     REQUIRE_API_TOKEN: bool = True  # settes til false i backend/.env for dev
 
+    # Soft-deleted tasks can be restored within this window, then get purged
+    RESTORE_WINDOW_HOURS: int = 72
+
+    # Background jobs (overdue flags, purges, SQLite maintenance)
+    SCHEDULER_ENABLED: bool = True
+    SCHEDULER_BATCH_SIZE: int = 500     # rows per write transaction
+    SCHEDULER_LEASE_SECONDS: int = 60   # leader lease across uvicorn workers
+    SCHEDULER_START_DELAY_SECONDS: float = 5.0  # keep the first requests after boot free of job I/O
+
+    # Max records per POST /api/ingest/absences
+    INGEST_MAX_BATCH: int = 20000
+
+    # Absence -> visit rules, evaluated every minute by the scheduler.
+    # Override with JSON, e.g. VISIT_RULES='[{"name":"syk-3-14","min_count":3}]'
+    VISIT_RULES: list[VisitRule] = [VisitRule(name="syk-3-in-14")]
+
+    # Route planning (GET /api/route)
+    ROUTE_SPEED_KMH: float = 20.0        # average city travel speed
+    ROUTE_SERVICE_MINUTES: float = 20.0  # time spent per visit
+    ROUTE_DAY_START_HOUR: int = 8
+
+    # Read-through cache for task detail, events and comments
+    CACHE_MAXSIZE: int = 2048
+    CACHE_TTL_SECONDS: float = 60.0
+
+    # Calendar: GET /api/calendar range limit and per-teacher .ics feeds
+    CALENDAR_MAX_RANGE_DAYS: int = 366
+    CALENDAR_PAST_DAYS: int = 60         # feeds include visits due this far back
+    CALENDAR_FEED_SECRET: str = "DEV_CALENDAR_SECRET"  # signs feed URLs; render.yaml generates one
+    CALENDAR_CACHE_TTL_SECONDS: float = 86400.0
+
+    # Webhooks: task events pushed from the outbox by app.webhooks (scheduler leader only).
+    # WEBHOOKS='[{"name":"sis","url":"https://example.org/hook","secret":"..."}]'
+    WEBHOOKS: list[WebhookEndpoint] = []
+    WEBHOOK_BATCH_SIZE: int = 100          # events per POST
+    WEBHOOK_POLL_SECONDS: float = 0.25     # idle check for new outbox rows
+    WEBHOOK_TIMEOUT_SECONDS: float = 10.0
+    WEBHOOK_MAX_ATTEMPTS: int = 10         # then the batch goes to webhook_dead_letters
+    WEBHOOK_BACKOFF_BASE_SECONDS: float = 1.0
+    WEBHOOK_BACKOFF_MAX_SECONDS: float = 600.0
+
+    # Audit log retention (app.audit): task_events older than this fold into one
+    # summary row per task; the newest EVENT_KEEP_RECENT per task are always kept
+    EVENT_ROLLUP_AFTER_DAYS: int = 90
+    EVENT_KEEP_RECENT: int = 20
+
+    # Online backups (app.backup): stepped copies through SQLite's backup API
+    BACKUP_DIR: str | None = None          # default: backups/ next to the database
+    BACKUP_PAGES_PER_STEP: int = 256       # pages copied per step (1 MB at 4 kB pages)
+    BACKUP_STEP_SLEEP_SECONDS: float = 0.02  # pause between steps, keeps disk I/O for requests
+    BACKUP_COMPRESS_LEVEL: int = 6         # gzip level
+    BACKUP_KEEP_LAST: int = 3              # newest snapshots always kept
+    BACKUP_KEEP_DAILY: int = 7             # plus the newest of each of the last N days
+    BACKUP_CRON: str | None = None         # e.g. "30 2 * * *" for nightly scheduled snapshots
+
 settings = Settings()
@@ -1,30 +1,488 @@
 # backend/app/db.py
+import json
 import os
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
+import re
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session, sessionmaker, declarative_base
 from pathlib import Path
 
+from app.config import settings
+
 PROJECT_ROOT = Path(__file__).resolve().parents[2]
 DB_PATH = PROJECT_ROOT / "app.db"
 
 # NEW: les fra env, fall tilbake til lokal fil
 SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", f"sqlite:///{DB_PATH.as_posix()}")
 
-connect_args = {}
-if SQLALCHEMY_DATABASE_URL.startswith("sqlite"):
-    connect_args = {"check_same_thread": False}
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL,
-    connect_args=connect_args,
-)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+def _json_dumps(obj) -> str:
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False)
+
+
+def _make_engine(url: str) -> Engine:
+    connect_args = {}
+    if url.startswith("sqlite"):
+        connect_args = {"check_same_thread": False}
+    # Compact JSON columns: no spaces, æøå stored as UTF-8 rather than \u escapes
+    eng = create_engine(url, connect_args=connect_args, json_serializer=_json_dumps)
+    if url.startswith("sqlite"):
+        @event.listens_for(eng, "connect")
+        def _sqlite_pragmas(dbapi_conn, _record):
+            # WAL: readers don't block the writer, and background jobs can checkpoint
+            cur = dbapi_conn.cursor()
+            cur.execute("PRAGMA journal_mode=WAL")
+            cur.execute("PRAGMA busy_timeout=5000")
+            cur.close()
+    return eng
+
+
+# Single-school database. With TENANT_DB_DIR set it only holds the scheduler
+# lease; school data lives in one file per tenant (below).
+engine = _make_engine(SQLALCHEMY_DATABASE_URL)
+
+
+# --- Tenants (one SQLite file per school) ------------------------------------
+# Separate files mean separate write locks, WAL files and table sets, so
+# schools never queue behind each other's writes.
+_TENANT_KEY = re.compile(r"^[a-z0-9][a-z0-9_-]{0,62}$")
+
+current_tenant: ContextVar[Optional[str]] = ContextVar("current_tenant", default=None)
+
+
+def tenancy_enabled() -> bool:
+    return bool(settings.TENANT_DB_DIR)
+
+
+def valid_tenant(key: Optional[str]) -> bool:
+    return bool(key) and _TENANT_KEY.match(key) is not None
+
+
+def tenant_path(tenant: str) -> str:
+    if not valid_tenant(tenant):
+        raise ValueError(f"invalid tenant key: {tenant!r}")
+    return os.path.join(os.path.abspath(settings.TENANT_DB_DIR), f"{tenant}.db")
+
+
+def tenant_exists(tenant: str) -> bool:
+    return valid_tenant(tenant) and os.path.exists(tenant_path(tenant))
+
+
+def list_tenants() -> List[str]:
+    if not tenancy_enabled() or not os.path.isdir(settings.TENANT_DB_DIR):
+        return []
+    names = (f[:-3] for f in os.listdir(settings.TENANT_DB_DIR) if f.endswith(".db"))
+    return sorted(n for n in names if valid_tenant(n))
+
+
+def resolve_tenant(header: Optional[str], host: Optional[str]) -> Optional[str]:
+    """Tenant key from the TENANT_HEADER value, else from <tenant>.TENANT_BASE_DOMAIN."""
+    if header:
+        return header.strip().lower()
+    base = (settings.TENANT_BASE_DOMAIN or "").lower()
+    host = (host or "").split(":")[0].lower()
+    if base and host.endswith("." + base):
+        label = host[: -len(base) - 1]
+        if "." not in label:
+            return label
+    return None
+
+
+@contextmanager
+def use_tenant(tenant: Optional[str]):
+    """Route SessionLocal(), caches and the change feed to tenant's database."""
+    token = current_tenant.set(tenant)
+    try:
+        yield
+    finally:
+        current_tenant.reset(token)
+
+
+class EnginePool:
+    """Bounded LRU of per-tenant engines.
+
+    Opening an engine runs init_schema, which is one SELECT for a database
+    that is already current. Past maxsize, the least recently used engines
+    with no checked-out connections are disposed. Busy ones are kept, so the
+    pool can briefly exceed maxsize under load.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._engines: "OrderedDict[str, Engine]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._evict_listeners: List[Callable[[str], None]] = []
+        self.opened = 0
+        self.evicted = 0
+
+    def on_evict(self, fn: Callable[[str], None]) -> None:
+        """fn(tenant) drops per-tenant state (feed connections, caches)."""
+        self._evict_listeners.append(fn)
+
+    def get(self, tenant: str) -> Engine:
+        with self._lock:
+            eng = self._engines.get(tenant)
+            if eng is not None:
+                self._engines.move_to_end(tenant)
+                return eng
+            os.makedirs(settings.TENANT_DB_DIR, exist_ok=True)
+            eng = _make_engine(f"sqlite:///{tenant_path(tenant)}")
+            init_schema(eng)
+            self._engines[tenant] = eng
+            self.opened += 1
+            evicted = self._evict()
+        for name in evicted:
+            for fn in self._evict_listeners:
+                fn(name)
+        return eng
+
+    def _evict(self) -> List[str]:
+        evicted = []
+        for name in list(self._engines):
+            if len(self._engines) <= self.maxsize:
+                break
+            eng = self._engines[name]
+            if eng.pool.checkedout() == 0:
+                del self._engines[name]
+                eng.dispose()
+                evicted.append(name)
+                self.evicted += 1
+        return evicted
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "open": len(self._engines),
+            "maxsize": self.maxsize,
+            "opened": self.opened,
+            "evicted": self.evicted,
+        }
+
+
+engines = EnginePool(settings.TENANT_POOL_SIZE)
+
+
+def get_engine(tenant: Optional[str] = None) -> Engine:
+    """Engine for tenant (default: the current one); the main engine without tenancy."""
+    tenant = tenant or current_tenant.get()
+    if tenant is None or not tenancy_enabled():
+        return engine
+    return engines.get(tenant)
+
+
+class _TenantSession(Session):
+    def __init__(self, bind=None, **kw):
+        # Bound when created, so a session never switches database midway
+        super().__init__(bind=bind or get_engine(), **kw)
+
+
+SessionLocal = sessionmaker(class_=_TenantSession, autocommit=False, autoflush=False)
 Base = declarative_base()
 
 def get_db():
+    """Session on the request's school database (tenant set by main.route_tenant)."""
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
 
+
+# Columns added after the first deploy. create_all() only creates missing
+# tables, so existing SQLite files get these via ALTER TABLE on startup.
+_ADDED_COLUMNS = {
+    "tasks": {
+        "version": "INTEGER NOT NULL DEFAULT 1",
+        "overdue_at": "DATETIME",
+    },
+}
+
+# change_log feeds cross-process cache invalidation (app.coherence). Triggers
+# catch every writer: API, bulk UPDATEs, background jobs, seed/CLI.
+_CHANGE_TRIGGERS = {
+    # table: (scope, key expression on the row)
+    "tasks": ("task", "id"),
+    "task_events": ("task", "task_id"),
+    "task_event_rollups": ("task", "task_id"),
+    "comments": ("comments", "task_id"),
+    "users": ("users", "id"),
+    "students": ("students", "id"),
+    "geocodes": ("geocodes", "NULL"),
+}
+# Scopes whose last change seq is also kept in scope_versions (never pruned),
+# for ETags that must match across workers and survive change_log pruning
+_VERSIONED_SCOPES = {"students"}
+
+
+def sqlite_file(eng: Optional[Engine] = None) -> str | None:
+    """Path of the SQLite database file, or None (in-memory / other backends)."""
+    eng = eng or get_engine()
+    if eng.dialect.name != "sqlite":
+        return None
+    db = eng.url.database
+    if not db or db == ":memory:" or db.startswith("file::memory:"):
+        return None
+    return os.path.abspath(db)
+
+
+@contextmanager
+def schema_lock(eng: Optional[Engine] = None):
+    """Exclusive file lock so only one process (uvicorn worker) migrates at a time."""
+    path = sqlite_file(eng)
+    try:
+        import fcntl
+    except ImportError:  # Windows dev: single process, no lock needed
+        fcntl = None
+    if path is None or fcntl is None:
+        yield
+        return
+    with open(path + ".init.lock", "a") as fh:
+        fcntl.flock(fh, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+# Bump together with a new entry in _MIGRATIONS. A boot at the current version
+# costs one SELECT: no table inspection, no DDL, no lock.
+SCHEMA_VERSION = 7
+
+
+def _schema_version(conn) -> int:
+    try:
+        return conn.execute(text("SELECT MAX(version) FROM schema_version")).scalar() or 0
+    except OperationalError:  # table missing: fresh file or pre-versioning deploy
+        return 0
+
+
+def init_schema(eng: Optional[Engine] = None):
+    """Bring the database to SCHEMA_VERSION, running only the missing migrations."""
+    eng = eng or get_engine()
+    with eng.connect() as conn:
+        if _schema_version(conn) >= SCHEMA_VERSION:
+            return
+    with schema_lock(eng):
+        with eng.connect() as conn:
+            current = _schema_version(conn)  # another worker may have finished meanwhile
+        for version in range(current + 1, SCHEMA_VERSION + 1):
+            _MIGRATIONS[version](eng)
+            with eng.begin() as conn:
+                conn.execute(text("DELETE FROM schema_version"))
+                conn.execute(text("INSERT INTO schema_version (version) VALUES (:v)"), {"v": version})
+
+
+def _migrate_v1(engine: Engine):
+    """Baseline: everything up to versioning. Idempotent, so it also upgrades
+    databases created before schema_version existed."""
+    from app import models  # noqa: F401  (registers tables on Base.metadata)
+
+    Base.metadata.create_all(bind=engine)
+    insp = inspect(engine)
+    with engine.begin() as conn:
+        for table, columns in _ADDED_COLUMNS.items():
+            have = {c["name"] for c in insp.get_columns(table)}
+            for name, ddl in columns.items():
+                if name not in have:
+                    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {ddl}"))
+        if "absences" in insp.get_table_names() and not any(
+            i["name"] == "uq_absences_student_date" for i in insp.get_indexes("absences")
+        ):
+            # Keep the latest row per (student_id, date) before the unique index goes on
+            conn.execute(text(
+                "DELETE FROM absences WHERE id NOT IN "
+                "(SELECT MAX(id) FROM absences GROUP BY student_id, date)"
+            ))
+        for table in Base.metadata.sorted_tables:
+            for idx in table.indexes:
+                idx.create(bind=conn, checkfirst=True)
+        if engine.dialect.name == "sqlite":
+            _create_change_triggers(conn, _CHANGE_TRIGGERS)
+
+
+def _create_change_triggers(conn, tables, versions: bool = False):
+    """change_log triggers; with versions (v7), _VERSIONED_SCOPES also upsert scope_versions."""
+    for table in tables:
+        scope, key = _CHANGE_TRIGGERS[table]
+        for op, row in (("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD")):
+            expr = key if key == "NULL" else f"{row}.{key}"
+            body = f"INSERT INTO change_log (scope, key) VALUES ('{scope}', {expr});"
+            if versions and scope in _VERSIONED_SCOPES:
+                body += (
+                    f" INSERT INTO scope_versions (scope, seq) SELECT '{scope}', (SELECT MAX(seq) FROM change_log)"
+                    " WHERE true ON CONFLICT(scope) DO UPDATE SET seq = excluded.seq;"
+                )
+            conn.execute(text(
+                f"CREATE TRIGGER IF NOT EXISTS trg_{table}_{op.lower()}_changes "
+                f"AFTER {op} ON {table} BEGIN {body} END"
+            ))
+
+
+# Columns an iCal feed shows; other updates (e.g. overdue flags) don't touch feeds
+_CALENDAR_COLUMNS = "title, body, address, due_at, completed_at, status, assignee_user_id, deleted_at"
+
+
+def _migrate_v2(engine: Engine):
+    """Calendar feeds: (assignee, due_at) and change_log (scope, key) indexes,
+    plus 'calendar' change rows keyed by assignee."""
+    from app import models  # noqa: F401
+
+    with engine.begin() as conn:
+        for name in ("tasks", "change_log"):
+            for idx in Base.metadata.tables[name].indexes:
+                idx.create(bind=conn, checkfirst=True)
+        if engine.dialect.name != "sqlite":
+            return
+        _create_calendar_triggers(conn)
+
+
+def _create_calendar_triggers(conn, versions: bool = False):
+    """'calendar' change rows keyed by assignee; with versions, each one also
+    becomes that teacher's durable feed version in calendar_versions (v6)."""
+    log = "INSERT INTO change_log (scope, key) SELECT 'calendar', {0} WHERE {0} IS NOT NULL{1};"
+    if versions:
+        log += (
+            " INSERT INTO calendar_versions (user_id, seq) SELECT {0}, (SELECT MAX(seq) FROM change_log)"
+            " WHERE {0} IS NOT NULL{1} ON CONFLICT(user_id) DO UPDATE SET seq = excluded.seq;"
+        )
+    conn.execute(text(
+        "CREATE TRIGGER IF NOT EXISTS trg_tasks_insert_calendar AFTER INSERT ON tasks "
+        f"BEGIN {log.format('NEW.assignee_user_id', '')} END"
+    ))
+    conn.execute(text(
+        "CREATE TRIGGER IF NOT EXISTS trg_tasks_delete_calendar AFTER DELETE ON tasks "
+        f"BEGIN {log.format('OLD.assignee_user_id', '')} END"
+    ))
+    # Reassignment changes both the old and the new teacher's feed
+    conn.execute(text(
+        "CREATE TRIGGER IF NOT EXISTS trg_tasks_update_calendar "
+        f"AFTER UPDATE OF {_CALENDAR_COLUMNS} ON tasks BEGIN "
+        f"{log.format('NEW.assignee_user_id', '')} "
+        f"{log.format('OLD.assignee_user_id', ' AND OLD.assignee_user_id IS NOT NEW.assignee_user_id')} END"
+    ))
+
+
+def _migrate_v3(engine: Engine):
+    """Webhook outbox: every task_events insert also queues a delivery row."""
+    from app import models
+
+    with engine.begin() as conn:
+        for model in (models.WebhookOutbox, models.WebhookCursor, models.WebhookDeadLetter):
+            model.__table__.create(bind=conn, checkfirst=True)
+        if engine.dialect.name != "sqlite":
+            return
+        # A trigger covers every writer (ORM, bulk inserts, jobs, seed) and
+        # commits or rolls back together with the event itself
+        conn.execute(text(
+            "CREATE TRIGGER IF NOT EXISTS trg_task_events_outbox AFTER INSERT ON task_events BEGIN "
+            "INSERT INTO webhook_outbox (event_id, task_id, payload) VALUES (NEW.id, NEW.task_id, "
+            "json_object('id', NEW.id, 'task_id', NEW.task_id, 'type', NEW.type, "
+            "'metadata', json(NEW.metadata), 'actor_user_id', NEW.actor_user_id, "
+            "'created_at', NEW.created_at)); END"
+        ))
+
+
+def _migrate_v4(engine: Engine):
+    """Audit rollups (app.audit): task_event_rollups and the events-by-task index."""
+    from app import models
+
+    with engine.begin() as conn:
+        models.TaskEventRollup.__table__.create(bind=conn, checkfirst=True)
+        for idx in models.TaskEvent.__table__.indexes:
+            idx.create(bind=conn, checkfirst=True)
+        if engine.dialect.name == "sqlite":
+            _create_change_triggers(conn, ["task_event_rollups"])
+
+
+def _migrate_v5(engine: Engine):
+    """Rule watermark on absences.seq: a change sequence that ingest upserts bump
+    (the upsert keeps absences.id, so corrected rows were never re-evaluated)."""
+    insp = inspect(engine)
+    with engine.begin() as conn:
+        for table, column, ddl in (("absences", "seq", "INTEGER"),
+                                   ("rule_state", "last_seq", "INTEGER NOT NULL DEFAULT 0")):
+            if column not in {c["name"] for c in insp.get_columns(table)}:
+                conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+        # Not declared on the model: _migrate_v1 builds every model index, and on a
+        # pre-versioning database it runs before this ALTER adds the column
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_absences_seq ON absences (seq)"))
+        # Existing rows keep their order, so the old id watermark carries over as is
+        conn.execute(text("UPDATE absences SET seq = id WHERE seq IS NULL"))
+        conn.execute(text("UPDATE rule_state SET last_seq = last_absence_id WHERE last_seq = 0"))
+        if engine.dialect.name != "sqlite":
+            return
+        # Triggers run inside the writer's transaction, so seqs commit in order
+        bump = "UPDATE absences SET seq = (SELECT COALESCE(MAX(seq), 0) + 1 FROM absences) WHERE id = NEW.id;"
+        conn.execute(text(
+            f"CREATE TRIGGER IF NOT EXISTS trg_absences_insert_seq AFTER INSERT ON absences BEGIN {bump} END"
+        ))
+        conn.execute(text(
+            "CREATE TRIGGER IF NOT EXISTS trg_absences_update_seq "
+            "AFTER UPDATE OF student_id, date, reason_code ON absences "
+            "WHEN OLD.student_id IS NOT NEW.student_id OR OLD.date IS NOT NEW.date "
+            f"OR OLD.reason_code IS NOT NEW.reason_code BEGIN {bump} END"
+        ))
+
+
+def _migrate_v6(engine: Engine):
+    """Durable calendar feed versions: change_log is pruned after minutes, so
+    the newest 'calendar' row per teacher can't serve as the feed ETag."""
+    from app import models
+
+    with engine.begin() as conn:
+        models.CalendarVersion.__table__.create(bind=conn, checkfirst=True)
+        if engine.dialect.name != "sqlite":
+            return
+        conn.execute(text(
+            "INSERT OR IGNORE INTO calendar_versions (user_id, seq) "
+            "SELECT key, MAX(seq) FROM change_log WHERE scope = 'calendar' AND key IS NOT NULL GROUP BY key"
+        ))
+        # Users whose rows were already pruned start at the current seq, which no
+        # earlier ETag can have paired with a different feed body
+        conn.execute(text(
+            "INSERT OR IGNORE INTO calendar_versions (user_id, seq) "
+            "SELECT id, COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'change_log'), 0) FROM users"
+        ))
+        for op in ("insert", "delete", "update"):
+            conn.execute(text(f"DROP TRIGGER IF EXISTS trg_tasks_{op}_calendar"))
+        _create_calendar_triggers(conn, versions=True)
+
+
+def _migrate_v7(engine: Engine):
+    """Durable scope versions for ETags (GET /api/students): the same in every
+    worker, and unaffected by change_log pruning."""
+    from app import models
+
+    with engine.begin() as conn:
+        models.ScopeVersion.__table__.create(bind=conn, checkfirst=True)
+        if engine.dialect.name != "sqlite":
+            return
+        tables = [t for t, (scope, _) in _CHANGE_TRIGGERS.items() if scope in _VERSIONED_SCOPES]
+        for scope in _VERSIONED_SCOPES:
+            # The current seq was never handed out as a version for different data
+            conn.execute(text(
+                "INSERT OR IGNORE INTO scope_versions (scope, seq) SELECT :scope, COALESCE("
+                "(SELECT MAX(seq) FROM change_log WHERE scope = :scope), "
+                "(SELECT seq FROM sqlite_sequence WHERE name = 'change_log'), 0)"
+            ), {"scope": scope})
+        for table in tables:
+            for op in ("insert", "update", "delete"):
+                conn.execute(text(f"DROP TRIGGER IF EXISTS trg_{table}_{op}_changes"))
+        _create_change_triggers(conn, tables, versions=True)
+
+
+# version -> migration; each must be safe to re-run if a boot dies halfway
+_MIGRATIONS = {
+    1: _migrate_v1,
+    2: _migrate_v2,
+    3: _migrate_v3,
+    4: _migrate_v4,
+    5: _migrate_v5,
+    6: _migrate_v6,
+    7: _migrate_v7,
+}
@@ -4,7 +4,7 @@ from fastapi import Depends, HTTPException, Security, Header
 from fastapi.security import APIKeyHeader
 from sqlalchemy.orm import Session
 
-from app.db import get_db
+from app.db import current_tenant, get_db
 from app.models import User, Role
 from app.config import settings
 
@@ -15,6 +15,14 @@ USER_FIXTURES = {
     "una":   3,  # User 2
 }
 
+# Brukere endres sjelden: (id, name, role) caches per prosess og skole, tømmes via app.coherence
+_user_cache: dict[tuple, tuple] = {}
+
+
+def invalidate_users() -> None:
+    _user_cache.clear()
+
+
 # Eksponer "X-User" som API-key i Swagger ("Authorize" knapp)
 x_user_scheme = APIKeyHeader(name="X-User", auto_error=False)
 
@@ -29,9 +37,15 @@ def get_current_user(
     if not uid:
         raise HTTPException(status_code=401, detail="Unauthorized")
 
+    cached = _user_cache.get((current_tenant.get(), uid))
+    if cached is not None:
+        # Detached snapshot; endpoints only read id/name/role
+        return User(id=cached[0], name=cached[1], role=cached[2])
+
     user = db.query(User).filter(User.id == uid).first()
     if not user:
         raise HTTPException(status_code=401, detail="User not found")
+    _user_cache[(current_tenant.get(), uid)] = (user.id, user.name, user.role)
     return user
 
 
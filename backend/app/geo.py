@@ -0,0 +1,72 @@
+# app/geo.py
+"""Local address -> coordinate gazetteer.
+
+Coordinates live in the ``geocodes`` table (seeded by ``app.seed``); the
+whole table is loaded into memory on first use, so lookups are dict hits.
+No external geocoding service is called.
+"""
+from __future__ import annotations
+
+import re
+import threading
+from typing import Dict, Mapping, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from .db import current_tenant
+from .models import Geocode
+
+LatLon = Tuple[float, float]
+
+_SPACES = re.compile(r"\s+")
+
+
+def normalize(address: str) -> str:
+    return _SPACES.sub(" ", address.strip().lower())
+
+
+class Gazetteer:
+    def __init__(self):
+        # One table per tenant database, so one dict per tenant
+        self._places: Dict[Optional[str], Dict[str, LatLon]] = {}
+        self._lock = threading.Lock()
+
+    def _load(self, db: Session) -> Dict[str, LatLon]:
+        tenant = current_tenant.get()
+        with self._lock:
+            places = self._places.get(tenant)
+            if places is None:
+                places = self._places[tenant] = {a: (lat, lon) for a, lat, lon in db.execute(
+                    select(Geocode.address, Geocode.lat, Geocode.lon)
+                )}
+            return places
+
+    def lookup(self, db: Session, address: Optional[str]) -> Optional[LatLon]:
+        if not address:
+            return None
+        return self._load(db).get(normalize(address))
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._places.pop(current_tenant.get(), None)
+
+
+gazetteer = Gazetteer()
+
+
+def ensure_geocodes(db: Session, places: Mapping[str, LatLon]) -> None:
+    """Upsert known coordinates into the gazetteer table."""
+    if not places:
+        return
+    stmt = sqlite_insert(Geocode)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Geocode.address],
+        set_={"lat": stmt.excluded.lat, "lon": stmt.excluded.lon},
+    )
+    db.execute(stmt, [
+        {"address": normalize(a), "lat": lat, "lon": lon} for a, (lat, lon) in places.items()
+    ])
+    db.commit()
+    gazetteer.invalidate()
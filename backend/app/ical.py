@@ -0,0 +1,132 @@
+# app/ical.py
+"""Per-teacher iCalendar (.ics) feeds.
+
+Calendar apps poll a feed URL without our X-User header, so the URL carries
+an HMAC key for the user id. The feed version is the teacher's row in
+calendar_versions: the seq of the last ``calendar`` change_log row for them,
+kept by triggers (db._migrate_v6) and never pruned. Each poll costs one
+primary-key lookup; the body is rebuilt only when that version changes.
+"""
+from __future__ import annotations
+
+import hashlib
+import hmac
+import logging
+from datetime import datetime, timedelta
+from typing import Iterable, List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from .cache import TTLCache
+from .config import settings
+from .db import current_tenant
+from .models import Task, TaskStatus
+
+log = logging.getLogger("app.ical")
+
+PRODID = "-//Simple Task Pro//Visits//EN"
+DEV_FEED_SECRET = "DEV_CALENDAR_SECRET"
+
+if settings.CALENDAR_FEED_SECRET == DEV_FEED_SECRET:
+    log.warning("CALENDAR_FEED_SECRET is the development default; anyone can forge feed URLs")
+
+# Entries are checked against the feed version on every hit, so the TTL only
+# bounds memory for teachers whose calendar app stopped polling
+calendar_cache = TTLCache(settings.CACHE_MAXSIZE, settings.CALENDAR_CACHE_TTL_SECONDS)
+
+
+def feed_key(user_id: int) -> str:
+    # Bound to the school too: user ids repeat across tenant databases
+    msg = f"calendar:{current_tenant.get() or ''}:{user_id}"
+    mac = hmac.new(settings.CALENDAR_FEED_SECRET.encode(), msg.encode(), hashlib.sha256)
+    return mac.hexdigest()[:32]
+
+
+def check_feed_key(user_id: int, key: str) -> bool:
+    return hmac.compare_digest(feed_key(user_id), key or "")
+
+
+def feed_version(db: Session, user_id: int) -> int:
+    """Seq of the last change to this teacher's feed; 0 if it never changed."""
+    return db.execute(
+        text("SELECT seq FROM calendar_versions WHERE user_id = :uid"), {"uid": user_id}
+    ).scalar() or 0
+
+
+def feed_since(now: Optional[datetime] = None) -> datetime:
+    """Oldest due date in a feed; midnight, so it moves once a day."""
+    day = (now or datetime.utcnow()).date() - timedelta(days=settings.CALENDAR_PAST_DAYS)
+    return datetime.combine(day, datetime.min.time())
+
+
+def feed_tasks(db: Session, user_id: int, since: datetime) -> List[Task]:
+    return (
+        db.query(Task)
+        .filter(
+            Task.assignee_user_id == user_id,
+            Task.due_at >= since,
+            Task.deleted_at.is_(None),
+            Task.status != TaskStatus.REJECTED,
+        )
+        .order_by(Task.due_at, Task.id)
+        .all()
+    )
+
+
+# --- Rendering (RFC 5545) ----------------------------------------------------
+def _escape(value: str) -> str:
+    return (
+        value.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,")
+        .replace("\r\n", "\\n").replace("\n", "\\n")
+    )
+
+
+def _fold(line: str) -> str:
+    # Lines longer than 75 octets continue on the next line after a space
+    raw = line.encode()
+    if len(raw) <= 75:
+        return line
+    parts, start = [], 0
+    while start < len(raw):
+        end = min(start + (75 if not parts else 74), len(raw))
+        while end < len(raw) and (raw[end] & 0xC0) == 0x80:  # don't split UTF-8 sequences
+            end -= 1
+        parts.append(raw[start:end].decode())
+        start = end
+    return "\r\n ".join(parts)
+
+
+def _stamp(dt: datetime) -> str:
+    return dt.strftime("%Y%m%dT%H%M%SZ")  # stored times are UTC
+
+
+def render(tasks: Iterable[Task], name: str) -> bytes:
+    duration = timedelta(minutes=settings.ROUTE_SERVICE_MINUTES)
+    lines = [
+        "BEGIN:VCALENDAR",
+        "VERSION:2.0",
+        f"PRODID:{PRODID}",
+        "CALSCALE:GREGORIAN",
+        f"X-WR-CALNAME:{_escape(name)}",
+    ]
+    for t in tasks:
+        done = t.status == TaskStatus.DONE
+        lines += [
+            "BEGIN:VEVENT",
+            f"UID:task-{t.id}@simple-task-pro",
+            f"SEQUENCE:{t.version}",
+            f"DTSTAMP:{_stamp(t.updated_at or t.due_at)}",
+            f"DTSTART:{_stamp(t.due_at)}",
+            f"DTEND:{_stamp(t.due_at + duration)}",
+            f"SUMMARY:{_escape(('✓ ' if done else '') + t.title)}",
+            # Accepted and done visits are fixed; the rest may still move
+            f"STATUS:{'CONFIRMED' if done or t.status == TaskStatus.ACCEPTED else 'TENTATIVE'}",
+        ]
+        if t.address:
+            lines.append(f"LOCATION:{_escape(t.address)}")
+        if t.body:
+            lines.append(f"DESCRIPTION:{_escape(t.body)}")
+        lines.append("END:VEVENT")
+    lines.append("END:VCALENDAR")
+    return ("\r\n".join(_fold(l) for l in lines) + "\r\n").encode()
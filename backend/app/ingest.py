@@ -0,0 +1,88 @@
+# app/ingest.py
+"""Bulk ingest for system-to-system feeds (attendance etc.)."""
+from __future__ import annotations
+
+from typing import Dict, List, Sequence, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from .models import Absence, Student
+from .schemas import AbsenceBatchResult, AbsenceIn, IngestError
+
+# Rows per executemany; keeps each statement well under SQLite's variable limit
+CHUNK = 500
+
+# Errors echoed back per request; counts are always complete
+MAX_ERRORS = 100
+
+_FIELDS = ("reason_code", "note", "reported_by")
+
+
+def upsert_absences(db: Session, items: Sequence[AbsenceIn]) -> AbsenceBatchResult:
+    """Insert or update absences on (student_id, date) in one transaction.
+
+    Unknown student ids are rejected. Within a batch the last record for a
+    key wins. Rows whose values already match are left untouched.
+    """
+    result = AbsenceBatchResult()
+    errors: List[IngestError] = []
+
+    # Preloaded once per batch; validating thousands of ids becomes set lookups
+    known_students = set(db.scalars(select(Student.id)))
+
+    rows: Dict[Tuple[int, object], dict] = {}
+    for i, a in enumerate(items):
+        if a.student_id not in known_students:
+            result.rejected += 1
+            if len(errors) < MAX_ERRORS:
+                errors.append(IngestError(index=i, student_id=a.student_id, detail="Unknown student"))
+            continue
+        key = (a.student_id, a.date)
+        if key in rows:
+            result.duplicates += 1
+        rows[key] = a.model_dump()
+    result.errors = errors
+    if not rows:
+        return result
+
+    # Existing values for the keys in this batch, to classify insert/update/unchanged
+    existing: Dict[Tuple[int, object], tuple] = {}
+    dates = sorted({d for _, d in rows})
+    student_ids = sorted({sid for sid, _ in rows})
+    for chunk_ids in _chunks(student_ids, CHUNK):
+        # Served by the (student_id, date) unique index
+        q = select(Absence.student_id, Absence.date, *[getattr(Absence, f) for f in _FIELDS]).where(
+            Absence.student_id.in_(chunk_ids), Absence.date.in_(dates)
+        )
+        for sid, d, *vals in db.execute(q):
+            if (sid, d) in rows:
+                existing[(sid, d)] = tuple(vals)
+
+    to_write = []
+    for key, row in rows.items():
+        old = existing.get(key)
+        if old is None:
+            result.inserted += 1
+        elif old != tuple(row[f] for f in _FIELDS):
+            result.updated += 1
+        else:
+            result.unchanged += 1
+            continue
+        to_write.append(row)
+
+    stmt = sqlite_insert(Absence)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Absence.student_id, Absence.date],
+        set_={f: getattr(stmt.excluded, f) for f in _FIELDS},
+    )
+    for chunk in _chunks(to_write, CHUNK):
+        db.execute(stmt, chunk)
+    db.commit()
+    return result
+
+
+def _chunks(seq: list, n: int):
+    for i in range(0, len(seq), n):
+        yield seq[i:i + n]
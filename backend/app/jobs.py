@@ -0,0 +1,224 @@
+# app/jobs.py
+"""Background jobs run by app.scheduler.
+
+Write jobs work in short batches (``SCHEDULER_BATCH_SIZE`` rows per
+transaction, selected through an index) so request handlers never wait long
+for the SQLite write lock.
+"""
+from __future__ import annotations
+
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, func, or_, select, text, update
+
+from .audit import rollup_events
+from .backup import backup_job
+from .cache import invalidate_task
+from .config import settings
+from .db import SessionLocal, get_engine
+from .models import (
+    ChangeLog, Comment, Task, TaskEvent, TaskEventRollup, TaskStatus, WebhookCursor, WebhookOutbox
+)
+from .rules import run_rules_job
+from .scheduler import Scheduler
+
+# Pause between batches so queued writers get the lock
+BATCH_PAUSE_SECONDS = 0.01
+
+# Workers older than this in reading the change feed clear their caches
+CHANGE_LOG_KEEP_MINUTES = 10
+
+# VACUUM rewrites the whole file and blocks writers; only worth it when this
+# fraction of pages is free
+VACUUM_FREE_RATIO = 0.2
+
+
+def _is_sqlite() -> bool:
+    return get_engine().dialect.name == "sqlite"
+
+
+def _batched_update(stmt_for_ids, values) -> int:
+    """Run UPDATE tasks ... WHERE id IN (<batch of ids>) until nothing matches.
+
+    Bookkeeping only: updated_at keeps its value instead of taking the
+    column's onupdate default.
+    """
+    values = {"updated_at": Task.updated_at, **values}
+    batch = settings.SCHEDULER_BATCH_SIZE
+    total = 0
+    with SessionLocal() as db:
+        while True:
+            ids = db.scalars(stmt_for_ids.limit(batch)).all()
+            if not ids:
+                return total
+            db.execute(
+                update(Task)
+                .where(Task.id.in_(ids))
+                .values(**values)
+                .execution_options(synchronize_session=False)
+            )
+            db.commit()
+            invalidate_task(*ids)
+            total += len(ids)
+            if len(ids) < batch:
+                return total
+            time.sleep(BATCH_PAUSE_SECONDS)
+
+
+def flag_overdue() -> int:
+    """Set overdue_at on tasks past due_at that are not done; clear it when no longer true."""
+    now = datetime.utcnow()
+    flagged = _batched_update(
+        select(Task.id).where(
+            Task.due_at < now,
+            Task.overdue_at.is_(None),
+            Task.deleted_at.is_(None),
+            Task.status != TaskStatus.DONE,
+        ),
+        {"overdue_at": now},
+    )
+    cleared = _batched_update(
+        select(Task.id).where(
+            Task.overdue_at.is_not(None),
+            or_(
+                Task.status == TaskStatus.DONE,
+                Task.due_at.is_(None),
+                Task.due_at >= now,
+                Task.deleted_at.is_not(None),
+            ),
+        ),
+        {"overdue_at": None},
+    )
+    return flagged + cleared
+
+
+def purge_deleted() -> int:
+    """Hard-delete tasks soft-deleted longer ago than the restore window."""
+    cutoff = datetime.utcnow() - timedelta(hours=settings.RESTORE_WINDOW_HOURS)
+    batch = settings.SCHEDULER_BATCH_SIZE
+    total = 0
+    with SessionLocal() as db:
+        while True:
+            ids = db.scalars(
+                select(Task.id).where(Task.deleted_at < cutoff).limit(batch)
+            ).all()
+            if not ids:
+                return total
+            db.execute(delete(Comment).where(Comment.task_id.in_(ids)))
+            db.execute(delete(TaskEvent).where(TaskEvent.task_id.in_(ids)))
+            db.execute(delete(TaskEventRollup).where(TaskEventRollup.task_id.in_(ids)))
+            db.execute(
+                delete(Task).where(Task.id.in_(ids)).execution_options(synchronize_session=False)
+            )
+            db.commit()
+            invalidate_task(*ids, with_comments=True)
+            total += len(ids)
+            if len(ids) < batch:
+                return total
+            time.sleep(BATCH_PAUSE_SECONDS)
+
+
+def prune_change_log() -> int:
+    """Drop change_log rows every worker has long since read."""
+    cutoff = datetime.utcnow() - timedelta(minutes=CHANGE_LOG_KEEP_MINUTES)
+    batch = settings.SCHEDULER_BATCH_SIZE * 10
+    total = 0
+    with SessionLocal() as db:
+        while True:
+            top = db.scalar(
+                select(ChangeLog.seq).where(ChangeLog.created_at < cutoff)
+                .order_by(ChangeLog.seq).offset(batch - 1).limit(1)
+            )
+            if top is None:
+                res = db.execute(delete(ChangeLog).where(ChangeLog.created_at < cutoff))
+            else:
+                res = db.execute(delete(ChangeLog).where(ChangeLog.seq <= top))
+            db.commit()
+            total += res.rowcount
+            if top is None:
+                return total
+            time.sleep(BATCH_PAUSE_SECONDS)
+
+
+# --- SQLite maintenance ------------------------------------------------------
+def _pragma(sql: str):
+    with get_engine().connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        res = conn.execute(text(sql))
+        return res.fetchall() if res.returns_rows else []
+
+
+def wal_checkpoint() -> int:
+    """PASSIVE checkpoint: copies what it can without waiting on readers/writers."""
+    if not _is_sqlite():
+        return 0
+    rows = _pragma("PRAGMA wal_checkpoint(PASSIVE)")
+    busy, log_pages, checkpointed = rows[0] if rows else (0, 0, 0)
+    return max(checkpointed, 0)
+
+
+def optimize() -> int:
+    if not _is_sqlite():
+        return 0
+    _pragma("PRAGMA optimize")
+    return 0
+
+
+def analyze() -> int:
+    if not _is_sqlite():
+        return 0
+    _pragma("ANALYZE")
+    return 0
+
+
+def vacuum_if_fragmented() -> int:
+    """VACUUM when enough pages are free; returns the number of pages reclaimed."""
+    if not _is_sqlite():
+        return 0
+    page_count = _pragma("PRAGMA page_count")[0][0]
+    free = _pragma("PRAGMA freelist_count")[0][0]
+    if not page_count or free / page_count < VACUUM_FREE_RATIO:
+        return 0
+    _pragma("VACUUM")
+    _pragma("PRAGMA wal_checkpoint(TRUNCATE)")
+    return free
+
+
+def prune_outbox() -> int:
+    """Drop webhook_outbox rows every configured endpoint has moved past."""
+    names = [e.name for e in settings.WEBHOOKS if e.enabled]
+    batch = settings.SCHEDULER_BATCH_SIZE * 10
+    total = 0
+    with SessionLocal() as db:
+        if names:
+            cursors = db.scalars(select(WebhookCursor.last_id).where(WebhookCursor.endpoint.in_(names))).all()
+            if len(cursors) < len(names):
+                return 0  # an endpoint hasn't started yet
+            floor = min(cursors)
+        else:
+            floor = db.scalar(select(func.max(WebhookOutbox.id))) or 0
+        start = db.scalar(select(func.min(WebhookOutbox.id)))
+        while start is not None and start <= floor:
+            top = min(start + batch - 1, floor)
+            res = db.execute(delete(WebhookOutbox).where(WebhookOutbox.id <= top))
+            db.commit()
+            total += res.rowcount
+            start = top + 1
+            time.sleep(BATCH_PAUSE_SECONDS)
+    return total
+
+
+def register_default_jobs(s: Scheduler) -> Scheduler:
+    s.every("flag_overdue", 60, flag_overdue)
+    s.every("visit_rules", 60, run_rules_job)
+    s.every("wal_checkpoint", 300, wal_checkpoint)
+    s.every("prune_change_log", 300, prune_change_log)
+    s.every("prune_outbox", 300, prune_outbox)
+    s.cron("purge_deleted", "10 * * * *", purge_deleted)   # hourly
+    s.cron("optimize", "0 */6 * * *", optimize)
+    s.cron("analyze", "15 3 * * *", analyze)               # nightly
+    s.cron("rollup_events", "0 4 * * *", rollup_events)    # nightly
+    s.cron("vacuum", "30 3 * * 0", vacuum_if_fragmented)   # Sunday night
+    if settings.BACKUP_CRON:
+        s.cron("backup", settings.BACKUP_CRON, backup_job)
+    return s
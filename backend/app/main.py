@@ -1,29 +1,52 @@
 from __future__ import annotations
 
 import os
-from datetime import datetime, timedelta
-from typing import List, Optional
+import time
+from datetime import date, datetime, timedelta
+from typing import List, Optional, Tuple
 
-from fastapi import FastAPI, Depends, HTTPException, Request
+from fastapi import FastAPI, Depends, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse
 from fastapi.staticfiles import StaticFiles
+from pydantic import TypeAdapter
+from starlette.concurrency import run_in_threadpool
 from starlette.responses import Response
-from sqlalchemy import text
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
+from sqlalchemy.orm.exc import StaleDataError
 
-from app.db import Base, engine, get_db
+from app.db import (
+    current_tenant, engines, get_db, init_schema, resolve_tenant, tenancy_enabled, tenant_exists, use_tenant
+)
 from app.config import settings
 from app.models import (
-    Task, TaskStatus, TaskEventType, User, Student, Absence, Role, Comment
+    Task, TaskStatus, TaskEventType, TaskEvent, User, Student, Absence, Role, Comment
 )
 from app.schemas import (
     UserOut, TaskIn, TaskOut, TaskEdit, AssignIn, StatusIn, TaskEventOut,
     AbsenceIn, AbsenceOut, StudentIn, StudentOut, HistoryItem,
-    CommentCreate, CommentOut
+    CommentCreate, CommentOut, AbsenceBatchResult, BoardOut, BoardTaskOut, LastEventOut, StudentBrief,
+    RouteOut, RouteStop, RouteUnlocated, AutoAssignIn, AutoAssignOut, CalendarFeedOut
+)
+from app import backup
+from app.assign import auto_assign
+from app.audit import edit_diff, encode_edit, event_view
+from app.cache import (
+    task_cache, task_key, events_key, comments_key, students_key,
+    invalidate_task, invalidate_comments, invalidate_students,
 )
-from app.deps import get_current_user, require_admin
-from app.utils import log_event, soft_delete, restore
+from app.coherence import feed, scope_version
+from app.deps import get_current_user, require_admin, require_api_token, invalidate_users
+from app.ical import calendar_cache, check_feed_key, feed_key, feed_since, feed_tasks, feed_version, render
+from app.ingest import upsert_absences
+from app.geo import gazetteer
+from app.rules import run_rules
+from app.jobs import register_default_jobs
+from app.scheduler import scheduler
+from app.webhooks import dispatcher
+from app.utils import log_event, naive_utc, soft_delete, restore, transition_status, ASSIGNABLE_STATUSES
 
 # -------------------- App + CORS --------------------
 
@@ -60,9 +83,61 @@ async def no_cache_index(request: Request, call_next):
         resp.headers["Cache-Control"] = "no-store"
     return resp
 
+# Multi-worker: pick up other processes' commits before serving (see app.coherence)
+# A task row change may move the assignee, so the comments ACL goes too
+feed.subscribe("task", lambda keys: invalidate_task(*keys, with_comments=True))
+feed.subscribe("comments", lambda keys: invalidate_comments(*keys))
+feed.subscribe("students", lambda keys: invalidate_students())
+feed.subscribe("users", lambda keys: invalidate_users())
+feed.subscribe("geocodes", lambda keys: gazetteer.invalidate())
+for _reset in (task_cache.clear, invalidate_users, gazetteer.invalidate):
+    feed.on_reset(_reset)
+
+# feed.sync() does sqlite I/O and, on a tenant's first request, opens its
+# engine and runs migrations, so it goes to the threadpool (which copies the
+# tenant contextvar set by route_tenant)
+@app.middleware("http")
+async def sync_change_feed(request: Request, call_next):
+    if request.url.path.startswith("/api/"):
+        await run_in_threadpool(feed.sync)
+    return await call_next(request)
+
+# Multi-school: pick the tenant database before anything touches the DB.
+# Registered last so it wraps the feed sync above.
+engines.on_evict(feed.drop)
+
+@app.middleware("http")
+async def route_tenant(request: Request, call_next):
+    path = request.url.path
+    if not tenancy_enabled() or not path.startswith("/api/") or path == "/api/health":
+        return await call_next(request)
+    tenant = resolve_tenant(request.headers.get(settings.TENANT_HEADER), request.headers.get("host"))
+    # Calendar apps can't send headers; feed URLs carry the school as ?tenant=
+    tenant = tenant or request.query_params.get("tenant")
+    if not tenant:
+        return JSONResponse(status_code=400, content={"detail": f"Missing school ({settings.TENANT_HEADER} header or subdomain)"})
+    if not tenant_exists(tenant):
+        return JSONResponse(status_code=404, content={"detail": "Unknown school"})
+    with use_tenant(tenant):
+        return await call_next(request)
+
+# A concurrent write bumped Task.version between our read and our flush
+@app.exception_handler(StaleDataError)
+async def stale_data_handler(request: Request, exc: StaleDataError):
+    return JSONResponse(status_code=409, content={"detail": "Task was modified by someone else"})
+
 @app.on_event("startup")
 def on_startup():
-    Base.metadata.create_all(bind=engine)
+    init_schema()
+    if settings.SCHEDULER_ENABLED:
+        register_default_jobs(scheduler)
+        scheduler.start()
+        dispatcher.start()
+
+@app.on_event("shutdown")
+def on_shutdown():
+    dispatcher.stop()
+    scheduler.stop()
 
 # -------------------- Health / Me --------------------
 
@@ -75,20 +150,85 @@ def health():
 def me(user: User = Depends(get_current_user)):
     return user
 
+# -------------------- Background jobs --------------------
+
+@app.get("/api/admin/jobs", dependencies=[Depends(require_admin)])
+def job_metrics():
+    """Per-job run counts, durations and errors for this worker's scheduler."""
+    return scheduler.metrics()
+
+@app.post("/api/admin/rules/run", dependencies=[Depends(require_admin)])
+def run_visit_rules(db: Session = Depends(get_db)):
+    """Evaluate absence rules now instead of waiting for the scheduler."""
+    return run_rules(db)
+
+@app.get("/api/admin/webhooks", dependencies=[Depends(require_admin)])
+def webhook_metrics():
+    """Per-endpoint cursor, backlog and delivery counters (counters are this worker's)."""
+    return dispatcher.metrics()
+
+@app.get("/api/admin/cache", dependencies=[Depends(require_admin)])
+def cache_metrics():
+    """Hit/miss counters for the task detail/events/comments cache."""
+    return {
+        **task_cache.stats(),
+        "calendar": calendar_cache.stats(),
+        "change_feed": feed.stats(),
+        "tenant_engines": engines.stats() if tenancy_enabled() else None,
+    }
+
+@app.get("/api/admin/backups", dependencies=[Depends(require_admin)])
+def list_backups():
+    """Snapshots on disk for this database, newest first, plus this worker's last backup report."""
+    try:
+        snaps = backup.list_snapshots(backup.db_label())
+    except backup.BackupError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    return {"dir": backup.backup_dir(), "snapshots": snaps, "last": backup.last_report()}
+
+@app.post("/api/admin/backups", dependencies=[Depends(require_admin)])
+def create_backup():
+    """Take an online snapshot now; writers keep committing while pages are copied."""
+    try:
+        return backup.create()
+    except backup.BackupBusy as exc:
+        raise HTTPException(status_code=409, detail=str(exc))
+    except backup.BackupError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+# -------------------- Cached reads --------------------
+# Cached values are (acl, json_bytes); acl = (assignee_user_id, created_by)
+# so permissions are checked on every hit, not just when the entry is loaded.
+
+_events_adapter = TypeAdapter(List[TaskEventOut])
+_comments_adapter = TypeAdapter(List[CommentOut])
+
+def _json(body: bytes) -> Response:
+    return Response(content=body, media_type="application/json")
+
+def _can_view(user: User, acl: Tuple[Optional[int], Optional[int]]) -> bool:
+    return user.role == Role.ADMIN or user.id in acl
+
 # -------------------- Comments --------------------
 
 @app.get("/api/tasks/{task_id}/comments", response_model=List[CommentOut])
-def list_comments(task_id: int, db: Session = Depends(get_db)):
-    task = db.query(Task).filter(Task.id == task_id).first()
-    if not task:
-        raise HTTPException(status_code=404, detail="Task not found")
-    items = (
-        db.query(Comment)
-        .filter(Comment.task_id == task_id)
-        .order_by(Comment.created_at.asc())
-        .all()
-    )
-    return items
+def list_comments(task_id: int, db: Session = Depends(get_db), user: User = Depends(get_current_user)):
+    def load():
+        task = db.query(Task).filter(Task.id == task_id).first()
+        if not task:
+            raise HTTPException(status_code=404, detail="Task not found")
+        items = (
+            db.query(Comment)
+            .filter(Comment.task_id == task_id)
+            .order_by(Comment.created_at.asc())
+            .all()
+        )
+        return (task.assignee_user_id, task.created_by), _comments_adapter.dump_json(items)
+
+    acl, body = task_cache.get_or_load(comments_key(task_id), load)
+    if not _can_view(user, acl):
+        raise HTTPException(status_code=403, detail="Forbidden")
+    return _json(body)
 
 @app.post("/api/tasks/{task_id}/comments", response_model=CommentOut)
 def add_comment(task_id: int, body: CommentCreate, db: Session = Depends(get_db), user: User = Depends(get_current_user)):
@@ -99,6 +239,7 @@ def add_comment(task_id: int, body: CommentCreate, db: Session = Depends(get_db)
     c = Comment(task_id=task_id, author=author, text=body.text.strip())
     db.add(c)
     db.commit()
+    invalidate_comments(task_id)
     db.refresh(c)
     return c
 
@@ -109,12 +250,26 @@ def create_student(data: StudentIn, db: Session = Depends(get_db), user: User =
     s = Student(name=data.name, student_class=data.student_class, address=data.address)
     db.add(s)
     db.commit()
+    invalidate_students()
     db.refresh(s)
     return s
 
+_students_adapter = TypeAdapter(List[StudentOut])
+
 @app.get("/api/students", response_model=List[StudentOut])
-def list_students(db: Session = Depends(get_db), user: User = Depends(get_current_user)):
-    return db.query(Student).all()
+def list_students(request: Request, db: Session = Depends(get_db), user: User = Depends(get_current_user)):
+    # ETag from the durable scope version (scope_versions, kept by triggers):
+    # the same in every worker, and unaffected by change_log pruning
+    etag = f'W/"students-{scope_version(db, "students")}"' if feed.active else None
+    if etag and request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    body = task_cache.get_or_load(
+        students_key(), lambda: _students_adapter.dump_json(db.query(Student).all())
+    )
+    resp = _json(body)
+    if etag:
+        resp.headers["ETag"] = etag
+    return resp
 
 @app.get("/api/students/{student_id}/history", response_model=List[HistoryItem])
 def student_history(student_id: int, days: int = 90, db: Session = Depends(get_db), user: User = Depends(get_current_user)):
@@ -160,10 +315,21 @@ def create_absence(data: AbsenceIn, db: Session = Depends(get_db), user: User =
         reported_by=data.reported_by
     )
     db.add(a)
-    db.commit()
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=409, detail="Absence already registered for this student and date")
     db.refresh(a)
     return a
 
+# Attendance feed: thousands of records per call, idempotent on (student_id, date)
+@app.post("/api/ingest/absences", response_model=AbsenceBatchResult, dependencies=[Depends(require_api_token)])
+def ingest_absences(items: List[AbsenceIn], db: Session = Depends(get_db)):
+    if len(items) > settings.INGEST_MAX_BATCH:
+        raise HTTPException(status_code=413, detail=f"Max {settings.INGEST_MAX_BATCH} records per batch")
+    return upsert_absences(db, items)
+
 # -------------------- Tasks --------------------
 
 @app.post("/api/tasks", response_model=TaskOut, dependencies=[Depends(require_admin)])
@@ -184,7 +350,12 @@ def list_tasks(
     sort: Optional[str] = None,
     order: Optional[str] = None
 ):
-    q = db.query(Task).filter(Task.deleted_at.is_(None))
+    return _visible_tasks(db.query(Task), user, status, scope, sort, order).all()
+
+def _visible_tasks(q, user: User, status: Optional[TaskStatus], scope: Optional[str],
+                   sort: Optional[str], order: Optional[str]):
+    """Apply list_tasks' visibility, status filter and sorting to a Task query."""
+    q = q.filter(Task.deleted_at.is_(None))
     if status:
         q = q.filter(Task.status == status)
     # Scope: admins can request 'all' (default); users default to 'my'
@@ -201,16 +372,69 @@ def list_tasks(
         q = q.order_by(col.is_(None), col.desc())
     else:
         q = q.order_by(col.is_(None), col.asc())
-    return q.all()
+    return q
+
+# Board bootstrap: me + users + visible tasks (with comment counts and last
+# event) + students in four queries, whatever the number of tasks.
+@app.get("/api/board", response_model=BoardOut)
+def board(
+    db: Session = Depends(get_db),
+    user: User = Depends(get_current_user),
+    status: Optional[TaskStatus] = None,
+    scope: Optional[str] = None,
+    sort: Optional[str] = None,
+    order: Optional[str] = None
+):
+    users = db.query(User).order_by(User.id).all()
+
+    comment_counts = (
+        db.query(Comment.task_id.label("task_id"), func.count(Comment.id).label("n"))
+        .group_by(Comment.task_id)
+        .subquery()
+    )
+    last_ids = (
+        db.query(TaskEvent.task_id.label("task_id"), func.max(TaskEvent.id).label("event_id"))
+        .group_by(TaskEvent.task_id)
+        .subquery()
+    )
+    q = (
+        db.query(
+            Task,
+            func.coalesce(comment_counts.c.n, 0),
+            TaskEvent.type, TaskEvent.actor_user_id, TaskEvent.created_at,
+        )
+        .outerjoin(comment_counts, comment_counts.c.task_id == Task.id)
+        .outerjoin(last_ids, last_ids.c.task_id == Task.id)
+        .outerjoin(TaskEvent, TaskEvent.id == last_ids.c.event_id)
+    )
+    tasks = []
+    for t, n_comments, ev_type, ev_actor, ev_at in _visible_tasks(q, user, status, scope, sort, order):
+        item = BoardTaskOut.model_validate(t)
+        item.comment_count = n_comments
+        if ev_type is not None:
+            item.last_event = LastEventOut(type=ev_type, actor_user_id=ev_actor, created_at=ev_at)
+        tasks.append(item)
+
+    students = db.query(Student.id, Student.name, Student.student_class).order_by(Student.id).all()
+    return BoardOut(
+        me=user,
+        users=users,
+        tasks=tasks,
+        students=[StudentBrief(id=i, name=n, student_class=c) for i, n, c in students],
+    )
 
 @app.get("/api/tasks/{task_id}", response_model=TaskOut)
 def get_task(task_id: int, db: Session = Depends(get_db), user: User = Depends(get_current_user)):
-    t = db.query(Task).filter(Task.id == task_id).first()
-    if not t or t.deleted_at is not None:
-        raise HTTPException(status_code=404, detail="Task not found")
-    if user.role != Role.ADMIN and t.assignee_user_id != user.id and t.created_by != user.id:
+    def load():
+        t = db.query(Task).filter(Task.id == task_id).first()
+        if not t or t.deleted_at is not None:
+            raise HTTPException(status_code=404, detail="Task not found")
+        return (t.assignee_user_id, t.created_by), TaskOut.model_validate(t).model_dump_json().encode()
+
+    acl, body = task_cache.get_or_load(task_key(task_id), load)
+    if not _can_view(user, acl):
         raise HTTPException(status_code=403, detail="Forbidden")
-    return t
+    return _json(body)
 
 # Single edit endpoint for tasks
 @app.patch("/api/tasks/{task_id}", response_model=TaskOut)
@@ -233,15 +457,22 @@ def edit_task(task_id: int, data: TaskEdit, db: Session = Depends(get_db), user:
         if disallowed:
             raise HTTPException(status_code=403, detail=f"Fields not allowed for user: {sorted(disallowed)}")
 
-    changed = {}
-    for k, v in payload.items():
-        setattr(t, k, v)
-        changed[k] = v
+    # due_at is stored as naive UTC
+    if payload.get("due_at") is not None:
+        payload["due_at"] = naive_utc(payload["due_at"])
+
+    # Forms resend every field; only real changes are written and logged
+    diff = edit_diff(t, payload)
+    if not diff:
+        return t
+    for k in diff:
+        setattr(t, k, payload[k])
 
     db.add(t)
     db.commit()
     db.refresh(t)
-    log_event(db, t, user, TaskEventType.EDIT, {"changed": changed})
+    log_event(db, t, user, TaskEventType.EDIT, encode_edit(diff))
+    invalidate_task(task_id)
     return t
 
 @app.delete("/api/tasks/{task_id}", dependencies=[Depends(require_admin)])
@@ -267,63 +498,184 @@ def assign_task(task_id: int, data: AssignIn, db: Session = Depends(get_db), use
         raise HTTPException(status_code=404, detail="Task not found")
     prev = t.assignee_user_id
     t.assignee_user_id = data.assignee_user_id
-    if t.status in [TaskStatus.NEW, TaskStatus.REJECTED]:
+    if t.status in ASSIGNABLE_STATUSES:
         t.status = TaskStatus.ASSIGNED
     db.add(t)
     db.commit()
     db.refresh(t)
     evt = TaskEventType.ASSIGN if prev is None or prev == data.assignee_user_id else TaskEventType.REASSIGN
     log_event(db, t, user, evt, {"from": prev, "to": data.assignee_user_id})
+    invalidate_task(task_id, with_comments=True)  # comments ACL carries the assignee
     return t
 
+@app.post("/api/tasks/auto-assign", response_model=AutoAssignOut, dependencies=[Depends(require_admin)])
+def auto_assign_tasks(data: AutoAssignIn, db: Session = Depends(get_db), user: User = Depends(get_current_user)):
+    """Distribute all unassigned NEW tasks across teachers by open workload."""
+    return auto_assign(db, user, data.user_ids, data.prefer_previous, data.max_per_user)
+
 @app.post("/api/tasks/{task_id}/status", response_model=TaskOut)
 def change_status(task_id: int, data: StatusIn, db: Session = Depends(get_db), user: User = Depends(get_current_user)):
-    t = db.query(Task).filter(Task.id == task_id, Task.deleted_at.is_(None)).first()
-    if not t:
-        raise HTTPException(status_code=404, detail="Task not found")
-    if user.role != Role.ADMIN and t.assignee_user_id != user.id:
-        raise HTTPException(status_code=403, detail="Forbidden")
-
     action = data.action
-    now_iso = datetime.utcnow().isoformat()
-    if action == "accept":
-        t.status = TaskStatus.ACCEPTED
-        log_event(db, t, user, TaskEventType.ACCEPT, {"at": now_iso})
-    elif action == "reject":
+    now = datetime.utcnow()
+    values = {}
+    meta = {"at": now.isoformat()}
+    if action == "reject":
         if not data.reason:
             raise HTTPException(status_code=400, detail="Reason required for reject")
-        t.status = TaskStatus.REJECTED
-        t.body = (data.reason or "").strip()  # store reason in Task.body
-        log_event(db, t, user, TaskEventType.REJECT, {"reason": data.reason, "at": now_iso})
+        values["body"] = data.reason.strip()  # store reason in Task.body
+        meta["reason"] = data.reason
     elif action == "complete":
-        t.status = TaskStatus.DONE
-        t.completed_at = datetime.utcnow()
-        log_event(db, t, user, TaskEventType.COMPLETE, {"at": now_iso})
-    else:
-        raise HTTPException(status_code=400, detail="Invalid action")
+        values["completed_at"] = now
 
-    db.add(t)
+    # Single conditional UPDATE ... RETURNING + event insert, one commit
+    t = transition_status(db, task_id, action, user, data.version, values, meta)
+    out = TaskOut.model_validate(t)
     db.commit()
-    db.refresh(t)
-    return t
+    invalidate_task(task_id)
+    return out
 
 @app.get("/api/tasks/{task_id}/events", response_model=List[TaskEventOut])
 def task_events(task_id: int, db: Session = Depends(get_db), user: User = Depends(get_current_user)):
-    t = db.query(Task).filter(Task.id == task_id).first()
-    if not t:
-        raise HTTPException(status_code=404, detail="Task not found")
-    if user.role != Role.ADMIN and t.assignee_user_id != user.id and t.created_by != user.id:
+    def load():
+        t = db.query(Task).filter(Task.id == task_id).first()
+        if not t:
+            raise HTTPException(status_code=404, detail="Task not found")
+        return (t.assignee_user_id, t.created_by), _events_adapter.dump_json(event_view(db, task_id))
+
+    acl, body = task_cache.get_or_load(events_key(task_id), load)
+    if not _can_view(user, acl):
         raise HTTPException(status_code=403, detail="Forbidden")
+    return _json(body)
 
-    rows = db.execute(
-        text(
-            "SELECT id, task_id, type, metadata, actor_user_id, created_at "
-            "FROM task_events WHERE task_id = :tid ORDER BY created_at DESC"
-        ),
-        {"tid": task_id}
-    ).mappings().all()
+# -------------------- Route planning --------------------
 
-    return [TaskEventOut(**dict(r)) for r in rows]
+@app.get("/api/route", response_model=RouteOut)
+def day_route(
+    day: Optional[date] = None,
+    user_id: Optional[int] = None,
+    lat: Optional[float] = None,
+    lon: Optional[float] = None,
+    db: Session = Depends(get_db),
+    user: User = Depends(get_current_user),
+):
+    """Visit order for a teacher's open tasks due on `day`.
+
+    Teachers get their own route; admins may pass user_id. lat/lon is an
+    optional start position, otherwise the route starts at the first visit.
+    """
+    from app.routing import plan_route  # NumPy is imported on first use, not at boot
+
+    t0 = time.perf_counter()
+    day = day or date.today()
+    uid = user.id
+    if user_id is not None and user_id != user.id:
+        if user.role != Role.ADMIN:
+            raise HTTPException(status_code=403, detail="Forbidden")
+        uid = user_id
+    if (lat is None) != (lon is None):
+        raise HTTPException(status_code=400, detail="lat and lon must be given together")
+
+    day_start = datetime.combine(day, datetime.min.time())
+    tasks = (
+        db.query(Task)
+        .filter(
+            Task.assignee_user_id == uid,
+            Task.deleted_at.is_(None),
+            Task.status.in_([TaskStatus.ASSIGNED, TaskStatus.ACCEPTED]),
+            Task.due_at >= day_start,
+            Task.due_at < day_start + timedelta(days=1),
+        )
+        .order_by(Task.due_at, Task.id)
+        .all()
+    )
+    located, coords, unlocated = [], [], []
+    for t in tasks:
+        pos = gazetteer.lookup(db, t.address)
+        if pos is None:
+            unlocated.append(RouteUnlocated(task_id=t.id, title=t.title, address=t.address))
+        else:
+            located.append(t)
+            coords.append(pos)
+
+    start_at = day_start + timedelta(hours=settings.ROUTE_DAY_START_HOUR)
+    plan = plan_route(
+        coords, [t.due_at for t in located], start_at,
+        start=(lat, lon) if lat is not None else None,
+        speed_kmh=settings.ROUTE_SPEED_KMH,
+        service_min=settings.ROUTE_SERVICE_MINUTES,
+    )
+    stops = []
+    for idx, leg, eta in zip(plan.order, plan.legs_km, plan.etas):
+        t = located[idx]
+        stops.append(RouteStop(
+            task_id=t.id, title=t.title, address=t.address,
+            lat=coords[idx][0], lon=coords[idx][1],
+            due_at=t.due_at, eta=eta, leg_km=leg,
+            late=t.due_at is not None and eta > t.due_at,
+        ))
+    return RouteOut(
+        day=day, user_id=uid, start_at=start_at,
+        total_km=round(plan.total_km, 3), late_minutes=plan.late_minutes,
+        stops=stops, unlocated=unlocated,
+        elapsed_ms=round((time.perf_counter() - t0) * 1000, 2),
+    )
+
+# -------------------- Calendar --------------------
+
+@app.get("/api/calendar", response_model=List[TaskOut])
+def calendar(
+    from_: datetime = Query(..., alias="from"),
+    to: datetime = Query(...),
+    scope: Optional[str] = None,
+    db: Session = Depends(get_db),
+    user: User = Depends(get_current_user),
+):
+    """Visible tasks with from <= due_at < to, earliest first. Undated tasks are never included."""
+    # due_at is stored as naive UTC; clients may send either form for each bound
+    from_, to = naive_utc(from_), naive_utc(to)
+    if to <= from_:
+        raise HTTPException(status_code=400, detail="'to' must be after 'from'")
+    if to - from_ > timedelta(days=settings.CALENDAR_MAX_RANGE_DAYS):
+        raise HTTPException(status_code=400, detail=f"Max range is {settings.CALENDAR_MAX_RANGE_DAYS} days")
+    q = db.query(Task).filter(Task.due_at >= from_, Task.due_at < to)
+    return _visible_tasks(q, user, None, scope, "due_at", "asc").all()
+
+@app.get("/api/calendar/feed", response_model=CalendarFeedOut)
+def calendar_feed_url(
+    request: Request,
+    user_id: Optional[int] = None,
+    user: User = Depends(get_current_user),
+):
+    """iCal subscription URL for the caller (admins may pass user_id)."""
+    uid = user.id
+    if user_id is not None and user_id != user.id:
+        if user.role != Role.ADMIN:
+            raise HTTPException(status_code=403, detail="Forbidden")
+        uid = user_id
+    url = request.url_for("calendar_feed", user_id=uid).include_query_params(key=feed_key(uid))
+    if tenancy_enabled():
+        url = url.include_query_params(tenant=current_tenant.get())
+    return CalendarFeedOut(user_id=uid, url=str(url))
+
+# Polled by calendar apps: one index probe and a 304 while nothing changed
+@app.get("/api/calendar/{user_id}.ics", name="calendar_feed")
+def calendar_feed(user_id: int, request: Request, key: str = "", db: Session = Depends(get_db)):
+    if not check_feed_key(user_id, key):
+        raise HTTPException(status_code=404, detail="Feed not found")
+    since = feed_since()
+    etag = f'W/"cal-{user_id}-{feed_version(db, user_id)}-{since:%Y%m%d}"' if feed.active else None
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"} if etag else {}
+    if etag and request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    cached = calendar_cache.get((current_tenant.get(), user_id)) if etag else None
+    if cached is not None and cached[0] == etag:
+        body = cached[1]
+    else:
+        owner = db.get(User, user_id)
+        body = render(feed_tasks(db, user_id, since), f"Visits: {owner.name if owner else user_id}")
+        if etag:
+            calendar_cache.set((current_tenant.get(), user_id), (etag, body))
+    return Response(content=body, media_type="text/calendar; charset=utf-8", headers=headers)
 
 # -------------------- SPA fallback (last) --------------------
 
@@ -2,7 +2,7 @@ import enum
 from datetime import datetime
 
 from sqlalchemy import (
-    Column, Integer, String, DateTime, ForeignKey, Text, JSON, Date, func
+    Column, Integer, String, DateTime, ForeignKey, Text, JSON, Date, Float, Index, UniqueConstraint, func
 )
 from sqlalchemy import Enum as SAEnum
 from sqlalchemy.orm import relationship
@@ -34,6 +34,7 @@ class TaskEventType(str, enum.Enum):
     ACCEPT = "Accept"
     REJECT = "Reject"
     COMPLETE = "Complete"
+    ROLLUP = "Rollup"  # never stored in task_events; labels the summary in the events view
 
 
 # ---------------- Core tables ----------------
@@ -61,6 +62,14 @@ class Absence(Base):
     note = Column(Text, nullable=True)
     reported_by = Column(String, nullable=False)
     created_at = Column(DateTime, server_default=func.now(), nullable=False)
+    # Change sequence, set by triggers on insert and on rule-relevant updates (rule watermark).
+    # Its index ix_absences_seq is created in db._migrate_v5, after the column exists
+    seq = Column(Integer, nullable=True)
+
+    # Én registrering per elev per dag (upsert-nøkkel for ingest)
+    __table_args__ = (
+        Index("uq_absences_student_date", "student_id", "date", unique=True),
+    )
 
 
 class Task(Base):
@@ -78,7 +87,7 @@ class Task(Base):
     # Sjekkliste lagres som JSON-liste [{text, done}], MutableList gjør at endringer fanges opp
     checklist = Column(MutableList.as_mutable(JSON), nullable=True, default=list)
 
-    due_at = Column(DateTime, nullable=True)
+    due_at = Column(DateTime, nullable=True, index=True)
     completed_at = Column(DateTime, nullable=True)
     status = Column(SAEnum(TaskStatus), default=TaskStatus.NEW, nullable=False)
 
@@ -86,7 +95,17 @@ class Task(Base):
     created_by = Column(Integer, ForeignKey("users.id"), nullable=True)
 
     updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
-    deleted_at = Column(DateTime, nullable=True)
+    deleted_at = Column(DateTime, nullable=True, index=True)
+    # Satt av bakgrunnsjobben når due_at er passert og oppgaven ikke er ferdig
+    overdue_at = Column(DateTime, nullable=True, index=True)
+
+    # Optimistisk låsing: økes ved hver skriving, ORM-flush feiler med StaleDataError ved kappløp
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+
+    __mapper_args__ = {"version_id_col": version}
+
+    # A teacher's tasks in a due-date range: /api/calendar, .ics feeds, /api/route
+    __table_args__ = (Index("ix_tasks_assignee_due", "assignee_user_id", "due_at"),)
 
 
 class Comment(Base):
@@ -111,3 +130,139 @@ class TaskEvent(Base):
 
     actor_user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     created_at = Column(DateTime, server_default=func.now(), nullable=False)
+
+    # The events endpoint reads one task's events newest first straight off this index
+    __table_args__ = (Index("ix_task_events_task_created", "task_id", "created_at", "id"),)
+
+
+class TaskEventRollup(Base):
+    """Old task_events folded into one summary per task (see app.audit.rollup_events).
+
+    Covers event ids first_event_id..last_event_id. Every remaining event for
+    the task is newer than last_event_id.
+    """
+    __tablename__ = "task_event_rollups"
+    task_id = Column(Integer, ForeignKey("tasks.id"), primary_key=True)
+    first_event_id = Column(Integer, nullable=False)
+    last_event_id = Column(Integer, nullable=False)
+    events = Column(Integer, nullable=False)
+    first_at = Column(DateTime, nullable=False)
+    last_at = Column(DateTime, nullable=False)
+    last_actor_user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    summary = Column(JSON, nullable=False)  # counts, actors, net field changes, assignee
+
+
+class SchedulerLease(Base):
+    """Leader lease so only one process runs background jobs."""
+    __tablename__ = "scheduler_leases"
+    name = Column(String, primary_key=True)
+    owner = Column(String, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+
+
+class RuleState(Base):
+    """Watermark: highest absences.seq the rule engine has processed."""
+    __tablename__ = "rule_state"
+    name = Column(String, primary_key=True)
+    last_absence_id = Column(Integer, nullable=False, default=0)  # pre-v5 watermark (absences.id)
+    last_seq = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+
+
+class RuleTrigger(Base):
+    """Last time a rule fired for a student; absences up to last_absence_date
+    never count towards another task for the same rule."""
+    __tablename__ = "rule_triggers"
+    id = Column(Integer, primary_key=True)
+    rule = Column(String, nullable=False)
+    student_id = Column(Integer, ForeignKey("students.id"), nullable=False)
+    last_absence_date = Column(Date, nullable=False)
+    task_id = Column(Integer, ForeignKey("tasks.id"), nullable=True)
+    created_at = Column(DateTime, server_default=func.now(), nullable=False)
+
+    __table_args__ = (UniqueConstraint("rule", "student_id", name="uq_rule_triggers_rule_student"),)
+
+
+class Geocode(Base):
+    """Local gazetteer: normalized address -> coordinates (see app.geo)."""
+    __tablename__ = "geocodes"
+    address = Column(String, primary_key=True)
+    lat = Column(Float, nullable=False)
+    lon = Column(Float, nullable=False)
+
+
+class ChangeLog(Base):
+    """Append-only change feed filled by SQLite triggers (see db._CHANGE_TRIGGERS)."""
+    __tablename__ = "change_log"
+    seq = Column(Integer, primary_key=True, autoincrement=True)
+    scope = Column(String, nullable=False)
+    key = Column(Integer, nullable=True)
+    created_at = Column(DateTime, server_default=func.now(), nullable=False)
+
+    # AUTOINCREMENT: seq never goes backwards, even after pruning empties the table.
+    # (scope, key) gives "last change for this key" in one index probe (calendar ETags).
+    __table_args__ = (
+        Index("ix_change_log_scope_key", "scope", "key"),
+        {"sqlite_autoincrement": True},
+    )
+
+
+class CalendarVersion(Base):
+    """Durable iCal feed version per teacher: the change_log seq of the last
+    change to their feed, kept by the calendar triggers and never pruned."""
+    __tablename__ = "calendar_versions"
+    user_id = Column(Integer, primary_key=True)
+    seq = Column(Integer, nullable=False)
+
+
+class ScopeVersion(Base):
+    """Durable last change seq of a change_log scope (db._VERSIONED_SCOPES),
+    kept by triggers and never pruned; used for cross-worker ETags."""
+    __tablename__ = "scope_versions"
+    scope = Column(String, primary_key=True)
+    seq = Column(Integer, nullable=False)
+
+
+class WebhookOutbox(Base):
+    """One row per task_events insert, written by a trigger in the same
+    transaction (db._migrate_v3); delivered by app.webhooks."""
+    __tablename__ = "webhook_outbox"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    event_id = Column(Integer, nullable=False)
+    task_id = Column(Integer, nullable=False)
+    payload = Column(Text, nullable=False)  # JSON snapshot of the event row
+    created_at = Column(DateTime, server_default=func.now(), nullable=False)
+
+    # Cursors compare ids, so ids must never be reused after pruning
+    __table_args__ = {"sqlite_autoincrement": True}
+
+
+class WebhookCursor(Base):
+    """Delivery position per endpoint: every outbox id <= last_id is delivered."""
+    __tablename__ = "webhook_cursors"
+    endpoint = Column(String, primary_key=True)
+    last_id = Column(Integer, nullable=False, default=0)
+    attempts = Column(Integer, nullable=False, default=0)  # failed tries of the current batch
+    next_attempt_at = Column(DateTime, nullable=True)
+    last_error = Column(String, nullable=True)
+    delivered = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+
+
+class WebhookDeadLetter(Base):
+    """Batch given up on after WEBHOOK_MAX_ATTEMPTS; outbox ids first_id..last_id."""
+    __tablename__ = "webhook_dead_letters"
+    id = Column(Integer, primary_key=True)
+    endpoint = Column(String, nullable=False, index=True)
+    first_id = Column(Integer, nullable=False)
+    last_id = Column(Integer, nullable=False)
+    attempts = Column(Integer, nullable=False)
+    error = Column(String, nullable=True)
+    payload = Column(Text, nullable=False)  # the undelivered request body, for replay
+    created_at = Column(DateTime, server_default=func.now(), nullable=False)
+
+
+class SchemaVersion(Base):
+    """Single row: schema version applied by db.init_schema."""
+    __tablename__ = "schema_version"
+    version = Column(Integer, primary_key=True)
@@ -0,0 +1,141 @@
+# app/routing.py
+"""Daily visit route planning.
+
+Distances come from a vectorized haversine matrix. The visit order is the
+better of earliest-due-first and nearest-neighbour, then improved with
+2-opt. A move is kept only if it does not make deadlines worse: routes are
+compared on (minutes late, distance). The start node is a depot row; when
+no start position is given it is a dummy with zero distance to every stop,
+so the route simply starts at its first visit.
+"""
+from __future__ import annotations
+
+from datetime import datetime, timedelta
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+EARTH_KM = 6371.0088
+
+
+def distance_matrix(coords: np.ndarray) -> np.ndarray:
+    """Great-circle distances (km) between all rows of an (n, 2) lat/lon array."""
+    rad = np.radians(coords)
+    lat = rad[:, 0][:, None]
+    lon = rad[:, 1][:, None]
+    dlat = lat - lat.T
+    dlon = lon - lon.T
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat) * np.cos(lat.T) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+class RoutePlan:
+    def __init__(self, order: List[int], legs_km: List[float], etas: List[datetime],
+                 late_minutes: float):
+        self.order = order          # indexes into the stops passed in
+        self.legs_km = legs_km
+        self.etas = etas
+        self.late_minutes = late_minutes
+
+    @property
+    def total_km(self) -> float:
+        return float(sum(self.legs_km))
+
+
+def _schedule(route: Sequence[int], dist: np.ndarray, deadlines: np.ndarray,
+              km_per_min: float, service_min: float) -> Tuple[float, float, np.ndarray]:
+    """Return (minutes late, km, arrival minutes) for a route of node ids (0 = depot)."""
+    legs = dist[np.concatenate(([0], route[:-1])), route]
+    travel = legs / km_per_min
+    # arrival_i = sum(travel[:i+1]) + service * i
+    arrivals = np.cumsum(travel) + service_min * np.arange(len(route))
+    late = np.maximum(arrivals - deadlines[route], 0.0).sum()
+    return float(late), float(legs.sum()), arrivals
+
+
+def _nearest_neighbour(dist: np.ndarray) -> np.ndarray:
+    n = dist.shape[0]
+    seen = np.zeros(n, dtype=bool)
+    seen[0] = True
+    route = []
+    cur = 0
+    for _ in range(n - 1):
+        row = np.where(seen, np.inf, dist[cur])
+        cur = int(np.argmin(row))
+        seen[cur] = True
+        route.append(cur)
+    return np.array(route, dtype=int)
+
+
+def _two_opt(route: np.ndarray, dist: np.ndarray, deadlines: np.ndarray,
+             km_per_min: float, service_min: float, max_passes: int = 50) -> np.ndarray:
+    best_key = _schedule(route, dist, deadlines, km_per_min, service_min)[:2]
+    n = len(route)
+    for _ in range(max_passes):
+        improved = False
+        for i in range(n - 1):
+            path = np.concatenate(([0], route))
+            a, b = path[i], path[i + 1]
+            c = path[i + 2:n + 1]
+            d = np.append(path[i + 3:n + 1], -1)
+            # Reversing route[i..j] swaps edges (a,b),(c,d) for (a,c),(b,d);
+            # the path is open, so the last j has no d (-1)
+            d_cd = np.where(d >= 0, dist[c, np.maximum(d, 0)], 0.0)
+            d_bd = np.where(d >= 0, dist[b, np.maximum(d, 0)], 0.0)
+            delta = dist[a, c] + d_bd - dist[a, b] - d_cd
+            # Try distance-saving reversals, best first; keep the first that
+            # also doesn't add lateness
+            for k in np.argsort(delta):
+                if delta[k] >= -1e-9:
+                    break
+                j = i + 1 + int(k)
+                cand = route.copy()
+                cand[i:j + 1] = cand[i:j + 1][::-1]
+                key = _schedule(cand, dist, deadlines, km_per_min, service_min)[:2]
+                if key < best_key:
+                    route, best_key, improved = cand, key, True
+                    break
+        if not improved:
+            break
+    return route
+
+
+def plan_route(coords: Sequence[Tuple[float, float]], deadlines: Sequence[Optional[datetime]],
+               start_at: datetime, start: Optional[Tuple[float, float]] = None,
+               speed_kmh: float = 20.0, service_min: float = 20.0) -> RoutePlan:
+    """Order stops to minimise lateness, then distance.
+
+    ``deadlines[i]`` is the latest arrival for stop i (None = any time).
+    """
+    n = len(coords)
+    if n == 0:
+        return RoutePlan([], [], [], 0.0)
+
+    pts = np.asarray(coords, dtype=float)
+    if start is not None:
+        pts = np.vstack(([start], pts))
+        dist = distance_matrix(pts)
+    else:
+        dist = np.zeros((n + 1, n + 1))
+        dist[1:, 1:] = distance_matrix(pts)
+
+    dl = np.full(n + 1, np.inf)
+    for i, d in enumerate(deadlines, start=1):
+        if d is not None:
+            dl[i] = (d - start_at).total_seconds() / 60.0
+    km_per_min = speed_kmh / 60.0
+
+    # Candidates: earliest-due-first (stable on input order) and nearest neighbour
+    edd = np.argsort(dl[1:], kind="stable") + 1
+    nn = _nearest_neighbour(dist)
+    route = min((edd, nn), key=lambda r: _schedule(r, dist, dl, km_per_min, service_min)[:2])
+    route = _two_opt(route, dist, dl, km_per_min, service_min)
+
+    late, _km, arrivals = _schedule(route, dist, dl, km_per_min, service_min)
+    legs = dist[np.concatenate(([0], route[:-1])), route]
+    return RoutePlan(
+        order=[int(r) - 1 for r in route],
+        legs_km=[round(float(x), 3) for x in legs],
+        etas=[start_at + timedelta(minutes=float(m)) for m in arrivals],
+        late_minutes=round(late, 1),
+    )
@@ -0,0 +1,171 @@
+# app/rules.py
+"""Absence -> home-visit rule engine.
+
+Each run only looks at absences whose ``seq`` is above the persisted
+watermark. Triggers bump ``seq`` on insert and when an upsert changes the
+student, date or reason code, so corrected feed rows are evaluated again. For
+every rule, one grouped query finds the students whose window now holds
+enough matching absences (through the (student_id, date) index); tasks,
+events and trigger rows are then written in bulk in the same transaction.
+
+A rule fires at most once per absence: the trigger row remembers the last
+absence date that was counted, and only later absences count next time.
+"""
+from __future__ import annotations
+
+from datetime import date, datetime, time, timedelta
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import func, insert, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from .config import VisitRule, settings
+from .db import SessionLocal
+from .models import (
+    Absence, RuleState, RuleTrigger, Student, Task, TaskEvent, TaskEventType, TaskStatus,
+)
+
+WATERMARK = "absence_rules"
+RULE_ACTOR_ID = 1  # Admin, same actor as the ingest endpoints (deps.get_admin_user)
+
+
+def _claim_range(db: Session) -> Optional[tuple]:
+    """Move the watermark to the current max absence seq.
+
+    The conditional UPDATE runs first, so a concurrent run blocks on the
+    write lock and then finds the watermark already moved.
+    """
+    state = db.get(RuleState, WATERMARK)
+    if state is None:
+        state = RuleState(name=WATERMARK, last_seq=0)
+        db.add(state)
+        db.flush()
+    low = state.last_seq
+    high = db.scalar(select(func.max(Absence.seq))) or 0
+    if high <= low:
+        return None
+    res = db.execute(
+        update(RuleState)
+        .where(RuleState.name == WATERMARK, RuleState.last_seq == low)
+        .values(last_seq=high)
+        .execution_options(synchronize_session=False)
+    )
+    if res.rowcount != 1:
+        return None
+    return low, high
+
+
+def _matches(db: Session, rule: VisitRule, low: int, high: int) -> List[Any]:
+    """Students whose newest matching absence in (low, high] completes the rule."""
+    codes = list(rule.reason_codes)
+
+    # Students touched by new matching absences, with their newest absence date
+    touched = (
+        select(Absence.student_id, func.max(Absence.date).label("end_date"))
+        .where(Absence.seq > low, Absence.seq <= high, Absence.reason_code.in_(codes))
+        .group_by(Absence.student_id)
+        .subquery()
+    )
+    start = func.date(touched.c.end_date, f"-{rule.window_days - 1} days")
+    q = (
+        select(
+            Absence.student_id,
+            func.count().label("n"),
+            func.max(Absence.date).label("last_date"),
+        )
+        .join(touched, touched.c.student_id == Absence.student_id)
+        .outerjoin(
+            RuleTrigger,
+            (RuleTrigger.rule == rule.name) & (RuleTrigger.student_id == Absence.student_id),
+        )
+        .where(
+            Absence.reason_code.in_(codes),
+            Absence.date >= start,
+            Absence.date <= touched.c.end_date,
+            Absence.seq <= high,
+            (RuleTrigger.id.is_(None)) | (Absence.date > RuleTrigger.last_absence_date),
+        )
+        .group_by(Absence.student_id)
+        .having(func.count() >= rule.min_count)
+    )
+    return db.execute(q).all()
+
+
+def _create_visits(db: Session, rule: VisitRule, hits: List[Any], now: datetime) -> int:
+    if not hits:
+        return 0
+    ids = [h.student_id for h in hits]
+    students = {
+        s.id: s for s in db.execute(
+            select(Student.id, Student.name, Student.address).where(Student.id.in_(ids))
+        )
+    }
+    due = datetime.combine(date.today() + timedelta(days=rule.due_in_days), time(9, 0))
+
+    task_rows = []
+    for h in hits:
+        s = students[h.student_id]
+        task_rows.append({
+            "student_id": s.id,
+            "title": rule.title.format(student=s.name),
+            "body": f"{h.n} absences ({', '.join(rule.reason_codes)}) in {rule.window_days} days",
+            "address": s.address,
+            "checklist": [],
+            "due_at": due,
+            "status": TaskStatus.NEW,
+            "created_by": RULE_ACTOR_ID,
+            "version": 1,
+        })
+    # RETURNING gives the new ids in one round-trip (SQLite >= 3.35)
+    task_ids = db.scalars(insert(Task).returning(Task.id, sort_by_parameter_order=True), task_rows).all()
+
+    db.execute(insert(TaskEvent), [
+        {
+            "task_id": tid,
+            "type": TaskEventType.EDIT,
+            "meta": {"create": True, "rule": rule.name, "absences": h.n},
+            "actor_user_id": RULE_ACTOR_ID,
+            "created_at": now,
+        }
+        for tid, h in zip(task_ids, hits)
+    ])
+
+    trig = sqlite_insert(RuleTrigger)
+    trig = trig.on_conflict_do_update(
+        index_elements=[RuleTrigger.rule, RuleTrigger.student_id],
+        set_={"last_absence_date": trig.excluded.last_absence_date, "task_id": trig.excluded.task_id},
+    )
+    db.execute(trig, [
+        {"rule": rule.name, "student_id": h.student_id, "last_absence_date": _as_date(h.last_date), "task_id": tid}
+        for tid, h in zip(task_ids, hits)
+    ])
+    return len(task_ids)
+
+
+def _as_date(v) -> date:
+    return v if isinstance(v, date) else date.fromisoformat(str(v))
+
+
+def run_rules(db: Session, rules: Optional[List[VisitRule]] = None) -> Dict[str, Any]:
+    """Evaluate all rules over absences newer than the watermark; one transaction."""
+    rules = settings.VISIT_RULES if rules is None else rules
+    claimed = _claim_range(db)
+    if claimed is None:
+        db.commit()
+        return {"absences": 0, "created": {}}
+    low, high = claimed
+    now = datetime.utcnow()
+    created = {}
+    for rule in rules:
+        created[rule.name] = _create_visits(db, rule, _matches(db, rule, low, high), now)
+    # seq values are shared with updates and not contiguous; count the rows
+    processed = db.scalar(select(func.count()).where(Absence.seq > low, Absence.seq <= high))
+    db.commit()
+    return {"absences": processed, "from_seq": low, "to_seq": high, "created": created}
+
+
+def run_rules_job() -> int:
+    """Scheduler entry point; returns the number of tasks created."""
+    with SessionLocal() as db:
+        return sum(run_rules(db)["created"].values())
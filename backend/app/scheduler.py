@@ -0,0 +1,318 @@
+# app/scheduler.py
+"""In-process job scheduler.
+
+Every uvicorn worker starts a scheduler thread, but only the worker holding
+the lease row in ``scheduler_leases`` runs jobs. The lease is renewed on every
+tick, before each job (and each school), and from a heartbeat thread while a
+job runs. It expires after ``SCHEDULER_LEASE_SECONDS``, so another worker
+takes over if the leader dies. A leader that finds the lease taken stops
+before its next job.
+
+With tenancy on, the lease lives in the main database, and each due job
+runs once per school database, one after the other.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Set
+
+from sqlalchemy import or_, update
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+from .config import settings
+from .db import SessionLocal, list_tenants, tenancy_enabled, use_tenant
+from .models import SchedulerLease
+
+log = logging.getLogger("app.scheduler")
+
+LEASE_NAME = "scheduler"
+TICK_SECONDS = 1.0
+
+
+# --- Cron expressions --------------------------------------------------------
+def _parse_field(expr: str, lo: int, hi: int) -> Set[int]:
+    values: Set[int] = set()
+    for part in expr.split(","):
+        step = 1
+        if "/" in part:
+            part, step_s = part.split("/", 1)
+            step = int(step_s)
+        if part == "*":
+            start, end = lo, hi
+        elif "-" in part:
+            a, b = part.split("-", 1)
+            start, end = int(a), int(b)
+        else:
+            start = end = int(part)
+        if start < lo or end > hi or step < 1:
+            raise ValueError(f"cron field out of range: {expr!r}")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class CronSpec:
+    """Five-field cron expression: minute hour day-of-month month day-of-week.
+
+    Supports ``*``, lists, ranges and steps. Day-of-week is 0-6 with Sunday=0.
+    """
+
+    def __init__(self, expr: str):
+        fields = expr.split()
+        if len(fields) != 5:
+            raise ValueError(f"cron needs 5 fields: {expr!r}")
+        self.expr = expr
+        self.minutes = sorted(_parse_field(fields[0], 0, 59))
+        self.hours = sorted(_parse_field(fields[1], 0, 23))
+        self.days = _parse_field(fields[2], 1, 31)
+        self.months = _parse_field(fields[3], 1, 12)
+        self.weekdays = {d % 7 for d in _parse_field(fields[4], 0, 7)}
+        self._any_day = fields[2] == "*"
+        self._any_weekday = fields[4] == "*"
+
+    def _day_matches(self, d: datetime) -> bool:
+        if d.month not in self.months:
+            return False
+        dom = d.day in self.days
+        dow = (d.isoweekday() % 7) in self.weekdays
+        # Classic cron: if both are restricted, either one may match
+        if self._any_day:
+            return dow
+        if self._any_weekday:
+            return dom
+        return dom or dow
+
+    def next_after(self, after: datetime) -> datetime:
+        start = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        day = start.replace(hour=0, minute=0)
+        for _ in range(366 * 5):
+            if self._day_matches(day):
+                for h in self.hours:
+                    for m in self.minutes:
+                        cand = day.replace(hour=h, minute=m)
+                        if cand >= start:
+                            return cand
+            day += timedelta(days=1)
+        raise ValueError(f"cron never fires: {self.expr!r}")
+
+
+# --- Jobs --------------------------------------------------------------------
+@dataclass
+class JobStats:
+    runs: int = 0
+    failures: int = 0
+    rows: int = 0
+    last_started_at: Optional[datetime] = None
+    last_duration_ms: Optional[float] = None
+    last_rows: Optional[int] = None
+    last_error: Optional[str] = None
+
+
+@dataclass
+class Job:
+    name: str
+    func: Callable[[], Optional[int]]  # returns number of rows touched
+    interval: Optional[timedelta] = None
+    cron: Optional[CronSpec] = None
+    next_run: Optional[datetime] = None
+    stats: JobStats = field(default_factory=JobStats)
+
+    def schedule_next(self, now: datetime) -> None:
+        if self.cron is not None:
+            self.next_run = self.cron.next_after(now)
+        else:
+            self.next_run = now + self.interval
+
+
+class Scheduler:
+    def __init__(self, session_factory=SessionLocal, lease_seconds: Optional[int] = None):
+        self._session_factory = session_factory
+        self._lease_seconds = lease_seconds or settings.SCHEDULER_LEASE_SECONDS
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.jobs: Dict[str, Job] = {}
+        self.is_leader = False
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    # -- registration -------------------------------------------------------
+    def every(self, name: str, seconds: float, func: Callable[[], Optional[int]]) -> Job:
+        job = Job(name=name, func=func, interval=timedelta(seconds=seconds))
+        self.jobs[name] = job
+        return job
+
+    def cron(self, name: str, expr: str, func: Callable[[], Optional[int]]) -> Job:
+        job = Job(name=name, func=func, cron=CronSpec(expr))
+        self.jobs[name] = job
+        return job
+
+    # -- leader lease -------------------------------------------------------
+    def _renew_lease(self) -> bool:
+        now = datetime.utcnow()
+        expires = now + timedelta(seconds=self._lease_seconds)
+        with self._session_factory() as db:
+            try:
+                res = db.execute(
+                    update(SchedulerLease)
+                    .where(
+                        SchedulerLease.name == LEASE_NAME,
+                        or_(SchedulerLease.owner == self.owner, SchedulerLease.expires_at < now),
+                    )
+                    .values(owner=self.owner, expires_at=expires)
+                )
+                if res.rowcount == 0:
+                    db.add(SchedulerLease(name=LEASE_NAME, owner=self.owner, expires_at=expires))
+                db.commit()
+                return True
+            except IntegrityError:
+                # Lease row exists and another worker holds it
+                db.rollback()
+                return False
+            except OperationalError:
+                # Database busy; keep current role until next tick
+                db.rollback()
+                return self.is_leader
+
+    def _hold_lease(self) -> bool:
+        """Renew the lease between jobs; False (and leadership dropped) if another worker took it."""
+        self.is_leader = self._renew_lease()
+        if not self.is_leader:
+            log.warning("scheduler lease lost: %s", self.owner)
+        return self.is_leader
+
+    @contextmanager
+    def _heartbeat(self):
+        """Renew the lease from a side thread while a job runs, so long jobs don't lose it."""
+        done = threading.Event()
+
+        def beat() -> None:
+            while not done.wait(max(0.5, self._lease_seconds / 3)):
+                try:
+                    if not self._renew_lease():
+                        self.is_leader = False
+                        log.warning("scheduler lease lost during a job: %s", self.owner)
+                        return
+                except Exception:
+                    log.exception("scheduler heartbeat failed")
+
+        thread = threading.Thread(target=beat, name="scheduler-heartbeat", daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            done.set()
+            thread.join()
+
+    def _release_lease(self) -> None:
+        if not self.is_leader:
+            return
+        with self._session_factory() as db:
+            db.execute(
+                update(SchedulerLease)
+                .where(SchedulerLease.name == LEASE_NAME, SchedulerLease.owner == self.owner)
+                .values(expires_at=datetime.utcnow())
+            )
+            db.commit()
+        self.is_leader = False
+
+    # -- running ------------------------------------------------------------
+    def run_job(self, job: Job) -> None:
+        stats = job.stats
+        stats.last_started_at = datetime.utcnow()
+        t0 = time.perf_counter()
+        rows = 0
+        stats.last_error = None
+        for tenant in (list_tenants() if tenancy_enabled() else [None]):
+            if not self._hold_lease():
+                stats.last_error = "lease lost; remaining schools skipped"
+                break
+            try:
+                with self._heartbeat(), use_tenant(tenant):
+                    rows += job.func() or 0
+            except Exception as exc:  # keep the loop (and other schools) going; surface via metrics
+                stats.failures += 1
+                where = f"[{tenant}] " if tenant else ""
+                stats.last_error = f"{where}{type(exc).__name__}: {exc}"
+                log.exception("job %s failed %s", job.name, where)
+        stats.last_rows = rows
+        stats.rows += rows
+        stats.runs += 1
+        stats.last_duration_ms = round((time.perf_counter() - t0) * 1000, 2)
+
+    def tick(self, now: Optional[datetime] = None) -> None:
+        now = now or datetime.utcnow()
+        was_leader = self.is_leader
+        self.is_leader = self._renew_lease()
+        if not self.is_leader:
+            return
+        if not was_leader:
+            log.info("scheduler leader: %s", self.owner)
+        for job in list(self.jobs.values()):
+            if not self.is_leader:
+                return  # lost during an earlier job; the new leader runs the rest
+            if job.next_run is None:
+                job.schedule_next(now)
+            if job.next_run <= now:
+                self.run_job(job)
+                job.schedule_next(datetime.utcnow())
+
+    def _loop(self) -> None:
+        lease_every = max(1.0, self._lease_seconds / 3)
+        last_lease = 0.0
+        self._stop.wait(settings.SCHEDULER_START_DELAY_SECONDS)
+        while not self._stop.is_set():
+            mono = time.monotonic()
+            # Non-leaders only poll the lease; the leader ticks every second
+            if self.is_leader or mono - last_lease >= lease_every:
+                last_lease = mono
+                try:
+                    self.tick()
+                except Exception:
+                    log.exception("scheduler tick failed")
+            self._stop.wait(TICK_SECONDS)
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name="scheduler", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+        try:
+            self._release_lease()
+        except Exception:
+            log.exception("could not release scheduler lease")
+
+    # -- metrics ------------------------------------------------------------
+    def metrics(self) -> Dict[str, object]:
+        jobs: List[Dict[str, object]] = []
+        for job in self.jobs.values():
+            s = job.stats
+            jobs.append({
+                "name": job.name,
+                "schedule": job.cron.expr if job.cron else f"every {int(job.interval.total_seconds())}s",
+                "next_run": job.next_run,
+                "runs": s.runs,
+                "failures": s.failures,
+                "rows": s.rows,
+                "last_started_at": s.last_started_at,
+                "last_duration_ms": s.last_duration_ms,
+                "last_rows": s.last_rows,
+                "last_error": s.last_error,
+            })
+        return {"owner": self.owner, "leader": self.is_leader, "jobs": jobs}
+
+
+scheduler = Scheduler()
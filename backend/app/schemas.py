@@ -55,6 +55,19 @@ class AbsenceOut(AbsenceIn):
     class Config:
         from_attributes = True
 
+class IngestError(BaseModel):
+    index: int
+    student_id: Optional[int] = None
+    detail: str
+
+class AbsenceBatchResult(BaseModel):
+    inserted: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    duplicates: int = 0  # repeated (student_id, date) inside the batch; last one wins
+    rejected: int = 0
+    errors: List[IngestError] = []
+
 class ChecklistItem(BaseModel):
     text: str
     done: bool = False
@@ -75,6 +88,8 @@ class TaskOut(TaskIn):
     updated_at: Optional[datetime] = None
     completed_at: Optional[datetime] = None
     deleted_at: Optional[datetime] = None
+    overdue_at: Optional[datetime] = None
+    version: Optional[int] = None
     class Config:
         from_attributes = True
 
@@ -89,9 +104,22 @@ class TaskEdit(BaseModel):
 class AssignIn(BaseModel):
     assignee_user_id: int
 
+class AutoAssignIn(BaseModel):
+    user_ids: Optional[List[int]] = None   # default: all teachers (Role.USER)
+    prefer_previous: bool = True           # prefer a teacher who visited the student before
+    max_per_user: Optional[int] = None
+
+class AutoAssignOut(BaseModel):
+    assigned: int
+    skipped: int
+    lost_races: int = 0
+    per_user: dict[int, int]
+
 class StatusIn(BaseModel):
     action: Literal["accept", "reject", "complete"]
     reason: Optional[str] = None
+    # Optional optimistic-concurrency guard: the TaskOut.version the client saw
+    version: Optional[int] = None
 
 class TaskEventOut(BaseModel):
     id: int
@@ -109,4 +137,53 @@ class HistoryItem(BaseModel):
     title: Optional[str] = None
     reason_code: Optional[str] = None
     note: Optional[str] = None
-    reported_by: Optional[str] = None
\ No newline at end of file
+    reported_by: Optional[str] = None
+class LastEventOut(BaseModel):
+    type: TaskEventType
+    actor_user_id: int
+    created_at: datetime
+
+class BoardTaskOut(TaskOut):
+    comment_count: int = 0
+    last_event: Optional[LastEventOut] = None
+
+class StudentBrief(BaseModel):
+    id: int
+    name: str
+    student_class: Optional[str] = None
+
+class BoardOut(BaseModel):
+    me: UserOut
+    users: List[UserOut]
+    tasks: List[BoardTaskOut]
+    students: List[StudentBrief]
+
+class RouteStop(BaseModel):
+    task_id: int
+    title: str
+    address: Optional[str] = None
+    lat: float
+    lon: float
+    due_at: Optional[datetime] = None
+    eta: datetime
+    leg_km: float
+    late: bool = False
+
+class RouteUnlocated(BaseModel):
+    task_id: int
+    title: str
+    address: Optional[str] = None
+
+class RouteOut(BaseModel):
+    day: date
+    user_id: int
+    start_at: datetime
+    total_km: float
+    late_minutes: float
+    stops: List[RouteStop]
+    unlocated: List[RouteUnlocated]  # addresses missing from the gazetteer
+    elapsed_ms: float
+
+class CalendarFeedOut(BaseModel):
+    user_id: int
+    url: str  # subscribe to this in a calendar app; the key in it is the only credential
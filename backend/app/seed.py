@@ -7,9 +7,13 @@ import random
 from datetime import date, datetime, timedelta, timezone
 from typing import List, Tuple
 
+from sqlalchemy import text
 from sqlalchemy.orm import Session
 
-from app.db import Base, engine, SessionLocal
+from app.db import (
+    Base, SessionLocal, get_engine, init_schema, list_tenants, tenancy_enabled, use_tenant, valid_tenant
+)
+from app.geo import ensure_geocodes
 from app.models import (
     User, Role, Student, Absence, Task, TaskStatus, TaskEventType
 )
@@ -38,6 +42,22 @@ LONDON_ADDR = [
     "Canary Wharf, London",
 ]
 
+# Coordinates for the demo addresses; loaded into the geocodes gazetteer
+LONDON_GEO = {
+    "221B Baker St, London":          (51.5238, -0.1586),
+    "10 Downing St, London":          (51.5034, -0.1276),
+    "Trafalgar Square, London":       (51.5080, -0.1281),
+    "1 Canada Square, London":        (51.5049, -0.0195),
+    "30 St Mary Axe, London":         (51.5145, -0.0803),
+    "Buckingham Palace, London":      (51.5014, -0.1419),
+    "Tower Bridge, London":           (51.5055, -0.0754),
+    "King's Cross Station, London":   (51.5308, -0.1238),
+    "Royal Albert Hall, London":      (51.5009, -0.1774),
+    "Piccadilly Circus, London":      (51.5101, -0.1340),
+    "Covent Garden, London":          (51.5117, -0.1240),
+    "Canary Wharf, London":           (51.5054, -0.0235),
+}
+
 FIRST = ["Oliver","Amelia","Jack","Isla","Harry","Emily","George","Sophie","Noah",
          "Ava","Leo","Mia","James","Grace","Oscar","Chloe","Thomas","Ella"]
 LAST  = ["Smith","Johnson","Williams","Brown","Jones","Davis","Miller","Taylor","Wilson",
@@ -50,7 +70,7 @@ LAST  = ["Smith","Johnson","Williams","Brown","Jones","Davis","Miller","Taylor",
 
 def _resolve_sqlite_path() -> Tuple[str, str]:
     """Return (db_url, resolved_file_path_or_note)."""
-    db_url = str(engine.url)
+    db_url = str(get_engine().url)
     if db_url.startswith("sqlite:////"):
         return db_url, db_url.replace("sqlite:////", "/")
     if db_url.startswith("sqlite:///"):
@@ -63,10 +83,32 @@ def _log_db_target(prefix: str):
     print(f"[{prefix}] DATABASE_URL: {db_url}")
     print(f"[{prefix}] DB file     : {db_path}")
 
+# Running workers tail change_log by seq (app.coherence) and version ETags
+# with it, so a reset must not restart the AUTOINCREMENT counter: changes
+# numbered at or below a worker's cursor would never reach it. The counter
+# resumes one past the old value; workers read that gap like pruned rows and
+# drop all their caches, since the dropped rows were never logged.
+_SEQ = "SELECT seq FROM sqlite_sequence WHERE name = 'change_log'"
+
 def drop_and_create():
     print("[RESET] drop_all + create_all")
-    Base.metadata.drop_all(bind=engine)
-    Base.metadata.create_all(bind=engine)
+    eng = get_engine()
+    seq = None
+    if eng.dialect.name == "sqlite":
+        with eng.connect() as conn:
+            if conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_sequence'")).first():
+                seq = conn.execute(text(_SEQ)).scalar()
+    Base.metadata.drop_all(bind=eng)
+    init_schema()
+    if seq:
+        seq += 1
+        with eng.begin() as conn:
+            # Migrations may already have logged changes; never move backwards
+            if conn.execute(text(_SEQ)).first():
+                conn.execute(text("UPDATE sqlite_sequence SET seq = MAX(seq, :seq) WHERE name = 'change_log'"), {"seq": seq})
+            else:
+                conn.execute(text("INSERT INTO sqlite_sequence (name, seq) VALUES ('change_log', :seq)"), {"seq": seq})
+        print(f"[RESET] change_log continues after seq {seq}")
 
 def ensure_user(db: Session, user_id: int, name: str, role: Role) -> User:
     """Create or update user deterministically (SQLAlchemy 2.0 style)."""
@@ -179,12 +221,12 @@ def seed_big(db: Session, paddy: User, ulf: User, una: User, students: int = 60)
         studs.append(s)
     db.add_all(studs); db.commit()
 
-    # Absence history (1–3 per student)
+    # Absence history (1–3 per student, distinct days)
     for s in studs:
-        for _ in range(random.randint(1, 3)):
+        for days_ago in random.sample(range(1, 15), random.randint(1, 3)):
             db.add(Absence(
                 student_id=s.id,
-                date=TODAY - timedelta(days=random.randint(1, 14)),
+                date=TODAY - timedelta(days=days_ago),
                 reason_code=random.choice(["Syk", "Reise", "Annet"]),
                 note="Auto-generated",
                 reported_by=random.choice(["Teacher", "Admin"]),
@@ -228,6 +270,7 @@ def do_reset_and_seed(big: int | None):
         paddy = ensure_user(db, 1, "Paddy MacGrath", Role.ADMIN)
         ulf   = ensure_user(db, 2, "Ulf", Role.USER)
         una   = ensure_user(db, 3, "Una", Role.USER)
+        ensure_geocodes(db, LONDON_GEO)
 
         if big and big > 0:
             seed_big(db, paddy, ulf, una, students=big)
@@ -238,11 +281,12 @@ def do_ensure(big: int | None):
     """Idempotent: creates users and minimal data if DB is empty.
        If --big N is passed, adds large demo set even if data exists."""
     _log_db_target("ENSURE")
-    Base.metadata.create_all(bind=engine)
+    init_schema()
     with SessionLocal() as db:
         paddy = ensure_user(db, 1, "Paddy MacGrath", Role.ADMIN)
         ulf   = ensure_user(db, 2, "Ulf", Role.USER)
         una   = ensure_user(db, 3, "Una", Role.USER)
+        ensure_geocodes(db, LONDON_GEO)
 
         have_tasks = db.query(Task).count()
         have_students = db.query(Student).count()
@@ -271,19 +315,36 @@ def main():
                         help="Idempotent: create if empty; never delete.")
     parser.add_argument("--big", type=int, default=0,
                         help="Also add a large demo set (N students, e.g. 60).")
+    parser.add_argument("--tenant", action="append", default=[],
+                        help="School database to seed (needs TENANT_DB_DIR); repeatable. Creates it if missing.")
+    parser.add_argument("--all-tenants", action="store_true",
+                        help="Run for every existing school database in TENANT_DB_DIR.")
     args = parser.parse_args()
 
     if args.reset and args.ensure:
         print("[WARN] both --reset and --ensure → using --reset")
         args.ensure = False
 
-    if args.reset:
-        do_reset_and_seed(args.big)
-    elif args.ensure or args.big > 0:
-        do_ensure(args.big)
-    else:
-        # default to ensure minimal
-        do_ensure(0)
+    tenants: List[str | None] = [None]
+    if args.tenant or args.all_tenants:
+        if not tenancy_enabled():
+            parser.error("--tenant/--all-tenants need TENANT_DB_DIR")
+        bad = [t for t in args.tenant if not valid_tenant(t)]
+        if bad:
+            parser.error(f"invalid tenant key(s): {', '.join(bad)} (use a-z, 0-9, '-', '_')")
+        tenants = sorted(set(args.tenant) | set(list_tenants() if args.all_tenants else []))
+
+    for tenant in tenants:
+        if tenant:
+            print(f"[TENANT] {tenant}")
+        with use_tenant(tenant):
+            if args.reset:
+                do_reset_and_seed(args.big)
+            elif args.ensure or args.big > 0:
+                do_ensure(args.big)
+            else:
+                # default to ensure minimal
+                do_ensure(0)
 
     print("Seed complete.")
 
@@ -1,19 +1,26 @@
 # app/utils.py
 from __future__ import annotations
 
-from datetime import datetime, date, timedelta
+from datetime import datetime, date, timedelta, timezone
 from enum import Enum
-from typing import Any, Dict, Optional
+from typing import Any, Dict, FrozenSet, Optional, Tuple
 
 from fastapi import HTTPException
+from sqlalchemy import func, update
 from sqlalchemy.orm import Session
 
+from .cache import invalidate_task
 from .config import settings
-from .models import Task, TaskEvent, TaskEventType, User
+from .models import Role, Task, TaskEvent, TaskEventType, TaskStatus, User
 
 
 # --- JSON sanitizer for event metadata --------------------------------------
+_PLAIN = frozenset({str, int, float, bool, type(None)})
+
+
 def _jsonify(obj: Any) -> Any:
+    if type(obj) in _PLAIN:  # exact type: str-based Enums must still map to .value
+        return obj
     if isinstance(obj, (datetime, date)):
         return obj.isoformat()
     if isinstance(obj, Enum):
@@ -25,6 +32,14 @@ def _jsonify(obj: Any) -> Any:
     return obj
 
 
+# --- Datetimes -----------------------------------------------------------------
+def naive_utc(dt: Optional[datetime]) -> Optional[datetime]:
+    """Aware datetimes converted to UTC without tzinfo; naive ones are already UTC."""
+    if dt is None or dt.tzinfo is None:
+        return dt
+    return dt.astimezone(timezone.utc).replace(tzinfo=None)
+
+
 # --- Event logging -----------------------------------------------------------
 def log_event(
     db: Session,
@@ -32,16 +47,102 @@ def log_event(
     actor: User,
     event_type: TaskEventType,
     metadata: Optional[Dict[str, Any]] = None,
+    commit: bool = True,
 ) -> None:
-    """Insert a row into task_events with JSON-serializable metadata."""
+    """Insert a row into task_events with JSON-serializable metadata.
+
+    Pass ``commit=False`` to stage the event in the caller's transaction.
+    """
     evt = TaskEvent(
         task_id=task.id,
         type=event_type,
-        metadata=_jsonify(metadata or {}),  # <-- ensure JSON-safe
+        meta=_jsonify(metadata or {}),  # <-- ensure JSON-safe
         actor_user_id=actor.id,
     )
     db.add(evt)
-    db.commit()
+    if commit:
+        db.commit()
+
+
+# --- Status transitions ------------------------------------------------------
+# action -> (target status, statuses the task may be in, event type)
+# New -> Assigned happens through assign_task; see ASSIGNABLE_STATUSES.
+STATUS_TRANSITIONS: Dict[str, Tuple[TaskStatus, FrozenSet[TaskStatus], TaskEventType]] = {
+    "accept": (
+        TaskStatus.ACCEPTED,
+        frozenset({TaskStatus.ASSIGNED}),
+        TaskEventType.ACCEPT,
+    ),
+    "reject": (
+        TaskStatus.REJECTED,
+        frozenset({TaskStatus.ASSIGNED, TaskStatus.ACCEPTED}),
+        TaskEventType.REJECT,
+    ),
+    "complete": (
+        TaskStatus.DONE,
+        frozenset({TaskStatus.ASSIGNED, TaskStatus.ACCEPTED}),
+        TaskEventType.COMPLETE,
+    ),
+}
+
+# Statuses that move to ASSIGNED when a task gets an assignee
+ASSIGNABLE_STATUSES = frozenset({TaskStatus.NEW, TaskStatus.REJECTED})
+
+
+def transition_status(
+    db: Session,
+    task_id: int,
+    action: str,
+    actor: User,
+    expected_version: Optional[int] = None,
+    values: Optional[Dict[str, Any]] = None,
+    metadata: Optional[Dict[str, Any]] = None,
+) -> Task:
+    """Apply a status transition as one conditional UPDATE ... RETURNING.
+
+    The event row is staged in the same transaction; the caller commits.
+    When no row matches, the task is re-read only to pick the right error:
+    404 (missing/deleted), 403 (not the assignee) or 409 (lost race or
+    transition not allowed from the current status).
+    """
+    if action not in STATUS_TRANSITIONS:
+        raise HTTPException(status_code=400, detail="Invalid action")
+    target, sources, event_type = STATUS_TRANSITIONS[action]
+
+    conds = [
+        Task.id == task_id,
+        Task.deleted_at.is_(None),
+        Task.status.in_(sources),
+    ]
+    if actor.role != Role.ADMIN:
+        conds.append(Task.assignee_user_id == actor.id)
+    if expected_version is not None:
+        conds.append(Task.version == expected_version)
+
+    stmt = (
+        update(Task)
+        .where(*conds)
+        .values(status=target, version=Task.version + 1, updated_at=func.now(), **(values or {}))
+        .returning(Task)
+        .execution_options(synchronize_session=False)
+    )
+    task = db.scalars(stmt).first()
+    if task is None:
+        db.rollback()
+        current = db.get(Task, task_id)
+        if not current or current.deleted_at is not None:
+            raise HTTPException(status_code=404, detail="Task not found")
+        if actor.role != Role.ADMIN and current.assignee_user_id != actor.id:
+            raise HTTPException(status_code=403, detail="Forbidden")
+        if expected_version is not None and current.version != expected_version:
+            raise HTTPException(status_code=409, detail="Task was modified by someone else")
+        raise HTTPException(
+            status_code=409,
+            detail=f"Cannot {action} a task in status {current.status.value}",
+        )
+
+    log_event(db, task, actor, event_type, metadata, commit=False)
+    return task
 
 
 # --- Soft delete / restore ---------------------------------------------------
@@ -52,6 +153,7 @@ def soft_delete(db: Session, task: Task, actor: User) -> None:
     db.add(task)
     db.commit()
     log_event(db, task, actor, TaskEventType.DELETE, {"deleted_at": task.deleted_at})
+    invalidate_task(task.id)
 
 
 def restore(db: Session, task: Task, actor: User) -> None:
@@ -64,3 +166,4 @@ def restore(db: Session, task: Task, actor: User) -> None:
     db.add(task)
     db.commit()
     log_event(db, task, actor, TaskEventType.RESTORE, {"restored_at": datetime.utcnow()})
+    invalidate_task(task.id)
@@ -0,0 +1,322 @@
+# app/webhooks.py
+"""Webhook delivery from the transactional outbox.
+
+A trigger adds a ``webhook_outbox`` row for every ``task_events`` insert, in
+the same transaction as the event (see db._migrate_v3). The dispatcher runs
+an asyncio loop in its own thread, so request handlers never wait on it.
+Each endpoint has one coroutine that POSTs outbox rows in id order, up to
+``WEBHOOK_BATCH_SIZE`` per request. Its cursor in ``webhook_cursors`` only
+moves after a 2xx. A failed batch is retried with exponential backoff, so
+an endpoint never sees events out of order. After ``WEBHOOK_MAX_ATTEMPTS``
+the batch is parked in ``webhook_dead_letters`` and delivery goes on.
+
+Delivery is at-least-once. A receiver can dedupe on ``X-Webhook-Delivery``
+or on the event ids.
+
+With tenancy on, every school database has its own outbox and cursors,
+and each (school, endpoint) pair gets its own coroutine. Payloads name the
+school in ``tenant``.
+
+Requests carry ``X-Webhook-Signature: t=<unix ts>,v1=<hex>``. The hex is
+HMAC-SHA256 over ``"<ts>.<body>"`` with the endpoint secret.
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import random
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import func, insert, select, update
+
+from .audit import decode
+from .config import WebhookEndpoint, settings
+from .db import SessionLocal, current_tenant, list_tenants, tenancy_enabled
+from .models import TaskEventType, WebhookCursor, WebhookDeadLetter, WebhookOutbox
+from .scheduler import scheduler
+
+log = logging.getLogger("app.webhooks")
+
+TENANT_SCAN_SECONDS = 30.0
+
+# Triggers store the enum name; receivers get the same values as the API
+_EVENT_TYPES = {t.name: t.value for t in TaskEventType}
+
+
+def sign(secret: str, timestamp: int, body: bytes) -> str:
+    mac = hmac.new(secret.encode(), str(timestamp).encode() + b"." + body, hashlib.sha256)
+    return f"t={timestamp},v1={mac.hexdigest()}"
+
+
+def verify(secret: str, header: str, body: bytes, tolerance: float = 300.0) -> bool:
+    """Receiver-side check; also used by the benchmark stand-in."""
+    try:
+        parts = dict(p.split("=", 1) for p in header.split(","))
+        ts = int(parts["t"])
+    except (KeyError, ValueError):
+        return False
+    if abs(time.time() - ts) > tolerance:
+        return False
+    return hmac.compare_digest(sign(secret, ts, body), header)
+
+
+def backoff_seconds(attempts: int) -> float:
+    """Exponential backoff with jitter (half to full step) after the n-th failure."""
+    cap = min(settings.WEBHOOK_BACKOFF_MAX_SECONDS,
+              settings.WEBHOOK_BACKOFF_BASE_SECONDS * 2 ** (attempts - 1))
+    return random.uniform(cap / 2, cap)
+
+
+def encode_batch(endpoint: str, rows: Sequence[Tuple[int, str]], tenant: Optional[str] = None) -> bytes:
+    events = []
+    for outbox_id, payload in rows:
+        evt = json.loads(payload)
+        evt["outbox_id"] = outbox_id
+        evt["type"] = _EVENT_TYPES.get(evt["type"], evt["type"])
+        evt["metadata"] = decode(evt.get("metadata"))  # receivers get full old values, not undo patches
+        if evt.get("created_at"):
+            evt["created_at"] = evt["created_at"].replace(" ", "T")
+        events.append(evt)
+    doc = {"endpoint": endpoint, "delivery": f"{rows[0][0]}-{rows[-1][0]}", "events": events}
+    if tenant:
+        doc["tenant"] = tenant
+    return json.dumps(doc, separators=(",", ":")).encode()
+
+
+@dataclass
+class EndpointStats:
+    batches: int = 0
+    events: int = 0
+    failures: int = 0
+    dead_lettered: int = 0
+    last_status: Optional[int] = None
+    last_latency_ms: Optional[float] = None
+    last_error: Optional[str] = None
+
+
+class Dispatcher:
+    def __init__(
+        self,
+        endpoints: Optional[List[WebhookEndpoint]] = None,
+        session_factory=SessionLocal,
+        should_run: Callable[[], bool] = lambda: True,
+    ):
+        self.endpoints = [e for e in (endpoints if endpoints is not None else settings.WEBHOOKS) if e.enabled]
+        self._session_factory = session_factory
+        # Only one process may deliver at a time
+        self._should_run = should_run
+        self.stats: Dict[str, EndpointStats] = {e.name: EndpointStats() for e in self.endpoints}
+        self._thread: Optional[threading.Thread] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stopping: Optional[asyncio.Event] = None
+
+    # -- database (runs in worker threads via asyncio.to_thread) ------------
+    def _cursor(self, name: str) -> WebhookCursor:
+        with self._session_factory() as db:
+            cur = db.get(WebhookCursor, name)
+            if cur is None:
+                # A new endpoint starts at the head: no replay of old history
+                head = db.scalar(select(func.max(WebhookOutbox.id))) or 0
+                cur = WebhookCursor(endpoint=name, last_id=head, attempts=0, delivered=0)
+                db.add(cur)
+                db.commit()
+                db.refresh(cur)
+            db.expunge(cur)
+            return cur
+
+    def _batch(self, after: int) -> List[Tuple[int, str]]:
+        with self._session_factory() as db:
+            return db.execute(
+                select(WebhookOutbox.id, WebhookOutbox.payload)
+                .where(WebhookOutbox.id > after)
+                .order_by(WebhookOutbox.id)
+                .limit(settings.WEBHOOK_BATCH_SIZE)
+            ).all()
+
+    def _advance(self, name: str, old: int, new: int, count: int) -> bool:
+        # Compare-and-set on last_id: a process that lost the lease mid-request
+        # can't move the cursor backwards
+        with self._session_factory() as db:
+            res = db.execute(
+                update(WebhookCursor)
+                .where(WebhookCursor.endpoint == name, WebhookCursor.last_id == old)
+                .values(last_id=new, attempts=0, next_attempt_at=None, last_error=None,
+                        delivered=WebhookCursor.delivered + count)
+            )
+            db.commit()
+            return res.rowcount == 1
+
+    def _fail(self, name: str, old: int, attempts: int, error: str) -> None:
+        with self._session_factory() as db:
+            db.execute(
+                update(WebhookCursor)
+                .where(WebhookCursor.endpoint == name, WebhookCursor.last_id == old)
+                .values(attempts=attempts, last_error=error[:500],
+                        next_attempt_at=datetime.utcnow() + timedelta(seconds=backoff_seconds(attempts)))
+            )
+            db.commit()
+
+    def _dead_letter(self, name: str, old: int, rows, attempts: int, error: str, body: bytes) -> bool:
+        with self._session_factory() as db:
+            res = db.execute(
+                update(WebhookCursor)
+                .where(WebhookCursor.endpoint == name, WebhookCursor.last_id == old)
+                .values(last_id=rows[-1][0], attempts=0, next_attempt_at=None, last_error=error[:500])
+            )
+            if res.rowcount != 1:
+                db.rollback()
+                return False
+            db.execute(insert(WebhookDeadLetter).values(
+                endpoint=name, first_id=rows[0][0], last_id=rows[-1][0],
+                attempts=attempts, error=error[:500], payload=body.decode(),
+            ))
+            db.commit()
+            return True
+
+    # -- delivery -----------------------------------------------------------
+    async def _post(self, client, ep: WebhookEndpoint, body: bytes,
+                    delivery: str) -> Tuple[Optional[int], Optional[str]]:
+        ts = int(time.time())
+        headers = {
+            "Content-Type": "application/json",
+            "User-Agent": "simple-task-pro-webhooks",
+            "X-Webhook-Signature": sign(ep.secret, ts, body),
+            "X-Webhook-Delivery": delivery,
+        }
+        try:
+            resp = await client.post(ep.url, content=body, headers=headers)
+        except Exception as exc:  # connection refused, timeout, TLS ...
+            return None, f"{type(exc).__name__}: {exc}"
+        if 200 <= resp.status_code < 300:
+            return resp.status_code, None
+        return resp.status_code, f"HTTP {resp.status_code}"
+
+    async def _run_endpoint(self, client, ep: WebhookEndpoint, tenant: Optional[str] = None) -> None:
+        # Each asyncio task has its own context; to_thread calls inherit it
+        current_tenant.set(tenant)
+        stats = self.stats[ep.name]
+        poll = settings.WEBHOOK_POLL_SECONDS
+        # Many idle schools would keep every tenant engine open; back off instead
+        max_idle = poll * (8 if tenant else 1)
+        idle = poll
+        cur: Optional[WebhookCursor] = None
+        while not self._stopping.is_set():
+            if not self._should_run():
+                cur = None  # another process may move the cursor meanwhile
+                await self._sleep(1.0)
+                continue
+            try:
+                # Re-read only after a failure; a successful batch updates it in place
+                if cur is None:
+                    cur = await asyncio.to_thread(self._cursor, ep.name)
+                wait = (cur.next_attempt_at - datetime.utcnow()).total_seconds() if cur.next_attempt_at else 0
+                if wait > 0:
+                    await self._sleep(min(wait, 1.0))
+                    continue
+                rows = await asyncio.to_thread(self._batch, cur.last_id)
+                if not rows:
+                    await self._sleep(idle)
+                    idle = min(idle * 2, max_idle)
+                    continue
+                idle = poll
+                body = encode_batch(ep.name, rows, tenant)
+                t0 = time.perf_counter()
+                status, error = await self._post(client, ep, body, f"{rows[0][0]}-{rows[-1][0]}")
+                stats.last_status = status
+                stats.last_latency_ms = round((time.perf_counter() - t0) * 1000, 2)
+                if error is None:
+                    if await asyncio.to_thread(self._advance, ep.name, cur.last_id, rows[-1][0], len(rows)):
+                        stats.batches += 1
+                        stats.events += len(rows)
+                        cur.last_id = rows[-1][0]
+                    else:
+                        cur = None
+                    continue
+                stats.failures += 1
+                stats.last_error = error
+                attempts = cur.attempts + 1
+                if attempts >= settings.WEBHOOK_MAX_ATTEMPTS:
+                    if await asyncio.to_thread(self._dead_letter, ep.name, cur.last_id, rows, attempts, error, body):
+                        stats.dead_lettered += len(rows)
+                        log.error("webhook %s: gave up on outbox %s-%s: %s",
+                                  ep.name, rows[0][0], rows[-1][0], error)
+                else:
+                    await asyncio.to_thread(self._fail, ep.name, cur.last_id, attempts, error)
+                cur = None
+            except Exception:
+                log.exception("webhook %s: dispatcher error", ep.name)
+                cur = None
+                await self._sleep(1.0)
+
+    async def _sleep(self, seconds: float) -> None:
+        try:
+            await asyncio.wait_for(self._stopping.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _main(self, ready: threading.Event) -> None:
+        import httpx  # only loaded when webhooks are configured
+
+        self._loop = asyncio.get_running_loop()
+        self._stopping = asyncio.Event()
+        ready.set()
+        limits = httpx.Limits(max_connections=len(self.endpoints) * 2)
+        async with httpx.AsyncClient(timeout=settings.WEBHOOK_TIMEOUT_SECONDS, limits=limits) as client:
+            running: Dict[Tuple[Optional[str], str], asyncio.Task] = {}
+            while not self._stopping.is_set():
+                # Schools created after start are picked up on the next scan
+                for tenant in (list_tenants() if tenancy_enabled() else [None]):
+                    for ep in self.endpoints:
+                        if (tenant, ep.name) not in running:
+                            running[(tenant, ep.name)] = asyncio.create_task(
+                                self._run_endpoint(client, ep, tenant))
+                await self._sleep(TENANT_SCAN_SECONDS)
+            await asyncio.gather(*running.values())
+
+    def start(self) -> None:
+        if not self.endpoints or (self._thread and self._thread.is_alive()):
+            return
+        ready = threading.Event()
+        self._thread = threading.Thread(
+            target=lambda: asyncio.run(self._main(ready)), name="webhooks", daemon=True
+        )
+        self._thread.start()
+        ready.wait(5)
+
+    def stop(self, timeout: float = 5.0) -> None:
+        if self._loop and self._stopping:
+            self._loop.call_soon_threadsafe(self._stopping.set)
+        if self._thread:
+            self._thread.join(timeout)
+
+    def metrics(self) -> Dict[str, object]:
+        with self._session_factory() as db:
+            head = db.scalar(select(func.max(WebhookOutbox.id))) or 0
+            cursors = {c.endpoint: c for c in db.scalars(select(WebhookCursor))}
+        out = []
+        for ep in self.endpoints:
+            c = cursors.get(ep.name)
+            s = self.stats[ep.name]
+            out.append({
+                "name": ep.name,
+                "url": ep.url,
+                "last_id": c.last_id if c else None,
+                "backlog": head - c.last_id if c else None,
+                "delivered_total": c.delivered if c else 0,
+                "attempts": c.attempts if c else 0,
+                "next_attempt_at": c.next_attempt_at if c else None,
+                "last_error": c.last_error if c else None,
+                **{f"process_{k}": v for k, v in s.__dict__.items()},
+            })
+        return {"outbox_head": head, "endpoints": out}
+
+
+# Webhooks go out from the scheduler leader only, so workers don't double-deliver
+dispatcher = Dispatcher(should_run=lambda: scheduler.is_leader)
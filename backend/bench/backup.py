@@ -0,0 +1,139 @@
+# bench/backup.py
+"""Writer latency during an online backup, and backup/restore timings.
+
+Seeds a scratch database and pads it with comments to --mb megabytes. A
+separate writer process then commits one comment at a time for the whole
+run. Meanwhile this process runs three phases:
+
+* ``idle``: no backup, the baseline
+* ``online``: ``app.backup.create()`` (stepped copy from a pinned WAL snapshot)
+* ``locked copy``: a naive consistent copy (``BEGIN IMMEDIATE`` + file copy)
+
+    cd backend
+    python -m bench.backup --mb 100 --pages 256 --sleep 0.02
+
+Each phase reports write-commit latency (p50/p99/max) and stalls over
+100 ms. The snapshot and restore timings follow.
+"""
+from __future__ import annotations
+
+import argparse
+import multiprocessing as mp
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+from bench.scale_workers import BACKEND, _seed
+
+STALL_SECONDS = 0.1
+
+
+def _pad(db_path: str, mb: int) -> None:
+    """Add comments until the file is about mb megabytes."""
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    words = "visit parent called home absent note follow up school bus late".split()
+    rnd = random.Random(1)
+    while os.path.getsize(db_path) < mb * 1048576:
+        conn.execute("BEGIN")
+        conn.executemany(
+            "INSERT INTO comments (task_id, author, text, created_at) VALUES (?, 'bench', ?, datetime('now'))",
+            ((rnd.randint(1, 40), " ".join(rnd.choices(words, k=60))) for _ in range(20000)),
+        )
+        conn.execute("COMMIT")
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.close()
+
+
+def _writer(db_path: str, stop, marks: "mp.Queue") -> None:
+    """Commit one comment at a time; report (start time, latency) per commit."""
+    conn = sqlite3.connect(db_path, isolation_level=None, timeout=30)
+    out = []
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        conn.execute("INSERT INTO comments (task_id, author, text, created_at) VALUES (1, 'w', 'x', datetime('now'))")
+        out.append((t0, time.perf_counter() - t0))
+        time.sleep(0.002)
+    marks.put(out)
+
+
+def _locked_copy(db_path: str, dest: str) -> None:
+    conn = sqlite3.connect(db_path, isolation_level=None, timeout=30)
+    conn.execute("BEGIN IMMEDIATE")  # blocks every other writer until the copy is done
+    shutil.copy(db_path, dest)
+    conn.execute("ROLLBACK")
+    conn.close()
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    ap.add_argument("--mb", type=int, default=100)
+    ap.add_argument("--pages", type=int, default=256, help="BACKUP_PAGES_PER_STEP")
+    ap.add_argument("--sleep", type=float, default=0.02, help="BACKUP_STEP_SLEEP_SECONDS")
+    ap.add_argument("--idle-seconds", type=float, default=3.0)
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="bench-backup-")
+    db_path = os.path.join(tmp, "app.db")
+    try:
+        _seed(db_path, 60)
+        _pad(db_path, args.mb)
+        os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+        os.environ["SCHEDULER_ENABLED"] = "false"
+        os.environ["BACKUP_PAGES_PER_STEP"] = str(args.pages)
+        os.environ["BACKUP_STEP_SLEEP_SECONDS"] = str(args.sleep)
+        sys.path.insert(0, str(BACKEND))
+        from app import backup
+
+        stop, marks = mp.Event(), mp.Queue()
+        writer = mp.Process(target=_writer, args=(db_path, stop, marks))
+        writer.start()
+        time.sleep(0.5)
+        phases = []
+        t = time.perf_counter()
+        time.sleep(args.idle_seconds)
+        phases.append(("idle", t, time.perf_counter()))
+        t = time.perf_counter()
+        report = backup.create(probe_writers=True)
+        phases.append(("online", t, time.perf_counter()))
+        time.sleep(0.5)
+        t = time.perf_counter()
+        _locked_copy(db_path, os.path.join(tmp, "copy.db"))
+        phases.append(("locked copy", t, time.perf_counter()))
+        time.sleep(0.5)
+        stop.set()
+        samples = marks.get()
+        writer.join()
+
+        t = time.perf_counter()
+        restored = backup.restore(report["snapshot"])
+        restore_ms = (time.perf_counter() - t) * 1000
+
+        print(f"cores={os.cpu_count()} db={report['db_bytes'] / 1048576:.0f} MB "
+              f"pages/step={args.pages} sleep={args.sleep}s")
+        print("| phase | seconds | commits | p50 ms | p99 ms | max ms | stalls >100 ms |")
+        print("|-------|--------:|--------:|-------:|-------:|-------:|---------------:|")
+        for name, start, end in phases:
+            # Commits that overlap the phase, including ones that were already waiting when it began
+            lat = sorted(l for t0, l in samples if t0 < end and t0 + l > start)
+            pct = lambda p, lat=lat: lat[min(len(lat) - 1, int(p * len(lat)))] * 1000 if lat else float("nan")
+            stalls = sum(1 for l in lat if l > STALL_SECONDS)
+            print(f"| {name} | {end - start:.1f} | {len(lat)} | {pct(0.5):.2f} | {pct(0.99):.2f} "
+                  f"| {lat[-1] * 1000 if lat else float('nan'):.1f} | {stalls} |")
+        print()
+        print(f"online backup: {report['pages']} pages in {report['steps']} steps "
+              f"({report['restarts']} restarts), copy {report['copy_ms']:.0f} ms, "
+              f"gzip {report['compress_ms']:.0f} ms -> {report['snapshot_bytes'] / 1048576:.1f} MB, "
+              f"writers blocked {report['writers_blocked_ms']:.0f} ms "
+              f"({report['write_probes']} write-lock probes, longest wait {report['max_writer_wait_ms']:.1f} ms)")
+        print(f"restore: {restore_ms:.0f} ms total, unpack {restored['unpack_ms']:.0f} ms, "
+              f"writers blocked {restored['writers_blocked_ms']:.0f} ms")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+# bench/events.py
+"""Audit table size and event read time: full payloads vs. diffs vs. rollups.
+
+Seeds a scratch database with --tasks tasks. Each has a long body and a
+--checklist item checklist. A stream of --edits form saves per task is
+then generated. The form resends every field, and each save makes one
+realistic change: tick a checklist item, append a sentence to the body, or
+move the due date. The same stream is stored three ways:
+
+* ``full``: the old encoding, ``{"changed": <whole payload>}`` as SQLAlchemy's
+  default serializer wrote it
+* ``diff``: ``app.audit.encode_edit`` (changed fields only, old values as undo patches)
+* ``diff + rollup``: as ``diff``, then ``rollup_events`` with events aged past
+  the window (the newest EVENT_KEEP_RECENT per task stay)
+
+    cd backend
+    python -m bench.events --tasks 200 --edits 200
+
+Reports the task_events + task_event_rollups bytes (file size delta after
+VACUUM) and the median time to build one task's events response.
+"""
+from __future__ import annotations
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from bench.scale_workers import BACKEND
+
+SENTENCES = [
+    "Called the parents, no answer.",
+    "Student was at home with a cold according to the neighbour.",
+    "Left a note in the mailbox; will try again on Thursday after school.",
+    "Mother says the bus was late three days this week.",
+]
+
+
+def _stream(tasks: list, edits: int, checklist: int, rnd: random.Random):
+    """Yield (task_id, payload before, payload after) for every form save."""
+    state = {
+        tid: {
+            "title": f"Home visit {tid}",
+            "body": " ".join(rnd.choice(SENTENCES) for _ in range(20)),
+            "address": "221B Baker St, London",
+            "checklist": [{"text": f"Step {i}: check in with family", "done": False} for i in range(checklist)],
+            "due_at": (datetime(2026, 9, 1) + timedelta(days=tid % 30)).isoformat(),
+        }
+        for tid in tasks
+    }
+    for _ in range(edits):
+        for tid in tasks:
+            before = state[tid]
+            after = json.loads(json.dumps(before))
+            roll = rnd.random()
+            if roll < 0.5:
+                item = rnd.randrange(len(after["checklist"]))
+                after["checklist"][item]["done"] = not after["checklist"][item]["done"]
+            elif roll < 0.8:
+                after["body"] += " " + rnd.choice(SENTENCES)
+            else:
+                after["due_at"] = (datetime.fromisoformat(after["due_at"]) + timedelta(days=1)).isoformat()
+            state[tid] = after
+            yield tid, before, after
+
+
+def _file_bytes(conn, path: str) -> int:
+    conn.execute("VACUUM")
+    return os.path.getsize(path)
+
+
+def _read_ms(task_ids: list) -> float:
+    from app.audit import event_view
+    from app.db import SessionLocal
+
+    times = []
+    with SessionLocal() as db:
+        for tid in task_ids:
+            t0 = time.perf_counter()
+            event_view(db, tid)
+            times.append(time.perf_counter() - t0)
+            db.expunge_all()
+    return statistics.median(times) * 1000
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    ap.add_argument("--tasks", type=int, default=200)
+    ap.add_argument("--edits", type=int, default=200, help="form saves per task")
+    ap.add_argument("--checklist", type=int, default=8)
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="bench-events-")
+    db_path = os.path.join(tmp, "app.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+    os.environ["SCHEDULER_ENABLED"] = "false"
+    sys.path.insert(0, str(BACKEND))
+    import sqlite3
+
+    from app import seed
+    from app.audit import encode_edit, rollup_events
+    from app.config import settings
+
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            seed.do_reset_and_seed(0)
+        conn = sqlite3.connect(db_path, isolation_level=None)
+        student = conn.execute("SELECT MIN(id) FROM students").fetchone()[0]
+        conn.execute("BEGIN")
+        first = conn.execute("SELECT COALESCE(MAX(id), 0) FROM tasks").fetchone()[0] + 1
+        task_ids = list(range(first, first + args.tasks))
+        conn.executemany(
+            "INSERT INTO tasks (id, student_id, title, status, version) VALUES (?, ?, 'bench', 'NEW', 1)",
+            ((tid, student) for tid in task_ids),
+        )
+        conn.execute("COMMIT")
+        conn.execute("DELETE FROM task_events")
+        conn.execute("DELETE FROM webhook_outbox")
+        conn.execute("DELETE FROM change_log")
+        base = _file_bytes(conn, db_path)
+        stream = list(_stream(task_ids, args.edits, args.checklist, random.Random(7)))
+        sample = random.Random(1).sample(task_ids, min(50, len(task_ids)))
+        old_day = (datetime.utcnow() - timedelta(days=settings.EVENT_ROLLUP_AFTER_DAYS + 1)).isoformat(" ")
+
+        def load(encode) -> int:
+            conn.execute("DELETE FROM task_events")
+            conn.execute("DELETE FROM task_event_rollups")
+            conn.execute("BEGIN")
+            conn.executemany(
+                "INSERT INTO task_events (task_id, type, metadata, actor_user_id, created_at) "
+                "VALUES (?, 'EDIT', ?, 1, ?)",
+                ((tid, encode(before, after), old_day) for tid, before, after in stream),
+            )
+            conn.execute("COMMIT")
+            conn.execute("DELETE FROM webhook_outbox")
+            conn.execute("DELETE FROM change_log")
+            return len(stream)
+
+        def legacy(before, after):
+            return json.dumps({"changed": after})  # SQLAlchemy's default json.dumps
+
+        def diff(before, after):
+            d = {k: (before[k], after[k]) for k in after if before[k] != after[k]}
+            return json.dumps(encode_edit(d), separators=(",", ":"), ensure_ascii=False)
+
+        rows = []
+        n = load(legacy)
+        rows.append(("full", n, _file_bytes(conn, db_path) - base, _read_ms(sample)))
+        n = load(diff)
+        rows.append(("diff", n, _file_bytes(conn, db_path) - base, _read_ms(sample)))
+        folded = rollup_events()
+        conn.execute("DELETE FROM change_log")
+        left = conn.execute("SELECT COUNT(*) FROM task_events").fetchone()[0]
+        rows.append(("diff + rollup", left, _file_bytes(conn, db_path) - base, _read_ms(sample)))
+        conn.close()
+
+        print(f"tasks={args.tasks} saves/task={args.edits} checklist={args.checklist} "
+              f"keep_recent={settings.EVENT_KEEP_RECENT} (folded {folded})")
+        print("| encoding | event rows | audit MB | bytes/save | read one task ms |")
+        print("|----------|-----------:|---------:|-----------:|-----------------:|")
+        for name, count, size, ms in rows:
+            print(f"| {name} | {count} | {size / 1048576:.1f} | {size / len(stream):.0f} | {ms:.2f} |")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
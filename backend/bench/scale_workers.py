@@ -0,0 +1,162 @@
+# bench/scale_workers.py
+"""Throughput vs. uvicorn worker count.
+
+Seeds a scratch database, then for each worker count starts
+``uvicorn app.main:app --workers N`` on it and drives a read-heavy mix
+(board, task list, task detail, events, comments, ~10 % comment writes)
+from separate client processes for a fixed time.
+
+    cd backend
+    python -m bench.scale_workers --workers 1 2 4 --clients 8 --seconds 15
+
+Prints one markdown table row per worker count (req/s, p50, p99, errors).
+Client processes share the machine with the server, so run with more
+cores than workers when you want clean numbers.
+"""
+from __future__ import annotations
+
+import argparse
+import http.client
+import json
+import multiprocessing as mp
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BACKEND = Path(__file__).resolve().parents[1]
+USERS = ["paddy", "ulf", "una"]
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _seed(db_path: str, students: int) -> None:
+    env = {**os.environ, "DATABASE_URL": f"sqlite:///{db_path}"}
+    subprocess.run(
+        [sys.executable, "-m", "app.seed", "--reset", "--big", str(students)],
+        cwd=BACKEND, env=env, check=True, stdout=subprocess.DEVNULL,
+    )
+
+
+def _wait_ready(port: int, timeout: float = 30.0) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            c = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            c.request("GET", "/api/health")
+            if c.getresponse().status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("server did not start")
+
+
+def _client(port: int, seconds: float, task_ids, seed: int, out: "mp.Queue") -> None:
+    rnd = random.Random(seed)
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    lat, errors = [], 0
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        who = rnd.choice(USERS)
+        tid = rnd.choice(task_ids)
+        r = rnd.random()
+        method, path, body = "GET", f"/api/tasks/{tid}", None
+        if r < 0.15:
+            path = "/api/board"
+        elif r < 0.35:
+            path = "/api/tasks"
+        elif r < 0.55:
+            path = f"/api/tasks/{tid}/events"
+        elif r < 0.80:
+            path = f"/api/tasks/{tid}/comments"
+        elif r < 0.90:
+            who = "paddy"
+            method, path, body = "POST", f"/api/tasks/{tid}/comments", json.dumps({"text": "bench"})
+        t0 = time.perf_counter()
+        try:
+            conn.request(method, path, body=body, headers={"X-User": who, "Content-Type": "application/json"})
+            resp = conn.getresponse()
+            resp.read()
+            if resp.status >= 500:
+                errors += 1
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+            continue
+        lat.append(time.perf_counter() - t0)
+    out.put((lat, errors))
+
+
+def run(workers: int, clients: int, seconds: float, db_template: str) -> dict:
+    tmp = tempfile.mkdtemp(prefix="bench-")
+    db_path = os.path.join(tmp, "app.db")
+    shutil.copy(db_template, db_path)
+    port = _free_port()
+    env = {**os.environ, "DATABASE_URL": f"sqlite:///{db_path}", "SCHEDULER_ENABLED": "false"}
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning", "--no-access-log"],
+        cwd=BACKEND, env=env,
+    )
+    try:
+        _wait_ready(port)
+        import sqlite3
+        task_ids = [r[0] for r in sqlite3.connect(db_path).execute("SELECT id FROM tasks")]
+        q: "mp.Queue" = mp.Queue()
+        procs = [mp.Process(target=_client, args=(port, seconds, task_ids, i, q)) for i in range(clients)]
+        for p in procs:
+            p.start()
+        results = [q.get() for _ in procs]
+        for p in procs:
+            p.join()
+    finally:
+        server.terminate()
+        server.wait(10)
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    lat = sorted(x for r in results for x in r[0])
+    errors = sum(r[1] for r in results)
+    pct = lambda p: lat[min(len(lat) - 1, int(p * len(lat)))] * 1000 if lat else float("nan")
+    return {
+        "workers": workers,
+        "rps": len(lat) / seconds,
+        "p50": pct(0.50),
+        "p99": pct(0.99),
+        "errors": errors,
+    }
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    ap.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    ap.add_argument("--clients", type=int, default=8)
+    ap.add_argument("--seconds", type=float, default=15.0)
+    ap.add_argument("--students", type=int, default=300)
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="bench-seed-")
+    template = os.path.join(tmp, "app.db")
+    _seed(template, args.students)
+    print(f"cores={os.cpu_count()} clients={args.clients} seconds={args.seconds} students={args.students}")
+    print("| workers | req/s | p50 ms | p99 ms | errors |")
+    print("|--------:|------:|-------:|-------:|-------:|")
+    try:
+        for w in args.workers:
+            r = run(w, args.clients, args.seconds, template)
+            print(f"| {r['workers']} | {r['rps']:.0f} | {r['p50']:.1f} | {r['p99']:.1f} | {r['errors']} |", flush=True)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,337 @@
+# bench/soak.py
+"""School-day soak test: many teachers and an admin on one uvicorn instance.
+
+Seeds a scratch database with ``app.seed --reset --big N`` and starts
+``uvicorn app.main:app --workers W`` on it (or use --url for a running
+server). A pool of async virtual users then shares one httpx connection
+pool. Each user picks a scenario from --mix, runs it, and waits an
+exponential think time:
+
+* ``list_tasks``: reload the teacher's task list
+* ``change_status``: accept, reject or complete one of the teacher's
+  tasks, with the version guard; a 409 from a lost race counts as a conflict
+* ``add_comment``: comment on one of the teacher's tasks
+* ``edit_task``: tick a checklist item or append to the body (form resend)
+* ``assign_task``: admin bulk assignment, --burst back-to-back assigns
+
+Demo auth has two teacher logins (ulf, una), so the virtual teachers
+alternate between them. Rejected tasks go back to the admin's assign
+bursts, and only --complete-rate of accepted tasks finish, so the day keeps
+cycling. A 403/404 on a cached task means the admin handed it to the other
+teacher; it is counted apart from real errors and dropped until the next reload.
+
+    cd backend
+    python -m bench.soak --minutes 30 --users 40 --workers 2
+
+Prints a row every --report-every seconds: throughput, p50/p99/p999,
+errors, SQLite busy/locked errors from the server log, and server RSS
+(all uvicorn processes). At the end it prints per-scenario totals and
+memory growth after the first window (warm-up).
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional
+
+import httpx
+
+from bench.scale_workers import BACKEND, _free_port, _seed, _wait_ready
+
+SCENARIOS = ("list_tasks", "change_status", "add_comment", "edit_task", "assign_task")
+DEFAULT_MIX = "list_tasks=40,change_status=25,add_comment=20,edit_task=13,assign_task=2"
+TEACHERS = {"ulf": 2, "una": 3}
+# One match per failed request: SQLAlchemy wraps the driver error as "(sqlite3.OperationalError) ..."
+LOCKED = re.compile(r"\(sqlite3\.OperationalError\) database (?:table )?is (?:locked|busy)")
+# Last line of a traceback, e.g. "sqlalchemy.exc.IntegrityError: (sqlite3.IntegrityError) ..."
+EXCEPTION = re.compile(r"^([\w.]+(?:Error|Exception)): ?(.{0,80})", re.M)
+
+
+def _parse_mix(spec: str) -> Dict[str, float]:
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise SystemExit(f"unknown scenario {name!r}; choose from {', '.join(SCENARIOS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def _pct(sorted_lat: List[float], p: float) -> float:
+    if not sorted_lat:
+        return float("nan")
+    return sorted_lat[min(len(sorted_lat) - 1, int(p * len(sorted_lat)))] * 1000
+
+
+def _rss_mb(pid: int) -> Optional[float]:
+    """Resident memory of pid and all its descendants (Linux /proc)."""
+    if not os.path.isdir("/proc"):
+        return None
+    children = defaultdict(list)
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as fh:
+                ppid = int(fh.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children[ppid].append(int(entry))
+    total, todo = 0, [pid]
+    while todo:
+        p = todo.pop()
+        todo.extend(children.get(p, ()))
+        try:
+            with open(f"/proc/{p}/status") as fh:
+                for line in fh:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1])
+        except OSError:
+            pass
+    return total / 1024
+
+
+class Stats:
+    def __init__(self):
+        self.lat: Dict[str, List[float]] = defaultdict(list)     # whole run, per scenario
+        self.window: List[float] = []                             # since the last report
+        self.counts: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self.window_errors = 0
+        self.transport: Counter = Counter()  # exception name -> count
+
+    def record(self, scenario: str, seconds: float, outcome: str) -> None:
+        self.counts[scenario][outcome] += 1
+        if outcome in ("ok", "conflict", "stale"):
+            self.lat[scenario].append(seconds)
+            self.window.append(seconds)
+        if outcome in ("5xx", "transport"):
+            self.window_errors += 1
+
+
+class VirtualUser:
+    def __init__(self, n: int, client: httpx.AsyncClient, stats: Stats, args, admin_tasks: List[int]):
+        self.login = list(TEACHERS)[n % len(TEACHERS)]
+        self.headers = {"X-User": self.login}
+        self.client = client
+        self.stats = stats
+        self.args = args
+        self.rnd = random.Random(n)
+        self.tasks: List[dict] = []
+        self.admin_tasks = admin_tasks
+
+    async def _call(self, scenario: str, method: str, url: str, headers=None, **kw) -> Optional[httpx.Response]:
+        t0 = time.perf_counter()
+        try:
+            resp = await self.client.request(method, url, headers=headers or self.headers, **kw)
+        except httpx.HTTPError as exc:
+            self.stats.record(scenario, time.perf_counter() - t0, "transport")
+            self.stats.transport[type(exc).__name__] += 1
+            return None
+        dt = time.perf_counter() - t0
+        s = resp.status_code
+        if s < 400:
+            outcome = "ok"
+        elif s == 409:
+            outcome = "conflict"
+        elif s in (403, 404):
+            outcome = "stale"  # reassigned to the other teacher since the last reload
+        else:
+            outcome = "5xx" if s >= 500 else "4xx"
+        self.stats.record(scenario, dt, outcome)
+        if outcome in ("conflict", "stale") and "tasks/" in url:
+            tid = int(url.split("/")[3])
+            self.tasks = [t for t in self.tasks if t["id"] != tid]  # the next list_tasks brings it back
+        return resp
+
+    def _pick(self, statuses=None) -> Optional[dict]:
+        pool = [t for t in self.tasks if statuses is None or t["status"] in statuses]
+        return self.rnd.choice(pool) if pool else None
+
+    async def list_tasks(self):
+        resp = await self._call("list_tasks", "GET", "/api/tasks")
+        if resp is not None and resp.status_code == 200:
+            self.tasks = resp.json()
+
+    async def change_status(self):
+        t = self._pick({"Assigned", "Accepted"})
+        if t is None:
+            self.stats.record("change_status", 0.0, "skipped")
+            return
+        if t["status"] == "Assigned":
+            action = "accept" if self.rnd.random() < 0.7 else "reject"
+        else:
+            action = "complete" if self.rnd.random() < self.args.complete_rate else "reject"
+        body = {"action": action, "version": t.get("version")}
+        if action == "reject":
+            body["reason"] = "Family not home, please reschedule"
+        resp = await self._call("change_status", "POST", f"/api/tasks/{t['id']}/status", json=body)
+        if resp is not None and resp.status_code == 200:
+            t.update(resp.json())
+
+    async def add_comment(self):
+        t = self._pick()
+        if t is None:
+            self.stats.record("add_comment", 0.0, "skipped")
+            return
+        await self._call("add_comment", "POST", f"/api/tasks/{t['id']}/comments",
+                         json={"text": f"Visit note {self.rnd.randint(1, 10**6)}"})
+
+    async def edit_task(self):
+        t = self._pick()
+        if t is None:
+            self.stats.record("edit_task", 0.0, "skipped")
+            return
+        form = {k: t.get(k) for k in ("title", "body", "address", "checklist", "due_at")}
+        checklist = [dict(i) for i in (form["checklist"] or [])]
+        if checklist and self.rnd.random() < 0.6:
+            item = self.rnd.randrange(len(checklist))
+            checklist[item]["done"] = not checklist[item].get("done")
+            form["checklist"] = checklist
+        else:
+            form["body"] = ((form["body"] or "") + " Called again.")[-2000:]
+        resp = await self._call("edit_task", "PATCH", f"/api/tasks/{t['id']}", json=form)
+        if resp is not None and resp.status_code == 200:
+            t.update(resp.json())
+
+    async def assign_task(self):
+        for _ in range(self.args.burst):
+            tid = self.rnd.choice(self.admin_tasks)
+            await self._call("assign_task", "POST", f"/api/tasks/{tid}/assign", headers={"X-User": "paddy"},
+                             json={"assignee_user_id": self.rnd.choice(list(TEACHERS.values()))})
+
+    async def run(self, mix: Dict[str, float], until: float) -> None:
+        names, weights = list(mix), list(mix.values())
+        await self.list_tasks()
+        while time.perf_counter() < until:
+            await getattr(self, self.rnd.choices(names, weights)[0])()
+            if self.args.think_ms:
+                await asyncio.sleep(self.rnd.expovariate(1000 / self.args.think_ms))
+
+
+async def _soak(args, base_url: str, server_pid: Optional[int], log_path: Optional[str]) -> None:
+    mix = _parse_mix(args.mix)
+    stats = Stats()
+    # Expire idle connections before uvicorn's 5 s keep-alive timeout closes them mid-request
+    limits = httpx.Limits(max_connections=args.users, max_keepalive_connections=args.users, keepalive_expiry=4)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        resp = await client.get("/api/tasks", headers={"X-User": "paddy"})
+        resp.raise_for_status()
+        admin_tasks = [t["id"] for t in resp.json()]
+        until = time.perf_counter() + args.minutes * 60
+        users = [VirtualUser(i, client, stats, args, admin_tasks) for i in range(args.users)]
+        runners = [asyncio.create_task(u.run(mix, until)) for u in users]
+
+        start = time.perf_counter()
+        rss0 = rss = None  # baseline after the first window, once caches and imports have warmed up
+        print(f"cores={os.cpu_count()} users={args.users} workers={args.workers} minutes={args.minutes} "
+              f"think={args.think_ms} ms burst={args.burst} tasks={len(admin_tasks)}")
+        print(f"mix: {args.mix}")
+        print("| t s | req/s | p50 ms | p99 ms | p999 ms | errors | busy/locked | RSS MB |")
+        print("|----:|------:|-------:|-------:|--------:|-------:|------------:|-------:|")
+        last = first = start
+        while not all(r.done() for r in runners):
+            await asyncio.wait(runners, timeout=max(0.0, last + args.report_every - time.perf_counter()))
+            now = time.perf_counter()
+            window, stats.window = sorted(stats.window), []
+            errors, stats.window_errors = stats.window_errors, 0
+            rss = _rss_mb(server_pid) if server_pid else None
+            if rss0 is None:
+                rss0, first = rss, now
+            print(f"| {now - start:.0f} | {len(window) / max(now - last, 1e-9):.0f} | {_pct(window, 0.5):.1f} "
+                  f"| {_pct(window, 0.99):.1f} | {_pct(window, 0.999):.1f} | {errors} | {_locked(log_path)} "
+                  f"| {'n/a' if rss is None else f'{rss:.0f}'} |", flush=True)
+            last = now
+        elapsed = time.perf_counter() - start
+
+    print()
+    print("| scenario | requests | req/s | p50 ms | p99 ms | p999 ms | 409 | 403/404 | other 4xx | 5xx | transport | skipped |")
+    print("|----------|---------:|------:|-------:|-------:|--------:|----:|--------:|----------:|----:|----------:|--------:|")
+    everything = []
+    for name in SCENARIOS:
+        if name not in mix:
+            continue
+        lat = sorted(stats.lat[name])
+        everything.extend(lat)
+        c = stats.counts[name]
+        print(f"| {name} | {len(lat)} | {len(lat) / elapsed:.1f} | {_pct(lat, 0.5):.1f} | {_pct(lat, 0.99):.1f} "
+              f"| {_pct(lat, 0.999):.1f} | {c['conflict']} | {c['stale']} | {c['4xx']} | {c['5xx']} | {c['transport']} | {c['skipped']} |")
+    everything.sort()
+    print(f"| all | {len(everything)} | {len(everything) / elapsed:.1f} | {_pct(everything, 0.5):.1f} "
+          f"| {_pct(everything, 0.99):.1f} | {_pct(everything, 0.999):.1f} | | | | | | |")
+    print()
+    print(f"SQLite busy/locked errors (server log): {_locked(log_path)}")
+    if stats.transport:
+        print("transport errors: " + ", ".join(f"{n} x {name}" for name, n in stats.transport.most_common()))
+    if log_path:
+        for line, n in _exceptions(log_path).most_common(5):
+            print(f"  {n} x {line}")
+    if rss0 is not None and rss is not None:
+        per_hour = (rss - rss0) / (max(last - first, 1e-9) / 3600)
+        print(f"server RSS after warm-up: {rss0:.0f} MB -> {rss:.0f} MB ({rss - rss0:+.0f} MB, {per_hour:+.0f} MB/hour)")
+
+
+def _exceptions(log_path: str) -> Counter:
+    with open(log_path, errors="replace") as fh:
+        return Counter(f"{kind}: {msg}" for kind, msg in EXCEPTION.findall(fh.read()))
+
+
+def _locked(log_path: Optional[str]) -> str:
+    if not log_path:
+        return "n/a"
+    with open(log_path, errors="replace") as fh:
+        return str(len(LOCKED.findall(fh.read())))
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    ap.add_argument("--minutes", type=float, default=5.0)
+    ap.add_argument("--users", type=int, default=40, help="concurrent virtual users")
+    ap.add_argument("--workers", type=int, default=2, help="uvicorn workers (ignored with --url)")
+    ap.add_argument("--students", type=int, default=120, help="seed.py --big N")
+    ap.add_argument("--mix", default=DEFAULT_MIX, help="scenario=weight,... from: " + ", ".join(SCENARIOS))
+    ap.add_argument("--think-ms", type=float, default=250.0, help="mean think time between actions")
+    ap.add_argument("--burst", type=int, default=10, help="assigns per assign_task scenario")
+    ap.add_argument("--complete-rate", type=float, default=0.1, help="share of accepted tasks completed (rest rejected)")
+    ap.add_argument("--report-every", type=float, default=30.0, help="seconds between progress rows")
+    ap.add_argument("--url", help="soak an already running server instead (no seeding, no RSS)")
+    args = ap.parse_args()
+
+    if args.url:
+        asyncio.run(_soak(args, args.url, None, None))
+        return
+
+    tmp = tempfile.mkdtemp(prefix="bench-soak-")
+    db_path = os.path.join(tmp, "app.db")
+    log_path = os.path.join(tmp, "server.log")
+    try:
+        _seed(db_path, args.students)
+        port = _free_port()
+        env = {**os.environ, "DATABASE_URL": f"sqlite:///{db_path}"}
+        with open(log_path, "w") as log:
+            server = subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port),
+                 "--workers", str(args.workers), "--log-level", "warning", "--no-access-log"],
+                cwd=BACKEND, env=env, stdout=log, stderr=subprocess.STDOUT,
+            )
+            try:
+                _wait_ready(port)
+                asyncio.run(_soak(args, f"http://127.0.0.1:{port}", server.pid, log_path))
+            finally:
+                server.terminate()
+                server.wait(10)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
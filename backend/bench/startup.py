@@ -0,0 +1,146 @@
+# bench/startup.py
+"""Cold-start time: import cost and time to first response.
+
+For each run a fresh ``uvicorn app.main:app`` process is spawned and polled
+until ``/api/health`` answers, then ``/api/tasks`` is requested once. Two
+database states are measured:
+
+* ``fresh``: an empty file, so startup runs every migration
+* ``warm``: an already migrated and seeded file, so startup is one SELECT
+  on ``schema_version``
+* ``upgrade``: a file seeded by the code at --baseline-rev (default: the
+  repository's first commit, from before schema versioning), so startup
+  runs every migration on old data. It needs git; without it the row is
+  skipped.
+
+    cd backend
+    python -m bench.startup --runs 5
+
+Also reports ``import app.main`` time in a clean interpreter. All times are
+medians in milliseconds.
+"""
+from __future__ import annotations
+
+import argparse
+import http.client
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench.scale_workers import BACKEND, _free_port, _seed
+
+
+def import_ms() -> float:
+    out = subprocess.run(
+        [sys.executable, "-c",
+         "import time; t=time.perf_counter(); import app.main; print((time.perf_counter()-t)*1000)"],
+        cwd=BACKEND, check=True, capture_output=True, text=True,
+    )
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def _get(port: int, path: str) -> int:
+    c = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+    c.request("GET", path, headers={"X-User": "paddy"})
+    resp = c.getresponse()
+    resp.read()
+    return resp.status
+
+
+def _baseline_db(rev: str, db_path: str, students: int, tmp: str) -> bool:
+    """Seed db_path with the app as it was at rev; False if git can't provide it."""
+    try:
+        if not rev:
+            rev = subprocess.run(
+                ["git", "rev-list", "--max-parents=0", "HEAD"], cwd=BACKEND,
+                check=True, capture_output=True, text=True,
+            ).stdout.split()[0]
+        src = os.path.join(tmp, "baseline-src")
+        os.makedirs(src)
+        # Run from backend/, "git archive <rev> ." packs just that directory
+        archive = subprocess.run(["git", "archive", rev, "."], cwd=BACKEND, check=True, capture_output=True)
+        subprocess.run(["tar", "-x", "-C", src], input=archive.stdout, check=True)
+    except (OSError, subprocess.CalledProcessError, IndexError):
+        return False
+    env = {**os.environ, "DATABASE_URL": f"sqlite:///{db_path}"}
+    subprocess.run(
+        [sys.executable, "-m", "app.seed", "--reset", "--big", str(students)],
+        cwd=src, env=env, check=True, stdout=subprocess.DEVNULL,
+    )
+    return True
+
+
+def boot(db_path: str) -> dict:
+    """Spawn uvicorn and time first /api/health and first /api/tasks."""
+    port = _free_port()
+    env = {**os.environ, "DATABASE_URL": f"sqlite:///{db_path}", "SCHEDULER_ENABLED": "false"}
+    t0 = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port),
+         "--log-level", "warning", "--no-access-log"],
+        cwd=BACKEND, env=env,
+    )
+    try:
+        while True:
+            if server.poll() is not None:
+                raise RuntimeError("server exited during startup")
+            try:
+                if _get(port, "/api/health") == 200:
+                    break
+            except OSError:
+                time.sleep(0.005)
+        health = time.perf_counter() - t0
+        t1 = time.perf_counter()
+        status = _get(port, "/api/tasks")
+        first = time.perf_counter() - t1
+    finally:
+        server.terminate()
+        server.wait(10)
+    return {"health": health * 1000, "tasks": first * 1000, "status": status}
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--students", type=int, default=300)
+    ap.add_argument("--baseline-rev", default="", help="git revision for the upgrade case (default: first commit)")
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="bench-startup-")
+    try:
+        template = os.path.join(tmp, "seeded.db")
+        _seed(template, args.students)
+        baseline = os.path.join(tmp, "baseline.db")
+        labels = ["fresh", "warm"]
+        if _baseline_db(args.baseline_rev, baseline, args.students, tmp):
+            labels.append("upgrade")
+
+        imports = [import_ms() for _ in range(args.runs)]
+        print(f"cores={os.cpu_count()} runs={args.runs} students={args.students}")
+        print(f"import app.main: {statistics.median(imports):.0f} ms")
+        print("| database | spawn -> /api/health ms | first /api/tasks ms |")
+        print("|----------|------------------------:|--------------------:|")
+        for label in labels:
+            rows = []
+            for i in range(args.runs):
+                db_path = os.path.join(tmp, f"{label}-{i}.db")
+                if label != "fresh":
+                    shutil.copy(template if label == "warm" else baseline, db_path)
+                rows.append(boot(db_path))
+                if label != "fresh" and rows[-1]["status"] != 200:  # fresh has no users yet
+                    raise RuntimeError(f"{label}: /api/tasks returned {rows[-1]['status']}")
+            health = statistics.median(r["health"] for r in rows)
+            tasks = statistics.median(r["tasks"] for r in rows)
+            print(f"| {label} | {health:.0f} | {tasks:.1f} |", flush=True)
+        if "upgrade" not in labels:
+            print("upgrade: skipped (git revision not available)")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
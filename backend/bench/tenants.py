@@ -0,0 +1,140 @@
+# bench/tenants.py
+"""Write throughput vs. number of school databases.
+
+Seeds S school databases in a scratch TENANT_DB_DIR and starts uvicorn on
+them. The same number of client processes then run a write-only mix
+(comments and task edits) for a fixed time, spread round-robin over the
+first T schools. Each T in --tenants is one run.
+
+    cd backend
+    python -m bench.tenants --tenants 1 2 4 --clients 8 --workers 2 --seconds 15
+
+With T=1 every write queues on one SQLite lock. With T=4 the writes go to
+four files with four locks. "busy" counts 5xx responses (lock timeouts).
+"""
+from __future__ import annotations
+
+import argparse
+import http.client
+import json
+import multiprocessing as mp
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench.scale_workers import BACKEND, _free_port, _wait_ready
+
+WRITERS = ["paddy", "ulf", "una"]
+
+
+def _seed(tenant_dir: str, tenants: list) -> None:
+    env = {**os.environ, "TENANT_DB_DIR": tenant_dir, "DATABASE_URL": f"sqlite:///{tenant_dir}/main.db"}
+    args = [a for t in tenants for a in ("--tenant", t)]
+    subprocess.run(
+        [sys.executable, "-m", "app.seed", "--reset", "--big", "60", *args],
+        cwd=BACKEND, env=env, check=True, stdout=subprocess.DEVNULL,
+    )
+
+
+def _client(port: int, seconds: float, tenants: list, seed: int, out: "mp.Queue") -> None:
+    rnd = random.Random(seed)
+    tenant = tenants[seed % len(tenants)]
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    lat, busy = [], 0
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        tid = rnd.randint(1, 40)
+        if rnd.random() < 0.7:
+            method, path, body = "POST", f"/api/tasks/{tid}/comments", json.dumps({"text": "bench"})
+        else:
+            method, path, body = "PATCH", f"/api/tasks/{tid}", json.dumps({"body": f"bench {rnd.random()}"})
+        headers = {"X-User": "paddy", "X-Tenant": tenant, "Content-Type": "application/json"}
+        t0 = time.perf_counter()
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            resp = conn.getresponse()
+            resp.read()
+            if resp.status >= 500:
+                busy += 1
+                continue
+        except (OSError, http.client.HTTPException):
+            busy += 1
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+            continue
+        lat.append(time.perf_counter() - t0)
+    out.put((lat, busy))
+
+
+def run(tenants: int, clients: int, workers: int, seconds: float, template_dir: str) -> dict:
+    tmp = tempfile.mkdtemp(prefix="bench-tenants-")
+    tenant_dir = os.path.join(tmp, "schools")
+    shutil.copytree(template_dir, tenant_dir)
+    port = _free_port()
+    env = {
+        **os.environ,
+        "TENANT_DB_DIR": tenant_dir,
+        "DATABASE_URL": f"sqlite:///{tmp}/main.db",
+        "SCHEDULER_ENABLED": "false",
+    }
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning", "--no-access-log"],
+        cwd=BACKEND, env=env,
+    )
+    names = [f"school{i}" for i in range(tenants)]
+    try:
+        _wait_ready(port)
+        q: "mp.Queue" = mp.Queue()
+        procs = [mp.Process(target=_client, args=(port, seconds, names, i, q)) for i in range(clients)]
+        for p in procs:
+            p.start()
+        results = [q.get() for _ in procs]
+        for p in procs:
+            p.join()
+    finally:
+        server.terminate()
+        server.wait(10)
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    lat = sorted(x for r in results for x in r[0])
+    pct = lambda p: lat[min(len(lat) - 1, int(p * len(lat)))] * 1000 if lat else float("nan")
+    return {
+        "tenants": tenants,
+        "wps": len(lat) / seconds,
+        "p50": pct(0.50),
+        "p99": pct(0.99),
+        "busy": sum(r[1] for r in results),
+    }
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    ap.add_argument("--tenants", type=int, nargs="+", default=[1, 2, 4])
+    ap.add_argument("--clients", type=int, default=8)
+    ap.add_argument("--workers", type=int, default=2)
+    ap.add_argument("--seconds", type=float, default=15.0)
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="bench-tenants-seed-")
+    template = os.path.join(tmp, "schools")
+    _seed(template, [f"school{i}" for i in range(max(args.tenants))])
+    for f in os.listdir(template):
+        if not f.endswith(".db"):
+            os.remove(os.path.join(template, f))
+    print(f"cores={os.cpu_count()} clients={args.clients} workers={args.workers} seconds={args.seconds}")
+    print("| schools | writes/s | p50 ms | p99 ms | busy |")
+    print("|--------:|---------:|-------:|-------:|-----:|")
+    try:
+        for t in args.tenants:
+            r = run(t, args.clients, args.workers, args.seconds, template)
+            print(f"| {r['tenants']} | {r['wps']:.0f} | {r['p50']:.1f} | {r['p99']:.1f} | {r['busy']} |", flush=True)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
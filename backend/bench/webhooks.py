@@ -0,0 +1,183 @@
+# bench/webhooks.py
+"""Webhook delivery throughput and latency against a local stand-in receiver.
+
+Seeds a scratch database, then starts a threaded HTTP receiver on
+localhost. The receiver checks every signature and can fail a share of
+requests with 503. The app's Dispatcher delivers to it while this process
+writes task events in small transactions, the same way the API does.
+
+    cd backend
+    python -m bench.webhooks --events 2000 --batch 1 10 100 --endpoints 2 --fail-rate 0.1
+
+Latency is commit of the event -> first accepted delivery. Throughput is
+delivered events per second per endpoint. The run fails if any endpoint
+sees an event out of order or a bad signature.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+BACKEND = Path(__file__).resolve().parents[1]
+SECRET = "bench-secret"
+
+
+class Receiver:
+    def __init__(self, fail_rate: float):
+        self.fail_rate = fail_rate
+        self.lock = threading.Lock()
+        self.accepted = {}      # endpoint -> [(recv time, [outbox ids], [event ids])]
+        self.rejected = 0
+        self.bad_signatures = 0
+        recv = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                from app.webhooks import verify
+
+                now = time.perf_counter()
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                if not verify(SECRET, self.headers.get("X-Webhook-Signature", ""), body):
+                    with recv.lock:
+                        recv.bad_signatures += 1
+                    self.send_response(401)
+                elif random.random() < recv.fail_rate:
+                    with recv.lock:
+                        recv.rejected += 1
+                    self.send_response(503)
+                else:
+                    doc = json.loads(body)
+                    with recv.lock:
+                        recv.accepted.setdefault(doc["endpoint"], []).append((
+                            now,
+                            [e["outbox_id"] for e in doc["events"]],
+                            [e["id"] for e in doc["events"]],
+                        ))
+                    self.send_response(204)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/hook"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def delivered(self, endpoint: str) -> int:
+        with self.lock:
+            return sum(len(ids) for _, ids, _ in self.accepted.get(endpoint, []))
+
+
+def produce(n: int, per_tx: int, committed: dict) -> None:
+    """Write n task events, per_tx per transaction; record commit time per event id."""
+    from app.db import SessionLocal
+    from app.models import Task, TaskEvent, TaskEventType
+
+    with SessionLocal() as db:
+        task_ids = [t for (t,) in db.query(Task.id)]
+        written = 0
+        while written < n:
+            batch = [
+                TaskEvent(task_id=random.choice(task_ids), type=TaskEventType.EDIT,
+                          meta={"bench": written + i}, actor_user_id=1)
+                for i in range(min(per_tx, n - written))
+            ]
+            db.add_all(batch)
+            db.flush()
+            ids = [e.id for e in batch]
+            db.commit()
+            t = time.perf_counter()
+            for eid in ids:
+                committed[eid] = t
+            written += len(batch)
+            db.expunge_all()
+
+
+def run(batch: int, events: int, endpoints: int, fail_rate: float, per_tx: int) -> list:
+    from app.config import WebhookEndpoint, settings
+    from app.webhooks import Dispatcher
+
+    settings.WEBHOOK_BATCH_SIZE = batch
+    settings.WEBHOOK_BACKOFF_BASE_SECONDS = 0.05
+    settings.WEBHOOK_BACKOFF_MAX_SECONDS = 0.5
+    settings.WEBHOOK_MAX_ATTEMPTS = 1000
+    recv = Receiver(fail_rate)
+    names = [f"bench-{batch}-{i}" for i in range(endpoints)]
+    disp = Dispatcher([WebhookEndpoint(name=n, url=recv.url, secret=SECRET) for n in names])
+    disp.start()
+    # Let every endpoint create its cursor at the current head first
+    deadline = time.time() + 10
+    while time.time() < deadline and not all(disp._cursor(n) for n in names):
+        time.sleep(0.05)
+    committed: dict = {}
+    t0 = time.perf_counter()
+    produce(events, per_tx, committed)
+    try:
+        deadline = time.time() + 300
+        while any(recv.delivered(n) < events for n in names):
+            if time.time() > deadline:
+                raise RuntimeError("delivery timed out")
+            time.sleep(0.02)
+    finally:
+        disp.stop()
+        recv.server.shutdown()
+
+    rows = []
+    for n in names:
+        got = recv.accepted[n]
+        outbox = [i for _, ids, _ in got for i in ids]
+        if outbox != sorted(outbox) or len(set(outbox)) != len(outbox):
+            raise RuntimeError(f"{n}: events out of order or duplicated")
+        lat = sorted(t - committed[eid] for t, _, eids in got for eid in eids)
+        end = max(t for t, _, _ in got)
+        pct = lambda p, lat=lat: lat[min(len(lat) - 1, int(p * len(lat)))] * 1000
+        rows.append({
+            "endpoint": n, "batch": batch, "events": len(outbox),
+            "eps": len(outbox) / (end - t0), "requests": len(got),
+            "p50": pct(0.50), "p99": pct(0.99), "max": lat[-1] * 1000,
+        })
+    if recv.bad_signatures:
+        raise RuntimeError(f"{recv.bad_signatures} requests with bad signatures")
+    if recv.rejected:
+        print(f"(batch {batch}: {recv.rejected} requests failed with 503 and were retried)")
+    return rows
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    ap.add_argument("--events", type=int, default=2000)
+    ap.add_argument("--batch", type=int, nargs="+", default=[1, 10, 100])
+    ap.add_argument("--endpoints", type=int, default=2)
+    ap.add_argument("--fail-rate", type=float, default=0.0)
+    ap.add_argument("--per-tx", type=int, default=1, help="events per write transaction")
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="bench-webhooks-")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp, 'app.db')}"
+    os.environ["SCHEDULER_ENABLED"] = "false"
+    sys.path.insert(0, str(BACKEND))
+    from app import seed
+    seed.do_reset_and_seed(0)
+
+    print(f"cores={os.cpu_count()} events={args.events} endpoints={args.endpoints} "
+          f"fail_rate={args.fail_rate} per_tx={args.per_tx}")
+    print("| batch | endpoint | events | requests | events/s | p50 ms | p99 ms | max ms |")
+    print("|------:|----------|-------:|---------:|---------:|-------:|-------:|-------:|")
+    for b in args.batch:
+        for r in run(b, args.events, args.endpoints, args.fail_rate, args.per_tx):
+            print(f"| {r['batch']} | {r['endpoint']} | {r['events']} | {r['requests']} | {r['eps']:.0f} "
+                  f"| {r['p50']:.1f} | {r['p99']:.1f} | {r['max']:.1f} |", flush=True)
+
+
+if __name__ == "__main__":
+    main()